@@ -5,6 +5,8 @@
     2) Attack Suite
     3) Attack
     4) Input Format
+    5) Attack Metrics
+    6) Attack Scheduler
 
     In this module, we have the backend entities to represent and structure our code
     And these entities have the following relations in between: (Connection endpoints represent cardinality of entity)
@@ -12,4 +14,6 @@
     - Protocol      1----------*    Attack Suite
     - Attack suite  1----------*    Attack
     - Attack        1----------*    Input format
+    - Attack        1----------1    Attack metrics
+    - Attack suite  1----------1    Attack scheduler
 """
\ No newline at end of file
@@ -1,5 +1,6 @@
 import logging
 
+from Entity.metrics import AttackMetrics
 from GUI import hard_coded_texts as hct
 
 
@@ -17,6 +18,8 @@ class Attack(object):
             self.logger = logging.getLogger(hct.get_logger_name())
         else:
             self.logger = logging.getLogger("Default logger")
+        # Counters, gauges and histograms which attacks update while running
+        self.metrics = AttackMetrics(name)
 
         # Load default parameters into input format values
         self.load_default_parameters()
@@ -61,10 +64,23 @@ class Attack(object):
             if _input.get_name() == input_name:
                 setattr(self, _input.get_name(), _input.get_value())
 
+    def get_metrics(self):
+        """
+        :rtype: AttackMetrics
+        """
+        return self.metrics
+
+    def export_metrics(self):
+        """
+        :return: Metrics of the last run in Prometheus text exposition format
+        """
+        return self.metrics.export_text()
+
     def run(self):
         # Set all the input values of the class, then show begins
         for _input in self.inputs:
             setattr(self, _input.get_name(), _input.get_value())
+        self.metrics.start()
         # Will be filled by inherited class
 
     def stop_attack(self):
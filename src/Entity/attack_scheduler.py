@@ -0,0 +1,277 @@
+import logging
+import multiprocessing
+import os
+import Queue
+import signal
+import threading
+import time
+import traceback
+import unittest
+
+from Entity import metrics as metrics_util
+from Entity.attack import Attack
+
+logger = logging.getLogger("Attack Scheduler")
+
+ATTACK_COMPLETED = "completed"
+ATTACK_FAILED = "failed"
+ATTACK_TIMED_OUT = "timed out"
+ATTACK_ABORTED = "aborted"  # Stopped by the liveness monitor since target went down
+
+DEFAULT_MAX_PARALLELISM = multiprocessing.cpu_count()
+# Time given to an attack to stop itself after its timeout, then its process is killed
+STOP_GRACE_PERIOD = 5
+POLL_INTERVAL = 0.1
+
+
+class AttackResult(object):
+    """
+    Outcome of an attack which is run by the scheduler
+    Metrics are the snapshot and Prometheus text export taken in the attack process when it finished.
+    Health transitions of the target are only recorded for attacks which are run with a liveness monitor.
+    """
+
+    def __init__(self, attack_name, status, error=None, metrics=None, metrics_text="", elapsed_time=0.,
+                 health_transitions=None):
+        self.attack_name = attack_name
+        self.status = status
+        self.error = error
+        self.metrics = metrics if metrics is not None else {}
+        self.metrics_text = metrics_text
+        self.elapsed_time = elapsed_time
+        self.health_transitions = health_transitions if health_transitions is not None else []
+
+    def get_attack_name(self):
+        return self.attack_name
+
+    def get_status(self):
+        return self.status
+
+    def get_error(self):
+        return self.error
+
+    def get_metrics(self):
+        return self.metrics
+
+    def get_metrics_text(self):
+        return self.metrics_text
+
+    def get_elapsed_time(self):
+        return self.elapsed_time
+
+    def get_health_transitions(self):
+        """
+        :return: List of dictionaries with timestamp, state, case index and reason of each transition
+        """
+        return self.health_transitions
+
+    def is_successful(self):
+        return self.status == ATTACK_COMPLETED
+
+
+def run_attack_process(index, attack, result_queue, liveness=None):
+    """
+    Entry point of an attack process, result of the attack is put into the queue with its index
+    SIGTERM is used as the stop request, so a timed out attack can stop gracefully and still report its metrics.
+    :param liveness: Settings of the liveness monitor which runs beside the attack, see create_monitor
+    """
+    stop_requested = []
+
+    def stop(signum, frame):
+        # Handler interrupts the attack wherever it is, stop_attack sleeps so it is run by a helper thread
+        if not stop_requested:
+            stop_requested.append(signum)
+            stopper = threading.Thread(target=attack.stop_attack, name="Attack Stopper")
+            stopper.daemon = True
+            stopper.start()
+
+    signal.signal(signal.SIGTERM, stop)
+    # Restart system calls which the stop request interrupts, select is never restarted so attacks retry it
+    signal.siginterrupt(signal.SIGTERM, False)
+    start_time = time.time()
+    error = None
+    monitor = None
+    try:
+        if liveness is not None:
+            # Probes depend on protocol packages, so they are only imported by the attacks which are monitored
+            from Utils.MonitorUtil.liveness_monitor import create_monitor
+            monitor = create_monitor(liveness, attack)
+            monitor.start()
+        attack.run()
+    except Exception:
+        error = traceback.format_exc()
+    if monitor is not None:
+        monitor.stop()
+    if monitor is not None and monitor.is_aborted():
+        status = ATTACK_ABORTED
+    elif stop_requested:
+        status = ATTACK_TIMED_OUT
+    else:
+        status = ATTACK_COMPLETED if error is None else ATTACK_FAILED
+    metrics = attack.get_metrics()
+    health_transitions = [_.to_dict() for _ in monitor.get_transitions()] if monitor is not None else None
+    result_queue.put((index, AttackResult(attack.get_attack_name(), status, error, metrics.get_snapshot(),
+                                          metrics.export_text(), time.time() - start_time, health_transitions)))
+
+
+class AttackScheduler(object):
+    """
+    Run attacks concurrently, each of them in its own process
+    At most max_parallelism attacks run at the same time, remaining ones wait for a free slot in the given order.
+    """
+
+    def __init__(self, attacks, max_parallelism=DEFAULT_MAX_PARALLELISM, timeout=None, timeouts=None,
+                 liveness=None, stop_grace_period=STOP_GRACE_PERIOD):
+        """
+        :param timeout: Default timeout in seconds of the attacks, None means that they are never stopped
+        :param timeouts: Dictionary of attack indexes or names to their timeouts which overrides the default one
+        :param liveness: Dictionary of attack indexes or names to the settings of their liveness monitors
+        :param stop_grace_period: Seconds given to a timed out attack to stop itself before it is killed
+        """
+        self.attacks = attacks
+        self.stop_grace_period = stop_grace_period
+        self.max_parallelism = max(1, max_parallelism or 1)
+        self.timeout = timeout
+        self.timeouts = timeouts if timeouts is not None else {}
+        self.liveness = liveness if liveness is not None else {}
+
+    def get_timeout(self, index, attack):
+        return self.timeouts.get(index, self.timeouts.get(attack.get_attack_name(), self.timeout))
+
+    def get_liveness(self, index, attack):
+        return self.liveness.get(index, self.liveness.get(attack.get_attack_name()))
+
+    def run(self):
+        """
+        :return: List of attack results in the order of the attacks
+        """
+        result_queue = multiprocessing.Queue()
+        results = [None] * len(self.attacks)
+        pending = list(enumerate(self.attacks))
+        # Index of the attack to its process, start time, deadline and kill time
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self.max_parallelism:
+                    index, attack = pending.pop(0)
+                    process = multiprocessing.Process(target=run_attack_process, name=attack.get_attack_name(),
+                                                      args=(index, attack, result_queue,
+                                                            self.get_liveness(index, attack)))
+                    process.daemon = True
+                    process.start()
+                    timeout = self.get_timeout(index, attack)
+                    start_time = time.time()
+                    deadline = start_time + timeout if timeout is not None else None
+                    running[index] = [process, start_time, deadline, None]
+                    logger.info("{0} is started.".format(attack.get_attack_name()))
+
+                # Results are drained before joining, a process does not exit until its queued result is consumed
+                self._drain(result_queue, results)
+
+                now = time.time()
+                for index in list(running):
+                    process, start_time, deadline, kill_time = running[index]
+                    attack_name = self.attacks[index].get_attack_name()
+                    if results[index] is None and not process.is_alive():
+                        # Result may have been queued right before the process has exited
+                        self._drain(result_queue, results)
+                    if results[index] is not None or not process.is_alive():
+                        process.join()
+                        if results[index] is None:
+                            results[index] = AttackResult(attack_name, ATTACK_FAILED,
+                                                          "Attack process has exited with code {0}".format(
+                                                              process.exitcode), elapsed_time=now - start_time)
+                        logger.info("{0} is {1}.".format(attack_name, results[index].get_status()))
+                        del running[index]
+                    elif kill_time is not None and now >= kill_time:
+                        os.kill(process.pid, signal.SIGKILL)
+                        process.join()
+                        results[index] = AttackResult(attack_name, ATTACK_TIMED_OUT, elapsed_time=now - start_time)
+                        logger.info("{0} is killed since it has not stopped after its timeout.".format(attack_name))
+                        del running[index]
+                    elif deadline is not None and kill_time is None and now >= deadline:
+                        logger.info("{0} has timed out, it is being stopped.".format(attack_name))
+                        process.terminate()
+                        running[index][3] = now + self.stop_grace_period
+        finally:
+            for process in [_[0] for _ in running.values()]:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGKILL)
+                    process.join()
+        return results
+
+    @staticmethod
+    def _drain(result_queue, results):
+        """
+        Consume the results which are queued by attack processes
+        """
+        while True:
+            try:
+                index, result = result_queue.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                return
+            results[index] = result
+
+
+class TestAttackScheduler(unittest.TestCase):
+    class LoopingAttack(Attack):
+        """
+        Sends until it is stopped, unless it ignores stop requests, or fails right after it starts
+        """
+
+        def __init__(self, name, ignore_stop=False, error=None, exit_code=None):
+            Attack.__init__(self, name, [], [], "Test attack")
+            self.ignore_stop = ignore_stop
+            self.error = error
+            self.exit_code = exit_code
+            self.stopped_flag = False
+
+        def run(self):
+            Attack.run(self)
+            messages_sent = self.metrics.counter(metrics_util.MESSAGES_SENT)
+            if self.error is not None:
+                raise self.error
+            if self.exit_code is not None:
+                os._exit(self.exit_code)
+            while not self.stopped_flag:
+                messages_sent.inc()
+                time.sleep(0.01)
+            self.metrics.finish()
+
+        def stop_attack(self):
+            if self.ignore_stop:
+                return
+            self.metrics.gauge("stopped_in_main_thread").set(
+                int(threading.current_thread().name == "MainThread"))
+            self.stopped_flag = True
+            time.sleep(2)
+
+    def test_timeout(self):
+        result = AttackScheduler([self.LoopingAttack("Looping")], timeout=0.5).run()[0]
+        self.assertEqual(ATTACK_TIMED_OUT, result.get_status())
+        self.assertIsNone(result.get_error())
+        self.assertGreater(result.get_metrics()[metrics_util.MESSAGES_SENT], 0)
+        self.assertEqual(0, result.get_metrics()["stopped_in_main_thread"])
+        self.assertIn("peniot_messages_sent_total", result.get_metrics_text())
+        # Stop request is handled without waiting for stop_attack to return
+        self.assertLess(result.get_elapsed_time(), 2)
+
+    def test_kill(self):
+        start_time = time.time()
+        result = AttackScheduler([self.LoopingAttack("Stubborn", ignore_stop=True)], timeout=0.2,
+                                 stop_grace_period=0.5).run()[0]
+        self.assertEqual(ATTACK_TIMED_OUT, result.get_status())
+        self.assertEqual({}, result.get_metrics())
+        self.assertLess(time.time() - start_time, STOP_GRACE_PERIOD)
+
+    def test_failure(self):
+        results = AttackScheduler([self.LoopingAttack("Failing", error=ValueError("Target is unreachable")),
+                                   self.LoopingAttack("Exiting", exit_code=3)], max_parallelism=2).run()
+        self.assertEqual([ATTACK_FAILED, ATTACK_FAILED], [result.get_status() for result in results])
+        self.assertIn("ValueError: Target is unreachable", results[0].get_error())
+        self.assertEqual(0, results[0].get_metrics()[metrics_util.MESSAGES_SENT])
+        self.assertEqual("Attack process has exited with code 3", results[1].get_error())
+
+
+if __name__ == '__main__':
+    unittest.main()
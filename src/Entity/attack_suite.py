@@ -1,7 +1,11 @@
+from Entity.attack_scheduler import AttackScheduler, DEFAULT_MAX_PARALLELISM
+
+
 class AttackSuite(object):
 
     name = None
     attacks = []
+    results = []
 
     def __init__(self, name, attacks):
         self.name = name
@@ -25,6 +29,16 @@ class AttackSuite(object):
         if self.attacks is not None:
             self.attacks.append(attack)
 
-    def run(self):
-        for attack in self.attacks:
-            attack.run()
+    def run(self, max_parallelism=DEFAULT_MAX_PARALLELISM, timeout=None, timeouts=None):
+        """
+        Run the attacks concurrently, each one in its own process
+        :param max_parallelism: Maximum number of attacks running at the same time
+        :param timeout: Default timeout of the attacks in seconds, None means that they are never stopped
+        :param timeouts: Dictionary of attack names to their timeouts which overrides the default one
+        :return: List of attack results with their metrics in the order of the attacks
+        """
+        self.results = AttackScheduler(self.attacks, max_parallelism, timeout, timeouts).run()
+        return self.results
+
+    def get_results(self):
+        return self.results
@@ -0,0 +1,269 @@
+import bisect
+import threading
+import time
+import unittest
+
+# Common metric names which attacks update, so runs of different attacks can be compared
+MESSAGES_SENT = "messages_sent_total"
+BYTES_SENT = "bytes_sent_total"
+ERRORS = "errors_total"
+RESPONSES_RECEIVED = "responses_received_total"
+TIMEOUTS = "timeouts_total"
+PACKETS_CAPTURED = "packets_captured_total"
+SEND_RATE = "send_rate"
+RESPONSE_TIME = "response_time_seconds"
+
+METRIC_PREFIX = "peniot_"
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_sample_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(int(value))
+
+
+class Counter(object):
+    """
+    Monotonically increasing value, e.g. number of sent messages
+    Updates are plain attribute increments so they are cheap enough for the hot path of attacks.
+    """
+    metric_type = "counter"
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get_value(self):
+        return self.value
+
+    def reset(self):
+        self.value = 0
+
+    def get_samples(self):
+        return [("", {}, self.value)]
+
+
+class Gauge(Counter):
+    """
+    Value which can go up and down, e.g. number of outstanding requests
+    """
+    metric_type = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram(object):
+    """
+    Distribution of observed values over fixed buckets, e.g. response round trip times
+    """
+    metric_type = "histogram"
+
+    def __init__(self, name, description="", buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # Last one is for values above all bounds
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_value(self):
+        """
+        :return: Mean of the observed values
+        """
+        return self.sum / self.count if self.count > 0 else 0.
+
+    def get_quantile(self, quantile):
+        """
+        :return: Upper bound of the bucket which contains given quantile
+        """
+        if self.count == 0:
+            return 0.
+        rank = quantile * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def reset(self):
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def get_samples(self):
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), self.bucket_counts):
+            cumulative += bucket_count
+            samples.append(("_bucket", {"le": format_sample_value(bound)}, cumulative))
+        samples.append(("_sum", {}, self.sum))
+        samples.append(("_count", {}, self.count))
+        return samples
+
+
+class AttackMetrics(object):
+    """
+    Metric registry of a single attack
+    Metrics are created on first use and kept across calls, so attacks can hold references to them
+    and update them without any lookup. Send rate is derived from sent message count and elapsed time.
+    """
+
+    def __init__(self, attack_name):
+        self.attack_name = attack_name
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.end_time = None
+
+    def _get_or_create(self, metric_class, name, *args):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = metric_class(name, *args)
+                    self.metrics[name] = metric
+        return metric
+
+    def counter(self, name, description=""):
+        """
+        :rtype: Counter
+        """
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name, description=""):
+        """
+        :rtype: Gauge
+        """
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name, description="", buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        :rtype: Histogram
+        """
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    def start(self):
+        """
+        Reset all metrics for a new run of the attack
+        """
+        for metric in self.metrics.values():
+            metric.reset()
+        self.start_time = time.time()
+        self.end_time = None
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def get_elapsed_time(self):
+        if self.start_time is None:
+            return 0.
+        return (self.end_time or time.time()) - self.start_time
+
+    def get_send_rate(self):
+        elapsed = self.get_elapsed_time()
+        sent = self.metrics.get(MESSAGES_SENT)
+        return sent.get_value() / elapsed if sent is not None and elapsed > 0 else 0.
+
+    def get_snapshot(self):
+        """
+        :return: Dictionary of metric names to their current values, histograms are represented by their mean
+        """
+        snapshot = dict((name, metric.get_value()) for name, metric in self.metrics.items())
+        snapshot[SEND_RATE] = self.get_send_rate()
+        return snapshot
+
+    def export_text(self):
+        """
+        Export metrics in Prometheus text exposition format
+        :return: Metrics as text where each sample is labelled with the attack name
+        """
+        attack_label = self.attack_name.replace("\\", "\\\\").replace("\"", "\\\"")
+        lines = []
+        rate = Gauge(SEND_RATE, "Sent messages per second since the attack has started")
+        rate.set(self.get_send_rate())
+        for metric in sorted(self.metrics.values(), key=lambda _: _.name) + [rate]:
+            name = METRIC_PREFIX + metric.name
+            if metric.description:
+                lines.append("# HELP {0} {1}".format(name, metric.description))
+            lines.append("# TYPE {0} {1}".format(name, metric.metric_type))
+            for suffix, labels, value in metric.get_samples():
+                label_text = ",".join(["attack=\"{0}\"".format(attack_label)] +
+                                      ["{0}=\"{1}\"".format(label_name, label_value)
+                                       for label_name, label_value in sorted(labels.items())])
+                lines.append("{0}{1}{{{2}}} {3}".format(name, suffix, label_text, format_sample_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class TestAttackMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = AttackMetrics("Test \"Quoted\" Attack")
+
+    def test_snapshot(self):
+        sent = self.metrics.counter(MESSAGES_SENT, "Sent messages")
+        outstanding = self.metrics.gauge("outstanding_requests")
+        self.metrics.start()
+        sent.inc()
+        sent.inc(4)
+        outstanding.inc(3)
+        outstanding.dec()
+        self.metrics.histogram(RESPONSE_TIME).observe(0.5)
+        self.metrics.histogram(RESPONSE_TIME).observe(1.5)
+        self.metrics.finish()
+        self.metrics.end_time = self.metrics.start_time + 2.
+
+        # Metrics are created once and the same instance is returned afterwards
+        self.assertIs(sent, self.metrics.counter(MESSAGES_SENT))
+        snapshot = self.metrics.get_snapshot()
+        self.assertEqual(5, snapshot[MESSAGES_SENT])
+        self.assertEqual(2, snapshot["outstanding_requests"])
+        self.assertEqual(1.0, snapshot[RESPONSE_TIME])
+        self.assertEqual(2.5, snapshot[SEND_RATE])
+
+        outstanding.set(7)
+        self.assertEqual(7, self.metrics.get_snapshot()["outstanding_requests"])
+        # A new run starts from zero
+        self.metrics.start()
+        self.assertEqual(0, self.metrics.get_snapshot()[MESSAGES_SENT])
+
+    def test_export_text(self):
+        self.metrics.counter(MESSAGES_SENT, "Sent messages").inc(3)
+        self.metrics.histogram(RESPONSE_TIME, buckets=(0.1, 1.0)).observe(0.5)
+        lines = self.metrics.export_text().splitlines()
+
+        label = "attack=\"Test \\\"Quoted\\\" Attack\""
+        self.assertEqual([
+            "# HELP peniot_messages_sent_total Sent messages",
+            "# TYPE peniot_messages_sent_total counter",
+            "peniot_messages_sent_total{%s} 3" % label,
+            "# TYPE peniot_response_time_seconds histogram",
+            "peniot_response_time_seconds_bucket{%s,le=\"0.1\"} 0" % label,
+            "peniot_response_time_seconds_bucket{%s,le=\"1.0\"} 1" % label,
+            "peniot_response_time_seconds_bucket{%s,le=\"+Inf\"} 1" % label,
+            "peniot_response_time_seconds_sum{%s} 0.5" % label,
+            "peniot_response_time_seconds_count{%s} 1" % label,
+            "# HELP peniot_send_rate Sent messages per second since the attack has started",
+            "# TYPE peniot_send_rate gauge",
+            "peniot_send_rate{%s} 0.0" % label,
+        ], lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
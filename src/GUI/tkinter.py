@@ -1,3 +1,4 @@
+import collections
 import logging
 import tkFileDialog
 import ttk
@@ -6,15 +7,23 @@ from threading import Timer
 from custom_widgets import *
 from hard_coded_texts import *
 from utils import *
-from Entity.attack import Attack
-from Entity.attack_suite import AttackSuite
 from Utils import CommonUtil
 from Utils.ExtendUtil.export_util import ExportUtil, ExportOptions
 from Utils.ExtendUtil.import_util import ImportUtil, ImportOptions
+from Utils.ExtendUtil.plugin_index import AttackEntry, AttackSuiteEntry
 from Utils.ReportUtil.report_generator import GenerateReport
 
 root = None
 
+# Milliseconds between two updates of live attack metrics
+METRICS_REFRESH_INTERVAL = 1000
+# Milliseconds between two updates of attack console, i.e. console is redrawn at most 20 times per second
+CONSOLE_REFRESH_INTERVAL = 50
+# Console keeps only the latest lines, older ones are discarded
+CONSOLE_MAX_LINES = 5000
+# Writes which wait for the console, a write may hold any number of lines so they are capped separately
+CONSOLE_MAX_PENDING_WRITES = 5000
+
 
 class HomePage(Frame):
     """
@@ -502,7 +511,7 @@ class AttacksPage(Frame):
         row_index = 1
         # Create a button for each attack
         for attack_suite in attacks_suites:
-            if isinstance(attack_suite, Attack):
+            if isinstance(attack_suite, AttackEntry):
                 # Create the button for the attack
                 CustomButton(self, attack_suite.get_attack_name(),
                              lambda selected_attack=attack_suite: change_frame(self,
@@ -513,7 +522,7 @@ class AttacksPage(Frame):
                              row_index)
                 # Increment the row index
                 row_index = row_index + 1
-            elif isinstance(attack_suite, AttackSuite):
+            elif isinstance(attack_suite, AttackSuiteEntry):
                 # Create the button for the attack suite
                 CustomButton(self, attack_suite.get_attack_suite_name(),
                              lambda selected_attack_suite=attack_suite: change_frame(self,
@@ -786,6 +795,10 @@ class AttackReportingPage(Frame):
         self.console = Text(self)
         self.console.grid(row=1, columnspan=2, sticky="nsew")
         self.console.configure(background=console_background_color, foreground=console_foreground_color, wrap='word')
+        # Attack thread only appends its output here, console is updated from the main loop in batches.
+        # Appending to a bounded deque is thread-safe and drops the oldest writes if the console falls behind.
+        self.pending_output = collections.deque(maxlen=CONSOLE_MAX_PENDING_WRITES)
+        self.drain_console()
         # Change the default output stream
         sys.stdout = self
         # Change the default input stream
@@ -807,15 +820,44 @@ class AttackReportingPage(Frame):
         # Stop the attack and back to menu button
         CustomButton(self, stop_attack_go_back, lambda: self.attack_stopper(), 2, 1, None, 0)
         CustomButton(self, generate_report, lambda: self.report_generator(), 2, 1, None, 1)
+        # Live metrics of the attack
+        self.metrics_label = CustomLabel(self, text="", row=3, column=0, columnspan=2)
+        self.metrics_label.configure(background=window_background_color)
+        self.refresh_metrics()
         # Make it visible
         self.grid()
 
-    # Override write function
+    def refresh_metrics(self):
+        # Page may be destroyed by navigating away
+        if not self.winfo_exists():
+            return
+        snapshot = self.attack.get_metrics().get_snapshot()
+        self.metrics_label.configure(text="   ".join(
+            "{0}: {1}".format(name, "{0:.2f}".format(value) if isinstance(value, float) else value)
+            for name, value in sorted(snapshot.items())))
+        self.after(METRICS_REFRESH_INTERVAL, self.refresh_metrics)
+
+    # Override write function, it is called from the attack thread so it must not touch the widgets
     def write(self, text):
-        self.console.insert(END, str(text))
-        # Change the state of the console to Disabled so that nobody can write
-        # Update the tasks so that the user can see the logs
-        self.update_idletasks()
+        self.pending_output.append(str(text))
+
+    def drain_console(self):
+        # Page may be destroyed by navigating away
+        if not self.winfo_exists():
+            return
+        # Only take what is there now, so a fast writer cannot keep the main loop busy
+        chunks = [self.pending_output.popleft() for _ in range(len(self.pending_output))]
+        if len(chunks) > 0:
+            text = "".join(chunks)
+            # Lines which would be trimmed right away are not inserted at all
+            if text.count("\n") > CONSOLE_MAX_LINES:
+                text = "\n".join(text.split("\n")[-CONSOLE_MAX_LINES - 1:])
+            self.console.insert(END, text)
+            line_count = int(self.console.index("end-1c").split(".")[0])
+            if line_count > CONSOLE_MAX_LINES:
+                self.console.delete("1.0", "{0}.0".format(line_count - CONSOLE_MAX_LINES + 1))
+            self.console.see(END)
+        self.after(CONSOLE_REFRESH_INTERVAL, self.drain_console)
 
     # Override readline function
     def readline(self):
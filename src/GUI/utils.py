@@ -1,12 +1,10 @@
 # This file contains methods which are used in the GUI.
-import importlib
-import inspect
 import os
-import pkgutil
 import shutil
 
 from Tkinter import *
 from hard_coded_texts import project_title, window_size, window_background_color
+from Utils.ExtendUtil import plugin_index
 from Utils.ExtendUtil.import_util import ImportUtil
 
 # list of default protocols
@@ -73,93 +71,17 @@ def pop_up_window(root, protocol_name, definition, justify=LEFT):
 def get_protocols():
     """
     it simply searches for the subclasses of Protocol class and returns the all protocols
+    Protocols are served from the plugin index, hence their modules are only imported when they are used.
     """
-    # Available protocols
-    protocols = []
-    # Base package to start searching for protocols
-    packages = ["src.protocols"]
-    # Continue to search until no package is available
-    while len(packages) > 0:
-        # Get the package
-        package = packages.pop()
-        # Get the package module
-        package_module = importlib.import_module(package)
-        prefix = package_module.__name__ + "."
-        for finder, name, ispkg in pkgutil.iter_modules(package_module.__path__, prefix):
-            # If it is a package, add it to the package list
-            if ispkg:
-                packages.append(name)
-            else:
-                # For some modules, we may have errors, skip those errors for now
-                try:
-                    mod = importlib.import_module(name)
-                except ImportError:
-                    continue
-                for tname, klass in inspect.getmembers(mod):
-                    if inspect.isclass(klass):
-                        # If the class inherits from Protocol class, simply add it to the protocol list
-                        if "Protocol" in [c.__name__ for c in inspect.getmro(klass)[1:]]:
-                            protocols.append({"package_name": package, "protocol": klass()})
-    return protocols
+    return plugin_index.get_protocols()
 
 
 def get_attacks(package_name):
     """
     it simply searches for the subclasses of Attack class in the given package and returns the attacks
+    Attacks are served from the plugin index, an attack is only instantiated when it is selected.
     """
-    # Available attack names
-    attack_names = []
-    # Available attack suites
-    attack_suites = []
-    # Available attacks
-    attacks = []
-    # Base package to start searching for protocols
-    packages = [package_name + ".attacks"]
-    # Continue to search until no package is available
-    while len(packages) > 0:
-        # Get the package
-        package = packages.pop()
-        package_module = importlib.import_module(package)
-        prefix = package_module.__name__ + "."
-        for finder, name, ispkg in pkgutil.iter_modules(package_module.__path__, prefix):
-            # If it is a package, add it to the package list
-            if ispkg:
-                packages.append(name)
-            else:
-                try:
-                    mod = importlib.import_module(name)
-                except ImportError:
-                    continue
-                for tname, klass in inspect.getmembers(mod):
-                    if inspect.isclass(klass):
-                        # If the class inherits from Attack class, simply add it to the attack list
-                        if "Attack" in [c.__name__ for c in inspect.getmro(klass)[1:]]:
-                            attack = klass()
-                            # check whether we have this attack in the list or not
-                            if not attack_names.__contains__(attack.get_attack_name()):
-                                attacks.append(attack)
-                                attack_names.append(attack.get_attack_name())
-                        # If the class inherits from AttackSuite class, simply add it to the Attack suite list
-                        if "AttackSuite" in [c.__name__ for c in inspect.getmro(klass)[1:]]:
-                            attack_suite = klass()
-                            attack_suites.append(attack_suite)
-    # Remove attack names included in the attack suites
-    for attack_suite in attack_suites:
-        for attack in attack_suite.get_attacks():
-            if attack_names.__contains__(attack.get_attack_name()):
-                attack_names.remove(attack.get_attack_name())
-    # Final list of available attacks
-    available_attacks = []
-    # Retrieve attack whose name is included in the attack name list
-    for attack in attacks:
-        for attack_name in attack_names:
-            if attack.get_attack_name() == attack_name:
-                available_attacks.append(attack)
-                break
-    # Add attack suites to the available attacks
-    for attack_suite in attack_suites:
-        available_attacks.append(attack_suite)
-    return available_attacks
+    return plugin_index.get_attacks(package_name)
 
 
 def get_captured_packet_files():
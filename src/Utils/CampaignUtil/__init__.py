@@ -0,0 +1,6 @@
+"""
+    Campaign Utilities
+    It contains necessary functionalities used for running attack campaigns from the command line
+
+    1) Campaign Runner
+"""
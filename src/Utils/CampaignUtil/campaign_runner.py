@@ -0,0 +1,328 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import time
+import unittest
+
+from Entity.attack_scheduler import AttackScheduler, AttackResult, DEFAULT_MAX_PARALLELISM, ATTACK_COMPLETED, \
+    ATTACK_TIMED_OUT
+from Utils import CommonUtil
+
+logger = logging.getLogger("Campaign Runner")
+
+EXIT_SUCCESS = 0
+EXIT_ATTACK_FAILURE = 1
+EXIT_INVALID_CAMPAIGN = 2
+
+DEFAULT_OUTPUT_DIRECTORY = "campaign_results"
+DEFAULT_TARGET_INPUT = "host"
+RESULTS_FILE_NAME = "results.json"
+METRICS_FILE_NAME = "metrics.prom"
+
+
+class CampaignError(Exception):
+    pass
+
+
+class CampaignRun(object):
+    """
+    Single attack of a campaign against a single target
+    """
+
+    def __init__(self, entry_index, class_path, target, attack, timeout, duration, liveness=None):
+        self.entry_index = entry_index
+        self.class_path = class_path
+        self.target = target
+        self.attack = attack
+        self.timeout = timeout
+        self.duration = duration
+        self.liveness = liveness
+
+    def is_passed(self, result):
+        """
+        An attack with a duration is expected to be stopped, hence timing out is its normal outcome
+        An attack which is aborted by its liveness monitor is never passed, since it took the target down
+        An attack which has raised an error is never passed, even if it was being stopped at that time
+        """
+        if result.get_error() is not None:
+            return False
+        if result.get_status() == ATTACK_COMPLETED:
+            return True
+        return self.duration is not None and result.get_status() == ATTACK_TIMED_OUT
+
+
+def load_campaign(campaign_path):
+    """
+    Campaign file is a json object with an "attacks" list and optional "concurrency", "timeout" and "output" fields
+    Each attack entry has an "attack" which is either the class path or the name of the attack, and optional
+    "inputs", "targets", "target_input", "timeout", "duration" and "liveness" fields.
+    Liveness is an object with a "protocol" (coap, mqtt or amqp) and optional "host", "port", "timeout", "interval",
+    "failure_threshold" and "action" (none, pause or abort) fields, the target of the run is probed by default.
+    """
+    try:
+        with open(campaign_path) as campaign_file:
+            campaign = json.load(campaign_file)
+    except (IOError, ValueError) as e:
+        raise CampaignError("Campaign file cannot be read: {0}".format(e))
+    if not isinstance(campaign, dict) or not isinstance(campaign.get("attacks"), list) or not campaign["attacks"]:
+        raise CampaignError("Campaign must be an object with a non empty \"attacks\" list")
+    for entry_index, entry in enumerate(campaign["attacks"]):
+        if not isinstance(entry, dict) or "attack" not in entry:
+            raise CampaignError("Attack entry {0} must be an object with an \"attack\" field".format(entry_index))
+    return campaign
+
+
+def resolve_class_path(attack):
+    """
+    Attack names are resolved with the plugin index, class paths are used as they are
+    :return: Module name and class name of the attack
+    """
+    if " " in attack or "." not in attack:
+        # Plugin index is only consulted for names, so class paths never trigger the protocol scan
+        from Utils.ExtendUtil import plugin_index
+        try:
+            protocols = plugin_index.get_protocols()
+        except ImportError as e:
+            raise CampaignError("Attack names cannot be resolved, use class paths instead: {0}".format(e))
+        for protocol in protocols:
+            for entry in plugin_index.get_attacks(protocol["package_name"]):
+                entries = entry.get_attacks() if isinstance(entry, plugin_index.AttackSuiteEntry) else [entry]
+                for attack_entry in entries:
+                    if attack_entry.get_attack_name() == attack:
+                        return attack_entry.record["module"], attack_entry.record["class_name"]
+        raise CampaignError("Unknown attack: {0}".format(attack))
+    return attack.rsplit(".", 1)
+
+
+def load_attack_class(attack):
+    module_name, class_name = resolve_class_path(attack)
+    # Protocols may be imported as a sub package of src or from the source directory itself
+    candidates = [module_name]
+    if module_name.startswith("src."):
+        candidates.append(module_name[len("src."):])
+    for candidate in candidates:
+        try:
+            module = importlib.import_module(candidate)
+        except ImportError as e:
+            error = e
+            continue
+        if not hasattr(module, class_name):
+            raise CampaignError("Module {0} has no attack named {1}".format(candidate, class_name))
+        return getattr(module, class_name)
+    raise CampaignError("Attack module {0} cannot be imported: {1}".format(module_name, error))
+
+
+def convert_input_value(_input, value):
+    """
+    Convert the value to the type of the input like the inputs page of the GUI does
+    """
+    if value is None:
+        return _input.get_default_value()
+    if _input.get_type() == bool:
+        return CommonUtil.get_boolean_value(value)
+    return _input.get_type()(value)
+
+
+def create_attack(attack_class, inputs):
+    attack = attack_class()
+    attack_inputs = dict((_input.get_name(), _input) for _input in attack.get_inputs())
+    for name, value in inputs.items():
+        if name not in attack_inputs:
+            raise CampaignError("{0} has no input named {1}".format(attack.get_attack_name(), name))
+        try:
+            attack_inputs[name].set_value(convert_input_value(attack_inputs[name], value))
+        except (TypeError, ValueError) as e:
+            raise CampaignError("Invalid value for {0} of {1}: {2}".format(name, attack.get_attack_name(), e))
+    # Mandatory inputs are checked like the inputs page of the GUI does, before any attack process starts
+    for _input in attack.get_inputs():
+        value = _input.get_value()
+        if _input.is_mandatory() and (value is None or (isinstance(value, basestring) and value.strip() == "")):
+            raise CampaignError("{0} requires a value for its mandatory input {1}".format(attack.get_attack_name(),
+                                                                                         _input.get_name()))
+    return attack
+
+
+def create_liveness(liveness, default_host):
+    """
+    :return: Liveness settings of a run whose host defaults to the target of the run
+    """
+    if not isinstance(liveness, dict) or "protocol" not in liveness:
+        raise CampaignError("Liveness must be an object with a \"protocol\" field")
+    liveness = dict(liveness)
+    liveness.setdefault("host", default_host)
+    # Probes are only created in the attack processes, invalid settings must fail before any attack starts
+    from Utils.MonitorUtil.liveness_monitor import create_monitor
+    try:
+        create_monitor(liveness)
+    except (TypeError, ValueError) as e:
+        raise CampaignError("Invalid liveness settings: {0}".format(e))
+    return liveness
+
+
+def create_runs(campaign, default_timeout=None):
+    """
+    Create an attack instance for each target of each campaign entry
+    Only the modules of the attacks in the campaign are imported.
+    :return: List of campaign runs
+    """
+    default_timeout = default_timeout if default_timeout is not None else campaign.get("timeout")
+    runs = []
+    for entry_index, entry in enumerate(campaign["attacks"]):
+        attack_class = load_attack_class(entry["attack"])
+        inputs = entry.get("inputs", {})
+        targets = entry.get("targets") or [None]
+        target_input = entry.get("target_input", DEFAULT_TARGET_INPUT)
+        duration = entry.get("duration")
+        timeout = duration if duration is not None else entry.get("timeout", default_timeout)
+        for target in targets:
+            target_inputs = dict(inputs)
+            if target is not None:
+                target_inputs[target_input] = target
+            liveness = None
+            if entry.get("liveness") is not None:
+                liveness = create_liveness(entry["liveness"], target_inputs.get(target_input))
+            runs.append(CampaignRun(entry_index, "{0}.{1}".format(attack_class.__module__, attack_class.__name__),
+                                    target, create_attack(attack_class, target_inputs), timeout, duration, liveness))
+    return runs
+
+
+def run_campaign(runs, concurrency=DEFAULT_MAX_PARALLELISM):
+    """
+    :return: List of result dictionaries in the order of the runs
+    """
+    timeouts = dict((index, run.timeout) for index, run in enumerate(runs) if run.timeout is not None)
+    liveness = dict((index, run.liveness) for index, run in enumerate(runs) if run.liveness is not None)
+    results = AttackScheduler([run.attack for run in runs], concurrency, None, timeouts, liveness).run()
+    return [{
+        "entry": run.entry_index,
+        "attack": result.get_attack_name(),
+        "class_path": run.class_path,
+        "target": run.target,
+        "status": result.get_status(),
+        "passed": run.is_passed(result),
+        "error": result.get_error(),
+        "elapsed_time": result.get_elapsed_time(),
+        "health_transitions": result.get_health_transitions(),
+        "metrics": result.get_metrics(),
+        "metrics_text": result.get_metrics_text()
+    } for run, result in zip(runs, results)]
+
+
+def write_results(results, output_directory):
+    """
+    Write results as json and metrics of all attacks in Prometheus text format
+    :return: Path of the results file
+    """
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    results_path = os.path.join(output_directory, RESULTS_FILE_NAME)
+    with open(results_path, "w") as results_file:
+        json.dump({"created_at": CommonUtil.get_current_datetime_for_report_format(), "results": results},
+                  results_file, indent=2, sort_keys=True)
+    with open(os.path.join(output_directory, METRICS_FILE_NAME), "w") as metrics_file:
+        for result in results:
+            if result["metrics_text"]:
+                metrics_file.write("# {0} -> {1}\n".format(result["attack"], result["target"]))
+                metrics_file.write(result["metrics_text"])
+    return results_path
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="Run a PENIOT attack campaign without the graphical interface")
+    parser.add_argument("campaign", help="Path of the campaign file in json format")
+    parser.add_argument("-o", "--output", help="Directory to write the results into")
+    parser.add_argument("-j", "--concurrency", type=int, help="Maximum number of attacks running at the same time")
+    parser.add_argument("-t", "--timeout", type=float, help="Default timeout of the attacks in seconds")
+    parser.add_argument("--log-level", default="INFO", help="Logging level, e.g. DEBUG, INFO or WARNING")
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point of the command line interface
+    :return: Exit code, 0 if all attacks have passed, 1 if any of them has failed and 2 for invalid campaigns
+    """
+    args = create_argument_parser().parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO),
+                        format="%(asctime)s:%(levelname)s:%(name)s : %(message)s")
+    try:
+        campaign = load_campaign(args.campaign)
+        runs = create_runs(campaign, args.timeout)
+    except CampaignError as e:
+        logger.error(str(e))
+        return EXIT_INVALID_CAMPAIGN
+
+    concurrency = args.concurrency or campaign.get("concurrency") or DEFAULT_MAX_PARALLELISM
+    start_time = time.time()
+    logger.info("Campaign with {0} attack runs is started.".format(len(runs)))
+    results = run_campaign(runs, concurrency)
+    results_path = write_results(results, args.output or campaign.get("output") or DEFAULT_OUTPUT_DIRECTORY)
+
+    failed = [result for result in results if not result["passed"]]
+    for result in results:
+        logger.info("{0} -> {1}: {2}".format(result["attack"], result["target"], result["status"]))
+    logger.info("Campaign is finished in {0:.2f} seconds, {1} of {2} attack runs have failed. Results: {3}".format(
+        time.time() - start_time, len(failed), len(results), results_path))
+    return EXIT_ATTACK_FAILURE if failed else EXIT_SUCCESS
+
+
+class TestCampaignRunner(unittest.TestCase):
+    # Mandatory inputs of CoAP DoS attack except its host, which is given by the targets
+    coap_dos_inputs = {"port": "5684", "path": "peniot", "method_string": "get", "payload": "peniot"}
+
+    def test_invalid_campaign(self):
+        self.assertRaises(CampaignError, load_campaign, "/nonexistent/campaign.json")
+
+    def test_resolve_class_path(self):
+        self.assertEqual(["protocols.CoAP.attacks.coap_dos_attack", "CoAPDoSAttack"],
+                         resolve_class_path("protocols.CoAP.attacks.coap_dos_attack.CoAPDoSAttack"))
+
+    def test_create_runs(self):
+        campaign = {"attacks": [{"attack": "protocols.CoAP.attacks.coap_dos_attack.CoAPDoSAttack",
+                                 "inputs": self.coap_dos_inputs, "targets": ["10.0.0.1", "10.0.0.2"],
+                                 "duration": 5}]}
+        runs = create_runs(campaign)
+        self.assertEqual(2, len(runs))
+        inputs = dict((_input.get_name(), _input.get_value()) for _input in runs[1].attack.get_inputs())
+        self.assertEqual("10.0.0.2", inputs["host"])
+        self.assertEqual(5684, inputs["port"])
+        self.assertEqual(5, runs[0].timeout)
+
+    def test_unknown_input(self):
+        campaign = {"attacks": [{"attack": "protocols.CoAP.attacks.coap_dos_attack.CoAPDoSAttack",
+                                 "inputs": {"unknown": 1}}]}
+        self.assertRaises(CampaignError, create_runs, campaign)
+
+    def test_missing_mandatory_input(self):
+        inputs = dict(self.coap_dos_inputs)
+        del inputs["port"]
+        campaign = {"attacks": [{"attack": "protocols.CoAP.attacks.coap_dos_attack.CoAPDoSAttack",
+                                 "inputs": inputs, "targets": ["10.0.0.1"]}]}
+        self.assertRaises(CampaignError, create_runs, campaign)
+        # Host is mandatory as well, it is only given by the targets
+        campaign["attacks"][0]["inputs"] = self.coap_dos_inputs
+        del campaign["attacks"][0]["targets"]
+        self.assertRaises(CampaignError, create_runs, campaign)
+
+    def test_liveness(self):
+        campaign = {"attacks": [{"attack": "protocols.CoAP.attacks.coap_dos_attack.CoAPDoSAttack",
+                                 "inputs": self.coap_dos_inputs, "targets": ["10.0.0.1"],
+                                 "liveness": {"protocol": "coap", "action": "pause"}}]}
+        runs = create_runs(campaign)
+        self.assertEqual({"protocol": "coap", "action": "pause", "host": "10.0.0.1"}, runs[0].liveness)
+        campaign["attacks"][0]["liveness"]["action"] = "restart"
+        self.assertRaises(CampaignError, create_runs, campaign)
+
+    def test_is_passed(self):
+        run = CampaignRun(0, "attack", "10.0.0.1", None, 5, 5)
+        self.assertTrue(run.is_passed(AttackResult("attack", ATTACK_TIMED_OUT)))
+        self.assertFalse(run.is_passed(AttackResult("attack", ATTACK_TIMED_OUT, "Traceback")))
+        run.duration = None
+        self.assertFalse(run.is_passed(AttackResult("attack", ATTACK_TIMED_OUT)))
+        self.assertTrue(run.is_passed(AttackResult("attack", ATTACK_COMPLETED)))
+
+
+if __name__ == '__main__':
+    unittest.main()
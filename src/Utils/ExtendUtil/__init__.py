@@ -1,4 +1,5 @@
 """
     Extendability Utilities
     It contains necessary functionality used for importing and exporting scripts.
+    It also keeps an index of the available protocols and attacks, so they are only imported when they are selected.
 """
\ No newline at end of file
@@ -0,0 +1,345 @@
+import importlib
+import inspect
+import json
+import logging
+import os
+import pkgutil
+import unittest
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s : %(message)s")
+logger = logging.getLogger("Util - Plugin Index")
+
+INDEX_VERSION = 1
+PROTOCOLS_PACKAGE = "src.protocols"
+PROTOCOLS_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../protocols"))
+INDEX_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../.plugin_index.json"))
+
+ATTACK = "attack"
+ATTACK_SUITE = "attack_suite"
+
+# Index which is loaded in this process and fingerprint of the sources it is built from
+_index = None
+
+
+def get_source_fingerprint(protocols_path=PROTOCOLS_PATH):
+    """
+    Fingerprint of protocol sources, any added, removed or modified module changes it
+    Only file metadata is read, so it is cheap enough to compute on every lookup.
+    :return: Sorted list of relative path, modification time and size of each module
+    """
+    fingerprint = []
+    for directory, _, file_names in os.walk(protocols_path):
+        for file_name in file_names:
+            if file_name.endswith(".py"):
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                fingerprint.append([os.path.relpath(path, protocols_path), stat.st_mtime, stat.st_size])
+    return sorted(fingerprint)
+
+
+def iter_package_classes(package_name):
+    """
+    Import every module under given package and yield the classes they contain
+    :return: Generator of (package name, class) tuples
+    """
+    packages = [package_name]
+    while len(packages) > 0:
+        package = packages.pop()
+        package_module = importlib.import_module(package)
+        prefix = package_module.__name__ + "."
+        for finder, name, ispkg in pkgutil.iter_modules(package_module.__path__, prefix):
+            if ispkg:
+                packages.append(name)
+            else:
+                # For some modules, we may have errors, skip those errors for now
+                try:
+                    mod = importlib.import_module(name)
+                except ImportError:
+                    continue
+                for tname, klass in inspect.getmembers(mod):
+                    if inspect.isclass(klass):
+                        yield package, klass
+
+
+def is_subclass_of(klass, base_class_name):
+    return base_class_name in [c.__name__ for c in inspect.getmro(klass)[1:]]
+
+
+def get_schema_value(value):
+    """
+    :return: Value if it can be stored as json, its string representation otherwise
+    """
+    if value is None or isinstance(value, (bool, int, long, float, basestring)):
+        return value
+    return str(value)
+
+
+def create_attack_record(attack):
+    return {
+        "type": ATTACK,
+        "module": attack.__class__.__module__,
+        "class_name": attack.__class__.__name__,
+        "name": attack.get_attack_name(),
+        "definition": attack.get_definition(),
+        "inputs": [{
+            "label_name": _input.get_label_name(),
+            "name": _input.get_name(),
+            "type": _input.get_type().__name__,
+            "value": get_schema_value(_input.get_value()),
+            "mandatory": _input.mandatory,
+            "secret": _input.secret,
+            "from_captured_packets": _input.from_captured_packets
+        } for _input in attack.get_inputs()]
+    }
+
+
+def create_attack_suite_record(attack_suite):
+    return {
+        "type": ATTACK_SUITE,
+        "module": attack_suite.__class__.__module__,
+        "class_name": attack_suite.__class__.__name__,
+        "name": attack_suite.get_attack_suite_name(),
+        "attacks": [create_attack_record(attack) for attack in attack_suite.get_attacks()]
+    }
+
+
+def scan_protocols():
+    """
+    :return: Records of the subclasses of Protocol class under protocols package
+    """
+    records = []
+    for package, klass in iter_package_classes(PROTOCOLS_PACKAGE):
+        if is_subclass_of(klass, "Protocol"):
+            protocol = klass()
+            records.append({"package_name": package, "module": klass.__module__, "class_name": klass.__name__,
+                            "name": protocol.get_protocol_name(), "definition": protocol.get_definition()})
+    return records
+
+
+def scan_attacks(package_name):
+    """
+    Records of the attacks and attack suites of the given protocol package
+    Attacks which are included in an attack suite are only listed in their suites.
+    :return: Attack records followed by attack suite records
+    """
+    attack_records = []
+    attack_suite_records = []
+    for package, klass in iter_package_classes(package_name + ".attacks"):
+        # If the class inherits from Attack class, simply add it to the attack list
+        if is_subclass_of(klass, "Attack"):
+            record = create_attack_record(klass())
+            # check whether we have this attack in the list or not
+            if record["name"] not in [_["name"] for _ in attack_records]:
+                attack_records.append(record)
+        # If the class inherits from AttackSuite class, simply add it to the Attack suite list
+        if is_subclass_of(klass, "AttackSuite"):
+            attack_suite_records.append(create_attack_suite_record(klass()))
+    # Remove attacks included in the attack suites
+    names_in_suites = set(attack["name"] for suite in attack_suite_records for attack in suite["attacks"])
+    return [_ for _ in attack_records if _["name"] not in names_in_suites] + attack_suite_records
+
+
+def build_index(fingerprint):
+    protocols = scan_protocols()
+    attacks = {}
+    for protocol in protocols:
+        if protocol["package_name"] not in attacks:
+            attacks[protocol["package_name"]] = scan_attacks(protocol["package_name"])
+    return {"version": INDEX_VERSION, "fingerprint": fingerprint, "protocols": protocols, "attacks": attacks}
+
+
+def read_index(index_path=INDEX_PATH):
+    try:
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+        return None
+    return index
+
+
+def write_index(index, index_path=INDEX_PATH):
+    """
+    Persist the index, it is written to a temporary file first so readers never see a partial index
+    """
+    temporary_path = "{0}.{1}.tmp".format(index_path, os.getpid())
+    try:
+        with open(temporary_path, "w") as index_file:
+            json.dump(index, index_file)
+        os.rename(temporary_path, index_path)
+    except (IOError, OSError) as e:
+        logger.warning("Plugin index cannot be saved: {0}".format(e))
+
+
+def get_index():
+    """
+    Index of the protocols and attacks, it is only rebuilt when protocol sources change
+    :return: Index which is valid for the current sources
+    """
+    global _index
+    fingerprint = get_source_fingerprint()
+    if _index is not None and _index["fingerprint"] == fingerprint:
+        return _index
+    index = read_index()
+    # Json does not keep tuples and floats may be written shorter, so compare after a round trip
+    if index is None or index["fingerprint"] != json.loads(json.dumps(fingerprint)):
+        logger.info("Protocol sources have changed, plugin index is being rebuilt.")
+        index = build_index(fingerprint)
+        write_index(index)
+    index["fingerprint"] = fingerprint
+    _index = index
+    return _index
+
+
+def load_class(module_name, class_name):
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class ProtocolEntry(object):
+    """
+    Indexed protocol whose module is not imported until the protocol itself is needed
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.protocol = None
+
+    def get_protocol_name(self):
+        return self.record["name"]
+
+    def get_definition(self):
+        return self.record["definition"]
+
+    def load(self):
+        if self.protocol is None:
+            self.protocol = load_class(self.record["module"], self.record["class_name"])()
+        return self.protocol
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+
+class AttackEntry(object):
+    """
+    Indexed attack which is only imported and instantiated once it is actually used
+    Name, definition and input schema are served from the index, any other attribute is looked up
+    on the attack instance which is created on first access.
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.attack = None
+
+    def get_attack_name(self):
+        return self.record["name"]
+
+    def get_definition(self):
+        return self.record["definition"]
+
+    def get_input_schema(self):
+        """
+        :return: List of dictionaries with label name, name, type name, default value and flags of each input
+        """
+        return self.record["inputs"]
+
+    def get_class_path(self):
+        return "{0}.{1}".format(self.record["module"], self.record["class_name"])
+
+    def load(self):
+        """
+        :rtype: Entity.attack.Attack
+        """
+        if self.attack is None:
+            self.attack = load_class(self.record["module"], self.record["class_name"])()
+        return self.attack
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+
+class AttackSuiteEntry(object):
+    """
+    Indexed attack suite, its attacks are indexed entries as well
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.attacks = [AttackEntry(attack_record) for attack_record in record["attacks"]]
+        self.attack_suite = None
+
+    def get_attack_suite_name(self):
+        return self.record["name"]
+
+    def get_attacks(self):
+        return self.attacks
+
+    def get_class_path(self):
+        return "{0}.{1}".format(self.record["module"], self.record["class_name"])
+
+    def load(self):
+        """
+        :rtype: Entity.attack_suite.AttackSuite
+        """
+        if self.attack_suite is None:
+            self.attack_suite = load_class(self.record["module"], self.record["class_name"])()
+        return self.attack_suite
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+
+def get_protocols():
+    """
+    :return: List of dictionaries with package name and protocol entry
+    """
+    return [{"package_name": record["package_name"], "protocol": ProtocolEntry(record)}
+            for record in get_index()["protocols"]]
+
+
+def get_attacks(package_name):
+    """
+    :return: Attack entries followed by attack suite entries of the given protocol package
+    """
+    index = get_index()
+    if package_name not in index["attacks"]:
+        index["attacks"][package_name] = scan_attacks(package_name)
+        write_index(index)
+    return [AttackEntry(record) if record["type"] == ATTACK else AttackSuiteEntry(record)
+            for record in index["attacks"][package_name]]
+
+
+class TestPluginIndex(unittest.TestCase):
+    def test_fingerprint(self):
+        fingerprint = get_source_fingerprint()
+        self.assertGreater(len(fingerprint), 0)
+        self.assertEqual(fingerprint, get_source_fingerprint())
+
+    def test_attack_entry(self):
+        entry = AttackEntry({"type": ATTACK, "module": "Entity.input_format", "class_name": "InputFormat",
+                             "name": "Entry", "definition": "Definition", "inputs": []})
+        self.assertEqual("Entry", entry.get_attack_name())
+        self.assertIsNone(entry.attack)
+        self.assertEqual("Entity.input_format.InputFormat", entry.get_class_path())
+
+    def test_index_round_trip(self):
+        index_path = INDEX_PATH + ".test"
+        index = {"version": INDEX_VERSION, "fingerprint": [["a.py", 1.5, 10]], "protocols": [], "attacks": {}}
+        write_index(index, index_path)
+        try:
+            self.assertEqual(index, read_index(index_path))
+        finally:
+            os.remove(index_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,4 +3,5 @@
     It contains necessary functionalities used for filtering packets in several attacks
 
     1) PyShark Filterer (used with Generic Sniffer)
+    2) Filter list compiler which pushes filters down to tshark display filter
 """
\ No newline at end of file
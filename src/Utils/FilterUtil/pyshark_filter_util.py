@@ -1,8 +1,41 @@
 import logging
+import unittest
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s : %(message)s")
 logger = logging.getLogger("Util - PyShark Filter")
 
+# pyshark drops the layer prefix of tshark field names and replaces their dots with underscores,
+# so tshark names of fields which have underscores cannot be derived and they are listed here
+TSHARK_FIELD_NAMES = {
+    ("ip", "src_host"): "ip.src_host",
+    ("ip", "dst_host"): "ip.dst_host",
+    ("tcp", "flags_syn"): "tcp.flags.syn",
+    ("tcp", "flags_ack"): "tcp.flags.ack",
+    ("tcp", "flags_fin"): "tcp.flags.fin",
+    ("tcp", "flags_reset"): "tcp.flags.reset",
+    ("tcp", "flags_push"): "tcp.flags.push",
+    ("coap", "opt_uri_path"): "coap.opt.uri_path",
+    ("coap", "opt_uri_host"): "coap.opt.uri_host",
+    ("coap", "opt_uri_port"): "coap.opt.uri_port",
+    ("coap", "opt_uri_query"): "coap.opt.uri_query",
+    ("mqtt", "topic_len"): "mqtt.topic_len",
+    ("mqtt", "proto_len"): "mqtt.proto_len",
+    ("mqtt", "conflag_cleansess"): "mqtt.conflag.cleansess",
+    ("mqtt", "conack_val"): "mqtt.conack.val",
+}
+
+
+def get_tshark_field_name(layer_name, field_name):
+    """
+    :return: tshark name of a pyshark field or None if it cannot be known
+    """
+    if (layer_name, field_name) in TSHARK_FIELD_NAMES:
+        return TSHARK_FIELD_NAMES[(layer_name, field_name)]
+    # A name without underscores is the same in both, except the layer prefix
+    if "_" not in field_name:
+        return "{0}.{1}".format(layer_name, field_name)
+    return None
+
 
 class PySharkFilter:
     """
@@ -47,3 +80,128 @@ class PySharkFilter:
             logger.error("Given layer name or field name is not defined in packet!")
             return False
 
+
+    def get_display_filter(self):
+        """
+        Equality on raw values cannot be expressed for every field type in tshark syntax,
+        hence only the presence of the field is pushed down to tshark
+        :return: Display filter which passes every packet this filter may accept,
+                 None if tshark name of the field is not known
+        """
+        return get_tshark_field_name(self.layer_name, self.field_name)
+
+
+class CompiledPySharkFilter:
+    """
+    Filter list folded into a single predicate
+    Filters are grouped by layer so that each layer is looked up once per packet and filter values are
+    converted to unicode once at compile time. Part of the filter which tshark can evaluate is exposed as
+    a display filter, so packets can be discarded before they are decoded.
+    """
+    def __init__(self, filter_list):
+        """
+        :type filter_list: list of PySharkFilter
+        """
+        self.checks_by_layer = []
+        layer_indexes = {}
+        display_filters = []
+        for single_filter in filter_list:
+            layer_name = single_filter.get_layer_name()
+            if layer_name not in layer_indexes:
+                layer_indexes[layer_name] = len(self.checks_by_layer)
+                self.checks_by_layer.append((layer_name, []))
+            self.checks_by_layer[layer_indexes[layer_name]][1].append(
+                (single_filter.get_field_name(), unicode(single_filter.get_value())))
+            # Fields without a known tshark name are only checked by the predicate
+            display_filter = single_filter.get_display_filter()
+            if display_filter is not None and display_filter not in display_filters:
+                display_filters.append(display_filter)
+        self.display_filter = " && ".join(display_filters) if len(display_filters) > 0 else None
+
+    def get_display_filter(self):
+        return self.display_filter
+
+    def combine_display_filter(self, display_filter=None):
+        """
+        :param display_filter: Display filter to be combined with the compiled one
+        :return: Conjunction of both filters, None if neither exists
+        """
+        if display_filter is None:
+            return self.display_filter
+        if self.display_filter is None:
+            return display_filter
+        return "({0}) && ({1})".format(display_filter, self.display_filter)
+
+    def __call__(self, packet):
+        """
+        :return: Whether packet passes all filters of the list
+        """
+        for layer_name, checks in self.checks_by_layer:
+            try:
+                layer = packet[layer_name]
+            except KeyError:
+                return False
+            for field_name, value in checks:
+                field = layer.get_field_value(field_name)
+                if field is None or field.main_field.raw_value != value:
+                    return False
+        return True
+
+    def filter_packets(self, packets):
+        return [packet for packet in packets if self(packet)]
+
+
+def compile_filter_list(filter_list):
+    """
+    :type filter_list: list of PySharkFilter
+    :return: Compiled predicate of given filters
+    """
+    return CompiledPySharkFilter(filter_list)
+
+
+class TestPySharkFilter(unittest.TestCase):
+    class Field:
+        def __init__(self, raw_value):
+            self.main_field = self
+            self.raw_value = raw_value
+
+    class Layer:
+        def __init__(self, fields):
+            self.fields = fields
+
+        def get_field_value(self, field_name):
+            if field_name in self.fields:
+                return TestPySharkFilter.Field(self.fields[field_name])
+            return None
+
+    def build_packet(self, **layers):
+        return dict((layer_name, self.Layer(fields)) for layer_name, fields in layers.items())
+
+    def setUp(self):
+        self.compiled_filter = compile_filter_list([
+            PySharkFilter("mqtt", "msgtype", 3),
+            PySharkFilter("mqtt", "topic_len", 5),
+            PySharkFilter("tcp", "flags_syn", 0),
+            PySharkFilter("mqtt", "msgtype", 3),
+        ])
+
+    def test_display_filter(self):
+        self.assertEqual("mqtt.msgtype && mqtt.topic_len && tcp.flags.syn", self.compiled_filter.get_display_filter())
+        self.assertEqual("(mqtt) && (mqtt.msgtype && mqtt.topic_len && tcp.flags.syn)",
+                         self.compiled_filter.combine_display_filter("mqtt"))
+        # Field name which cannot be mapped to tshark is only checked by the predicate
+        unmapped_filter = compile_filter_list([PySharkFilter("coap", "opt_name", "x")])
+        self.assertIsNone(unmapped_filter.get_display_filter())
+        self.assertEqual([], unmapped_filter.filter_packets([self.build_packet(coap={"opt_name": u"y"})]))
+
+    def test_predicate(self):
+        matching_packet = self.build_packet(mqtt={"msgtype": u"3", "topic_len": u"5"}, tcp={"flags_syn": u"0"})
+        other_type_packet = self.build_packet(mqtt={"msgtype": u"1", "topic_len": u"5"}, tcp={"flags_syn": u"0"})
+        missing_field_packet = self.build_packet(mqtt={"msgtype": u"3"}, tcp={"flags_syn": u"0"})
+        missing_layer_packet = self.build_packet(mqtt={"msgtype": u"3", "topic_len": u"5"})
+        packets = [matching_packet, other_type_packet, missing_field_packet, missing_layer_packet]
+        self.assertEqual([matching_packet], self.compiled_filter.filter_packets(packets))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,5 +2,7 @@
     Fuzzer Utilities
     It contains necessary functionalities used for fuzzing attacks
 
-    1) Radamsa Random Fuzzing Payload Generator
+    1) Radamsa Random Fuzzing Payload Generator and Persistent Radamsa Worker Pool
+    2) Bounded Memory Sized Payload Generator
+    3) Fuzz Case Journal with Deduplication and Replay
 """
\ No newline at end of file
@@ -0,0 +1,267 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from Utils import CommonUtil
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("Util - Fuzz Case Journal")
+
+DEFAULT_JOURNAL_DIRECTORY = "fuzz_journals"
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Outcomes of the fuzzing cases, protocols may record more specific ones such as response codes
+OUTCOME_SENT = "sent"
+OUTCOME_SEND_ERROR = "send error"
+OUTCOME_TIMEOUT = "timeout"
+FAILURE_OUTCOMES = (OUTCOME_SEND_ERROR, OUTCOME_TIMEOUT)
+
+CREATE_TABLE = "CREATE TABLE IF NOT EXISTS fuzz_cases (" \
+               "id INTEGER PRIMARY KEY, hash BLOB NOT NULL, timestamp REAL NOT NULL, target TEXT, " \
+               "payload BLOB NOT NULL, outcome TEXT)"
+CREATE_HASH_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS fuzz_case_hash ON fuzz_cases (hash)"
+CASE_COLUMNS = "id, hash, timestamp, target, payload, outcome"
+
+
+def get_case_hash(payload):
+    """
+    :return: Content hash of the payload which identifies the case in the journal
+    """
+    if isinstance(payload, unicode):
+        payload = payload.encode("utf-8")
+    return hashlib.sha1(payload).digest()
+
+
+def get_default_journal_path(attack_name):
+    return os.path.join(DEFAULT_JOURNAL_DIRECTORY, "{0}_{1}.sqlite".format(
+        attack_name.lower().replace(" ", "_"), CommonUtil.get_current_datetime_for_filename_format()))
+
+
+class FuzzCase:
+    """
+    Fuzzing case which is read back from a journal
+    """
+
+    def __init__(self, case_id, case_hash, timestamp, target, payload, outcome):
+        self.case_id = case_id
+        self.hash = case_hash
+        self.timestamp = timestamp
+        self.target = target
+        self.payload = payload
+        self.outcome = outcome
+
+    def is_failure(self):
+        return self.outcome in FAILURE_OUTCOMES
+
+    def __str__(self):
+        return "Case: {0}, Hash: {1}, Time: {2:.3f}, Target: {3}, Outcome: {4}, Payload: {5!r}".format(
+            self.case_id, self.hash.encode("hex"), self.timestamp, self.target, self.outcome, self.payload)
+
+
+class FuzzCaseJournal:
+    """
+    Append-only SQLite journal of the sent fuzzing cases
+    Cases are identified by the hash of their payloads, so a payload which is already in the journal is reported
+    as a duplicate and need not be sent again. New cases and outcome updates are buffered and written in batches,
+    hence journaling does not add a disk write to each sent message.
+    """
+
+    def __init__(self, path, target=None, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        :param path: Journal file, an existing journal is appended and its cases count as duplicates
+        :param target: Description of the target which is stored with each case, e.g. coap://host:port/path
+        :param flush_interval: Seconds after which buffered cases are written even if the batch is not full
+        """
+        self.path = path
+        self.target = target
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+
+        self.connection = None
+        self.hashes = set()
+        self.next_case_id = 1
+        self.pending_cases = []
+        self.pending_outcomes = {}
+        self.last_flush_time = None
+        self.duplicate_count = 0
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.text_factory = str
+        # Losing the last batch on a power failure is acceptable, waiting for the disk on each batch is not
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(CREATE_TABLE)
+        self.connection.execute(CREATE_HASH_INDEX)
+        self.connection.commit()
+        self.hashes = set(str(row[0]) for row in self.connection.execute("SELECT hash FROM fuzz_cases"))
+        self.next_case_id = (self.connection.execute("SELECT MAX(id) FROM fuzz_cases").fetchone()[0] or 0) + 1
+        self.last_flush_time = time.time()
+        return self
+
+    def is_duplicate(self, payload):
+        return get_case_hash(payload) in self.hashes
+
+    def record(self, payload, outcome=OUTCOME_SENT, timestamp=None):
+        """
+        Record a case which is about to be sent
+        :return: Identifier of the case, None if the payload is a duplicate
+        """
+        case_hash = get_case_hash(payload)
+        if case_hash in self.hashes:
+            self.duplicate_count += 1
+            return None
+        if isinstance(payload, unicode):
+            payload = payload.encode("utf-8")
+        case_id = self.next_case_id
+        self.next_case_id += 1
+        self.hashes.add(case_hash)
+        self.pending_cases.append((case_id, sqlite3.Binary(case_hash), timestamp or time.time(), self.target,
+                                   sqlite3.Binary(payload), outcome))
+        self._flush_if_due()
+        return case_id
+
+    def set_outcome(self, case_id, outcome):
+        """
+        Update the outcome of a case, e.g. once its response arrives
+        """
+        self.pending_outcomes[case_id] = outcome
+        self._flush_if_due()
+
+    def _flush_if_due(self):
+        if len(self.pending_cases) + len(self.pending_outcomes) >= self.batch_size or \
+                time.time() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered cases and outcomes in a single transaction
+        """
+        if self.pending_cases:
+            self.connection.executemany("INSERT INTO fuzz_cases ({0}) VALUES (?, ?, ?, ?, ?, ?)".format(
+                CASE_COLUMNS), self.pending_cases)
+        if self.pending_outcomes:
+            self.connection.executemany("UPDATE fuzz_cases SET outcome = ? WHERE id = ?",
+                                        [(outcome, case_id) for case_id, outcome in self.pending_outcomes.items()])
+        self.connection.commit()
+        self.pending_cases = []
+        self.pending_outcomes = {}
+        self.last_flush_time = time.time()
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def get_case_count(self):
+        return self.next_case_id - 1
+
+    def _query(self, condition, arguments=()):
+        self.flush()
+        return [FuzzCase(case_id, str(case_hash), timestamp, target, str(payload), outcome)
+                for case_id, case_hash, timestamp, target, payload, outcome in self.connection.execute(
+                    "SELECT {0} FROM fuzz_cases WHERE {1} ORDER BY id".format(CASE_COLUMNS, condition), arguments)]
+
+    def get_case(self, case_id):
+        cases = self._query("id = ?", (case_id,))
+        return cases[0] if cases else None
+
+    def get_cases(self, first_case_id=1, last_case_id=None):
+        """
+        :return: Cases in sending order whose identifiers are in the given inclusive range
+        """
+        if last_case_id is None:
+            return self._query("id >= ?", (first_case_id,))
+        return self._query("id BETWEEN ? AND ?", (first_case_id, last_case_id))
+
+    def get_cases_between(self, start_time, end_time):
+        return self._query("timestamp BETWEEN ? AND ?", (start_time, end_time))
+
+    def get_cases_around(self, case_id, before=10, after=0):
+        """
+        Window of cases around a failure, the cases sent right before it are the likely culprits
+        """
+        return self.get_cases(max(1, case_id - before), case_id + after)
+
+    def get_failures(self, outcomes=FAILURE_OUTCOMES):
+        return self._query("outcome IN ({0})".format(", ".join("?" * len(outcomes))), tuple(outcomes))
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_journal(path, target=None):
+    """
+    :return: Opened journal or None if it cannot be opened, fuzzing can go on without a journal
+    """
+    try:
+        return FuzzCaseJournal(path, target).open()
+    except (sqlite3.Error, OSError) as e:
+        logger.error("Fuzz case journal {0} cannot be opened: {1}".format(path, e))
+        return None
+
+
+def replay_cases(cases, send):
+    """
+    Send the cases back to back without any pacing, e.g. to reproduce a crash of the target
+    :param send: Function which sends a single payload
+    :return: Number of replayed cases
+    """
+    replayed = 0
+    for case in cases:
+        send(case.payload)
+        replayed += 1
+    return replayed
+
+
+class TestFuzzCaseJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "journal.sqlite")
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        os.rmdir(os.path.dirname(self.path))
+
+    def test_deduplication(self):
+        with FuzzCaseJournal(self.path, "coap://127.0.0.1:5683/peniot") as journal:
+            self.assertEqual(1, journal.record("first"))
+            self.assertIsNone(journal.record("first"))
+            self.assertEqual(2, journal.record(u"second"))
+            self.assertEqual(1, journal.duplicate_count)
+        # Cases of previous runs are known to a reopened journal
+        with FuzzCaseJournal(self.path) as journal:
+            self.assertTrue(journal.is_duplicate("second"))
+            self.assertEqual(3, journal.record("third"))
+            self.assertEqual(3, journal.get_case_count())
+
+    def test_outcomes_and_windows(self):
+        with FuzzCaseJournal(self.path, batch_size=1000, flush_interval=1000) as journal:
+            for index in range(10):
+                journal.record("case {0}".format(index))
+            journal.set_outcome(7, OUTCOME_TIMEOUT)
+            self.assertEqual(0, journal.connection.execute("SELECT COUNT(*) FROM fuzz_cases").fetchone()[0])
+            failures = journal.get_failures()
+            self.assertEqual([7], [case.case_id for case in failures])
+            window = journal.get_cases_around(failures[0].case_id, before=3, after=1)
+            self.assertEqual(["case {0}".format(index) for index in range(3, 8)], [case.payload for case in window])
+            replayed = []
+            self.assertEqual(5, replay_cases(window, replayed.append))
+            self.assertEqual("case 7", replayed[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,27 @@
+import distutils.spawn
 import logging
+import multiprocessing
+import os
+import Queue
+import socket
 import subprocess
+import tempfile
+import threading
+import time
+import unittest
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
 logger = logging.getLogger("Util - Radamsa")
 
 ASCII_DECODE_LIMIT = 128
+DEFAULT_PREFETCH_SIZE = 1024
+WORKER_STARTUP_TIMEOUT = 5.0
+WORKER_START_ATTEMPTS = 3
+RECEIVE_SIZE = 4096
+
+
+def delete_non_ascii_characters(_string):
+    return "".join([_ for _ in _string if ord(_) < ASCII_DECODE_LIMIT])
 
 
 def radamsa_malformed_input_generator(input_string, output_count=1):
@@ -33,9 +50,6 @@ def radamsa_malformed_input_generator(input_string, output_count=1):
 
 
 def get_ascii_decodable_radamsa_malformed_input(input_string, output_count=1):
-    def delete_non_ascii_characters(_string):
-        return "".join([_ for _ in _string if ord(_) < ASCII_DECODE_LIMIT])
-
     returned_strings = radamsa_malformed_input_generator(input_string, output_count)
     _type = type(returned_strings)
     if _type == list:
@@ -44,3 +58,170 @@ def get_ascii_decodable_radamsa_malformed_input(input_string, output_count=1):
         return delete_non_ascii_characters(returned_strings)
     else:
         logger.error("Non-matched type for output value")
+
+
+def get_free_port():
+    """
+    Another process may take the port before it is bound again, callers retry with a new port in that case
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class RadamsaWorkerPool:
+    """
+    Long-lived radamsa service for a single seed
+    Each worker is a radamsa process in TCP server mode which serves a new test case for every connection,
+    and a prefetch thread per worker keeps a bounded queue filled ahead of the sender.
+    Hence, callers pull ready-made test cases without any fork/exec per call.
+    """
+
+    def __init__(self, input_string, worker_count=None, prefetch_size=DEFAULT_PREFETCH_SIZE):
+        """
+        :param input_string: Seed of the generated test cases
+        :param worker_count: Number of radamsa processes, number of cores is used by default
+        :param prefetch_size: Maximum number of test cases generated ahead
+        """
+        self.input_string = input_string
+        self.worker_count = worker_count if worker_count is not None else multiprocessing.cpu_count()
+        self.queue = Queue.Queue(maxsize=prefetch_size)
+
+        self.seed_filename = None
+        self.processes = []
+        self.process_lock = threading.Lock()
+        self.threads = []
+        self.stopped_flag = False
+
+    def start(self):
+        """
+        Start radamsa processes and their prefetch threads
+        """
+        seed_file, self.seed_filename = tempfile.mkstemp(prefix="peniot-radamsa-")
+        input_string = self.input_string
+        if isinstance(input_string, unicode):
+            input_string = input_string.encode("utf-8")
+        os.write(seed_file, input_string)
+        os.close(seed_file)
+
+        self.stopped_flag = False
+        for _ in range(self.worker_count):
+            thread = threading.Thread(target=self._prefetch)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        logger.info("Radamsa worker pool is started with {0} workers.".format(self.worker_count))
+        return self
+
+    def _start_worker(self):
+        """
+        Start a radamsa process in TCP server mode, ":port" makes radamsa listen while "host:port" would connect
+        :return: Process and the port it listens on
+        """
+        port = get_free_port()
+        with self.process_lock:
+            process = subprocess.Popen(["radamsa", "-n", "inf", "-o", ":{0}".format(port), self.seed_filename])
+            self.processes.append(process)
+        return process, port
+
+    def _fetch(self, port):
+        """
+        :return: Single test case served by the radamsa process listening on given port
+        """
+        sock = socket.create_connection(("127.0.0.1", port))
+        try:
+            chunks = []
+            while True:
+                chunk = sock.recv(RECEIVE_SIZE)
+                if not chunk:
+                    return "".join(chunks)
+                chunks.append(chunk)
+        finally:
+            sock.close()
+
+    def _prefetch(self):
+        process, port = self._start_worker()
+        attempts = 1
+        # Wait until radamsa starts listening
+        deadline = time.time() + WORKER_STARTUP_TIMEOUT
+        while self.stopped_flag is False:
+            try:
+                test_case = self._fetch(port)
+            except socket.error as e:
+                if process.poll() is not None and attempts < WORKER_START_ATTEMPTS:
+                    # Port is taken between choosing and binding it, so start the worker again on another one
+                    logger.debug("Radamsa worker on port {0} exited, restarting it.".format(port))
+                    process, port = self._start_worker()
+                    attempts += 1
+                    deadline = time.time() + WORKER_STARTUP_TIMEOUT
+                    continue
+                if time.time() > deadline:
+                    logger.error("Radamsa worker on port {0} is not reachable: {1}".format(port, e))
+                    return
+                time.sleep(0.05)
+                continue
+            deadline = time.time() + WORKER_STARTUP_TIMEOUT
+            while self.stopped_flag is False:
+                try:
+                    self.queue.put(test_case, timeout=0.5)
+                    break
+                except Queue.Full:
+                    continue
+
+    def get_malformed_input(self, output_count=1):
+        """
+        Return ready-made test cases with the same convention as radamsa_malformed_input_generator
+        :param output_count: Number of returned test cases
+        :return: Test case if output count is one, list of test cases otherwise
+        """
+        test_cases = []
+        while len(test_cases) < output_count:
+            if not any(thread.is_alive() for thread in self.threads):
+                raise RuntimeError("Radamsa worker pool has no running workers")
+            try:
+                test_cases.append(self.queue.get(timeout=0.5))
+            except Queue.Empty:
+                continue
+        return test_cases if output_count > 1 else test_cases[0]
+
+    def get_ascii_decodable_malformed_input(self, output_count=1):
+        test_cases = self.get_malformed_input(output_count)
+        if type(test_cases) == list:
+            return [delete_non_ascii_characters(test_case) for test_case in test_cases]
+        return delete_non_ascii_characters(test_cases)
+
+    def stop(self):
+        self.stopped_flag = True
+        # Prefetch threads stop within a queue timeout, afterwards no new worker can be started
+        for thread in self.threads:
+            thread.join()
+        with self.process_lock:
+            for process in self.processes:
+                if process.poll() is None:
+                    process.terminate()
+                    process.wait()
+        self.processes = []
+        self.threads = []
+        if self.seed_filename is not None:
+            os.remove(self.seed_filename)
+            self.seed_filename = None
+
+
+class TestRadamsaWorkerPool(unittest.TestCase):
+    @unittest.skipIf(distutils.spawn.find_executable("radamsa") is None, "radamsa is not installed")
+    def test_fetch_from_live_pool(self):
+        pool = RadamsaWorkerPool("peniot fuzzing seed", worker_count=2, prefetch_size=8).start()
+        try:
+            test_cases = pool.get_malformed_input(3)
+            self.assertEqual(3, len(test_cases))
+            self.assertTrue(all(isinstance(test_case, str) for test_case in test_cases))
+        finally:
+            pool.stop()
+        self.assertEqual([], pool.processes)
+        self.assertIsNone(pool.seed_filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
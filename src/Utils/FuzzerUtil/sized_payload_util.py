@@ -0,0 +1,88 @@
+import logging
+import random
+import unittest
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("Util - Sized Payload")
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+PAYLOAD_CHARACTERS = "".join([chr(_) for _ in range(65, 91)]) + "".join([chr(_) for _ in range(97, 123)])
+
+
+class SizedPayloadGenerator:
+    """
+    Bounded memory payload generator for payload size fuzzers
+    Payloads of any size are produced as consecutive views over a single preallocated buffer,
+    so memory usage does not depend on the requested payload size.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.buffer = bytearray(chunk_size)
+        self.view = memoryview(self.buffer)
+        self.character = None
+
+    def fill(self, character=None):
+        """
+        Fill the buffer with the given character, a random letter is chosen if it is not given
+        :return: Character which the buffer is filled with
+        """
+        if character is None:
+            character = random.choice(PAYLOAD_CHARACTERS)
+        if character != self.character:
+            self.buffer[:] = character * self.chunk_size
+            self.character = character
+        return character
+
+    def iter_chunks(self, payload_size, max_chunk_size=None):
+        """
+        :param payload_size: Total size of the payload
+        :param max_chunk_size: Upper limit for the size of each chunk, e.g. due to frame size of the protocol
+        :return: Generator of memoryview chunks which add up to given payload size
+        """
+        chunk_size = self.chunk_size if max_chunk_size is None else min(self.chunk_size, max_chunk_size)
+        remaining = payload_size
+        while remaining > 0:
+            size = min(chunk_size, remaining)
+            yield self.view[:size]
+            remaining -= size
+
+    def get_payload(self, payload_size):
+        """
+        Payload as a single string, only meant for protocols whose messages are bounded by the chunk size
+        """
+        if payload_size > self.chunk_size:
+            logger.warning("Payload of {0} bytes exceeds chunk size and is created in memory.".format(payload_size))
+            return "".join(chunk.tobytes() for chunk in self.iter_chunks(payload_size))
+        return self.view[:payload_size].tobytes()
+
+
+class TestSizedPayloadGenerator(unittest.TestCase):
+    def setUp(self):
+        self.generator = SizedPayloadGenerator(chunk_size=16)
+
+    def test_iter_chunks(self):
+        chunks = list(self.generator.iter_chunks(40))
+        self.assertEqual([16, 16, 8], [len(chunk) for chunk in chunks])
+        chunks = list(self.generator.iter_chunks(40, max_chunk_size=10))
+        self.assertEqual(40, sum(len(chunk) for chunk in chunks))
+        self.assertTrue(all(len(chunk) <= 10 for chunk in chunks))
+        self.assertEqual([], list(self.generator.iter_chunks(0)))
+
+    def test_fill(self):
+        self.assertEqual("a", self.generator.fill("a"))
+        self.assertEqual("a" * 16, self.generator.get_payload(16))
+        self.generator.fill("b")
+        self.assertEqual("b" * 16, self.generator.get_payload(16))
+        self.assertIn(self.generator.fill(), PAYLOAD_CHARACTERS)
+
+    def test_get_payload(self):
+        self.generator.fill("c")
+        self.assertEqual("c" * 5, self.generator.get_payload(5))
+        # Payloads beyond the chunk size are joined from chunks
+        self.assertEqual("c" * 40, self.generator.get_payload(40))
+        self.assertEqual("", self.generator.get_payload(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,6 @@
+"""
+    Monitor Utilities
+    It contains necessary functionalities used for watching the target while attacks are running
+
+    1) Target Liveness Monitor with CoAP, MQTT and AMQP Probes
+"""
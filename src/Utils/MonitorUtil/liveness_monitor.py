@@ -0,0 +1,385 @@
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from Entity import metrics as Metrics
+from protocols import CoAP as PeniotCoAP
+from protocols.AMQP.amqp_chunked_publisher import AMQPChunkedPublisher, DEFAULT_AMQP_PORT
+from protocols.CoAP.coap_pipelined_client import CoAPResponse, encode_message, CON, MAX_DATAGRAM_SIZE
+from protocols.MQTT.mqtt_flood_engine import open_connection, DEFAULT_MQTT_PORT
+from protocols.MQTT.mqtt_packet_encoder import encode_pingreq_packet, encode_disconnect_packet, PINGRESP
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("Util - Liveness Monitor")
+
+DEFAULT_PROBE_INTERVAL = 1.0
+DEFAULT_PROBE_TIMEOUT = 1.0
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COAP_PORT = 5683
+WELL_KNOWN_CORE_PATH = ".well-known/core"
+
+# Health states of the target
+TARGET_UNKNOWN = "unknown"
+TARGET_ALIVE = "alive"
+TARGET_DOWN = "down"
+
+# Actions which are taken when the target goes down
+ACTION_NONE = "none"
+ACTION_PAUSE = "pause"
+ACTION_ABORT = "abort"
+
+TARGET_ALIVE_METRIC = "target_alive"
+PROBE_FAILURES_METRIC = "liveness_probe_failures_total"
+
+
+class LivenessProbeError(Exception):
+    pass
+
+
+class LivenessProbe(object):
+    """
+    Cheap request which the target answers as long as it is alive
+    Connections of the probes are kept aside from the ones of the attack and reopened after a failure.
+    """
+
+    def __init__(self, host, port, timeout=DEFAULT_PROBE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def probe(self):
+        """
+        :raise LivenessProbeError, socket.error: If the target does not answer in time
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class CoAPLivenessProbe(LivenessProbe):
+    """
+    Confirmable GET request to the resource discovery path, any response with its message ID or token will do
+    """
+
+    def __init__(self, host, port=DEFAULT_COAP_PORT, timeout=DEFAULT_PROBE_TIMEOUT):
+        LivenessProbe.__init__(self, host, port, timeout)
+        self.sock = None
+        self.next_mid = random.randint(0, 0xFFFF)
+
+    def probe(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # Connected socket reports ICMP port unreachable errors, so a closed port fails without waiting
+            self.sock.connect((self.host, self.port))
+        message_id = self.next_mid
+        self.next_mid = (self.next_mid + 1) & 0xFFFF
+        token = struct.pack("!I", random.randint(0, 0xFFFFFFFF))
+        self.sock.send(encode_message(CON, PeniotCoAP.CoAPMethods.GET.value, message_id, token, WELL_KNOWN_CORE_PATH))
+        deadline = time.time() + self.timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise LivenessProbeError("No response to CoAP GET /{0}".format(WELL_KNOWN_CORE_PATH))
+            self.sock.settimeout(remaining)
+            try:
+                response = CoAPResponse.decode(self.sock.recv(MAX_DATAGRAM_SIZE))
+            except socket.timeout:
+                continue
+            # Responses of earlier probes which have arrived late are skipped
+            if response is not None and (response.mid == message_id or response.token == token):
+                return
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class MQTTLivenessProbe(LivenessProbe):
+    """
+    PINGREQ on a side connection to the broker
+    """
+
+    def __init__(self, host, port=DEFAULT_MQTT_PORT, timeout=DEFAULT_PROBE_TIMEOUT):
+        LivenessProbe.__init__(self, host, port, timeout)
+        self.sock = None
+
+    def probe(self):
+        try:
+            if self.sock is None:
+                self.sock = open_connection(self.host, self.port, timeout=self.timeout)
+            self.sock.sendall(bytes(encode_pingreq_packet()))
+            response = bytearray()
+            while len(response) < 2:
+                received = self.sock.recv(2 - len(response))
+                if not received:
+                    raise LivenessProbeError("Broker closed the connection")
+                response.extend(received)
+            if response[0] != PINGRESP:
+                raise LivenessProbeError("Unexpected response to PINGREQ: {0:#04x}".format(response[0]))
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.sendall(bytes(encode_disconnect_packet()))
+            except socket.error:
+                pass
+            self.sock.close()
+            self.sock = None
+
+
+class AMQPLivenessProbe(LivenessProbe):
+    """
+    Heartbeat followed by a channel round trip on a side connection to the broker
+    """
+
+    def __init__(self, host, port=DEFAULT_AMQP_PORT, timeout=DEFAULT_PROBE_TIMEOUT):
+        LivenessProbe.__init__(self, host, port, timeout)
+        self.connection = None
+
+    def probe(self):
+        try:
+            if self.connection is None:
+                self.connection = AMQPChunkedPublisher(self.host, self.port, timeout=self.timeout)
+                self.connection.connect()
+            self.connection.ping()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+PROBES = {"coap": CoAPLivenessProbe, "mqtt": MQTTLivenessProbe, "amqp": AMQPLivenessProbe}
+
+
+def create_probe(protocol, host, port=None, timeout=DEFAULT_PROBE_TIMEOUT):
+    """
+    :param protocol: One of coap, mqtt and amqp
+    :param port: Default port of the protocol is used if it is not given
+    """
+    if protocol.lower() not in PROBES:
+        raise ValueError("Liveness probe protocol must be one of {0}: {1}".format(sorted(PROBES), protocol))
+    probe_class = PROBES[protocol.lower()]
+    if port is None:
+        return probe_class(host, timeout=timeout)
+    return probe_class(host, int(port), timeout)
+
+
+class HealthTransition(object):
+    """
+    Change of the health state of the target
+    """
+
+    def __init__(self, timestamp, state, case_index, reason=None):
+        self.timestamp = timestamp
+        self.state = state
+        self.case_index = case_index
+        self.reason = reason
+
+    def to_dict(self):
+        return {"timestamp": self.timestamp, "state": self.state, "case_index": self.case_index,
+                "reason": self.reason}
+
+    def __str__(self):
+        return "Target is {0} at case {1}{2}".format(self.state, self.case_index,
+                                                     ": {0}".format(self.reason) if self.reason else "")
+
+
+class LivenessMonitor(threading.Thread):
+    """
+    Probe the target periodically beside an attack and record the changes of its health
+    Target is considered down after given number of consecutive failed probes. Then, the attack is either paused
+    through its rate limiter until the target answers again, or stopped. Case index of a transition is the sent
+    message count of the attack at that moment.
+    """
+
+    def __init__(self, probe, interval=DEFAULT_PROBE_INTERVAL, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 action=ACTION_NONE, attack=None):
+        """
+        :type probe: LivenessProbe
+        :param action: One of none, pause and abort
+        :type attack: Entity.attack.Attack
+        """
+        threading.Thread.__init__(self, name="Liveness Monitor")
+        self.daemon = True
+        if action not in (ACTION_NONE, ACTION_PAUSE, ACTION_ABORT):
+            raise ValueError("Liveness action must be one of none, pause and abort: {0}".format(action))
+        self.probe = probe
+        self.interval = interval
+        self.failure_threshold = max(1, failure_threshold)
+        self.action = action
+        self.attack = attack
+
+        self.stop_event = threading.Event()
+        self.state = TARGET_UNKNOWN
+        self.consecutive_failures = 0
+        self.transitions = []
+        self.aborted = False
+        self.pause_warned = False
+
+        metrics = attack.get_metrics() if attack is not None else Metrics.AttackMetrics("Liveness Monitor")
+        self.alive_metric = metrics.gauge(TARGET_ALIVE_METRIC, "Whether target answers the liveness probes")
+        self.failure_metric = metrics.counter(PROBE_FAILURES_METRIC, "Failed liveness probes")
+
+    def get_case_index(self):
+        return getattr(self.attack, "sent_message_count", None)
+
+    def get_state(self):
+        return self.state
+
+    def get_transitions(self):
+        return self.transitions
+
+    def is_aborted(self):
+        return self.aborted
+
+    def run(self):
+        while not self.stop_event.is_set():
+            probe_time = time.time()
+            try:
+                self.probe.probe()
+                self.update(True)
+            except (socket.error, LivenessProbeError) as e:
+                self.update(False, str(e) or e.__class__.__name__)
+            if self.aborted:
+                break
+            self.stop_event.wait(max(0., self.interval - (time.time() - probe_time)))
+        self.probe.close()
+
+    def update(self, alive, reason=None):
+        """
+        Take the result of a probe into account
+        """
+        if alive:
+            self.consecutive_failures = 0
+            self.alive_metric.set(1)
+            if self.state != TARGET_ALIVE:
+                self._transit(TARGET_ALIVE)
+                rate_limiter = getattr(self.attack, "rate_limiter", None)
+                if self.action == ACTION_PAUSE and rate_limiter is not None and rate_limiter.is_paused():
+                    logger.info("Attack is resumed.")
+                    rate_limiter.resume()
+            return
+        self.consecutive_failures += 1
+        self.failure_metric.inc()
+        if self.consecutive_failures >= self.failure_threshold and self.state != TARGET_DOWN:
+            self.alive_metric.set(0)
+            self._transit(TARGET_DOWN, reason)
+            self._act_on_down()
+
+    def _transit(self, state, reason=None):
+        transition = HealthTransition(time.time(), state, self.get_case_index(), reason)
+        self.transitions.append(transition)
+        self.state = state
+        (logger.info if state == TARGET_ALIVE else logger.warning)(str(transition))
+
+    def _act_on_down(self):
+        if self.action == ACTION_PAUSE:
+            rate_limiter = getattr(self.attack, "rate_limiter", None)
+            if rate_limiter is not None:
+                logger.info("Attack is paused until target is alive again.")
+                rate_limiter.pause()
+            elif not self.pause_warned:
+                self.pause_warned = True
+                logger.warning("Attack has no rate limiter, hence it cannot be paused.")
+        elif self.action == ACTION_ABORT:
+            self.aborted = True
+            if self.attack is not None:
+                logger.info("Attack is being stopped since target is down.")
+                self.attack.stop_attack()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+def create_monitor(settings, attack=None, default_host=None):
+    """
+    :param settings: Dictionary with protocol and optional host, port, timeout, interval, failure_threshold and
+                     action fields
+    :param default_host: Host which is probed if settings do not have any
+    :rtype: LivenessMonitor
+    """
+    host = settings.get("host", default_host)
+    if not host:
+        raise ValueError("Liveness probe needs a host")
+    probe = create_probe(settings["protocol"], host, settings.get("port"),
+                         float(settings.get("timeout", DEFAULT_PROBE_TIMEOUT)))
+    return LivenessMonitor(probe, float(settings.get("interval", DEFAULT_PROBE_INTERVAL)),
+                           int(settings.get("failure_threshold", DEFAULT_FAILURE_THRESHOLD)),
+                           settings.get("action", ACTION_NONE), attack)
+
+
+class TestLivenessMonitor(unittest.TestCase):
+    class Probe(LivenessProbe):
+        def __init__(self, results):
+            LivenessProbe.__init__(self, "localhost", 0)
+            self.results = results
+
+        def probe(self):
+            if not self.results.pop(0):
+                raise LivenessProbeError("No response")
+
+    class Attack(object):
+        def __init__(self):
+            self.sent_message_count = 0
+            self.rate_limiter = None
+            self.stopped = False
+            self.metrics = Metrics.AttackMetrics("Test")
+
+        def get_metrics(self):
+            return self.metrics
+
+        def stop_attack(self):
+            self.stopped = True
+
+    def test_pause_and_resume(self):
+        from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
+        attack = TestLivenessMonitor.Attack()
+        attack.rate_limiter = RateLimiter(ConstantProfile(100))
+        monitor = LivenessMonitor(TestLivenessMonitor.Probe([]), failure_threshold=2, action=ACTION_PAUSE,
+                                  attack=attack)
+        monitor.update(True)
+        attack.sent_message_count = 42
+        monitor.update(False, "No response")
+        self.assertFalse(attack.rate_limiter.is_paused())
+        monitor.update(False, "No response")
+        self.assertTrue(attack.rate_limiter.is_paused())
+        monitor.update(True)
+        self.assertFalse(attack.rate_limiter.is_paused())
+        self.assertEqual([TARGET_ALIVE, TARGET_DOWN, TARGET_ALIVE], [_.state for _ in monitor.get_transitions()])
+        self.assertEqual(42, monitor.get_transitions()[1].case_index)
+        self.assertEqual(2, attack.metrics.counter(PROBE_FAILURES_METRIC).get_value())
+
+    def test_abort(self):
+        attack = TestLivenessMonitor.Attack()
+        monitor = LivenessMonitor(TestLivenessMonitor.Probe([True, False, False, True]), interval=0.01,
+                                  failure_threshold=2, action=ACTION_ABORT, attack=attack)
+        monitor.start()
+        monitor.join(5)
+        self.assertTrue(monitor.is_aborted())
+        self.assertTrue(attack.stopped)
+        self.assertEqual(TARGET_DOWN, monitor.get_state())
+
+    def test_coap_probe(self):
+        # Nothing listens on the discard port, so the probe fails
+        probe = CoAPLivenessProbe("127.0.0.1", 9, timeout=0.2)
+        self.assertRaises((socket.error, LivenessProbeError), probe.probe)
+        probe.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,6 @@
+"""
+    Rate Utilities
+    It contains necessary functionalities used for pacing the messages sent by attacks
+
+    1) Token Bucket Rate Limiter with Constant, Ramp, Step, Spike and Soak Profiles
+"""
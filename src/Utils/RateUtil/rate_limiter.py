@@ -0,0 +1,410 @@
+import math
+import threading
+import time
+import unittest
+
+# Accumulated tokens are capped to this many seconds of the current rate unless a burst size is given
+DEFAULT_BURST_TIME = 0.1
+# Waits shorter than this are spun instead of slept, since sleep granularity is coarser than that
+SPIN_THRESHOLD = 0.002
+# Wait time while the profile does not allow any messages, e.g. a ramp which starts from zero
+IDLE_WAIT_TIME = 0.01
+# Wait time while the limiter is paused, e.g. until the target is alive again
+PAUSED_WAIT_TIME = 0.1
+
+CONSTANT_PROFILE = "constant"
+RAMP_PROFILE = "ramp"
+STEP_PROFILE = "step"
+SPIKE_PROFILE = "spike"
+SOAK_PROFILE = "soak"
+
+
+class RateProfile(object):
+    """
+    Message rate as a function of the time elapsed since the beginning of the attack
+    Profiles also give the integral of their rate, i.e. the number of messages allowed so far, so limiter
+    does not accumulate the error of sampling the rate at discrete points.
+    """
+    duration = None  # None means that the profile never finishes
+
+    def get_rate(self, elapsed):
+        """
+        :return: Messages per second at given elapsed time
+        """
+        raise NotImplementedError()
+
+    def get_allowance(self, elapsed):
+        """
+        :return: Total number of messages allowed from the beginning until given elapsed time
+        """
+        raise NotImplementedError()
+
+    def is_unlimited(self):
+        return False
+
+    def is_finished(self, elapsed):
+        return self.duration is not None and elapsed >= self.duration
+
+
+class ConstantProfile(RateProfile):
+    """
+    Fixed rate, zero or negative rate means as fast as possible
+    """
+
+    def __init__(self, rate, duration=None):
+        self.rate = float(rate)
+        self.duration = duration
+
+    def get_rate(self, elapsed):
+        return self.rate
+
+    def get_allowance(self, elapsed):
+        return self.rate * elapsed
+
+    def is_unlimited(self):
+        return self.rate <= 0
+
+
+class SoakProfile(ConstantProfile):
+    """
+    Fixed rate which is sustained for a long but limited duration
+    """
+
+    def __init__(self, rate, duration):
+        ConstantProfile.__init__(self, rate, duration)
+
+
+class RampProfile(RateProfile):
+    """
+    Rate changes linearly from start rate to end rate in ramp duration, then it stays at end rate
+    """
+
+    def __init__(self, start_rate, end_rate, ramp_duration, duration=None):
+        self.start_rate = float(start_rate)
+        self.end_rate = float(end_rate)
+        self.ramp_duration = float(ramp_duration)
+        self.duration = duration
+
+    def get_rate(self, elapsed):
+        if elapsed >= self.ramp_duration:
+            return self.end_rate
+        return self.start_rate + (self.end_rate - self.start_rate) * elapsed / self.ramp_duration
+
+    def get_allowance(self, elapsed):
+        ramp_time = min(elapsed, self.ramp_duration)
+        allowance = self.start_rate * ramp_time + (self.end_rate - self.start_rate) * ramp_time ** 2 / (
+            2 * self.ramp_duration)
+        return allowance + self.end_rate * max(0., elapsed - self.ramp_duration)
+
+
+class StepProfile(RateProfile):
+    """
+    Rate starts from start rate and increases by step rate after every step duration, up to maximum rate
+    """
+
+    def __init__(self, start_rate, step_rate, step_duration, max_rate=None, duration=None):
+        self.start_rate = float(start_rate)
+        self.step_rate = float(step_rate)
+        self.step_duration = float(step_duration)
+        self.max_rate = max_rate
+        self.duration = duration
+        # Number of steps until maximum rate is reached
+        if max_rate is None or self.step_rate <= 0:
+            self.step_count = None
+        else:
+            self.step_count = max(0, int(math.ceil((max_rate - self.start_rate) / self.step_rate)))
+
+    def _get_step_rate(self, step):
+        if self.step_count is not None and step >= self.step_count:
+            return float(self.max_rate)
+        return self.start_rate + step * self.step_rate
+
+    def get_rate(self, elapsed):
+        return self._get_step_rate(int(elapsed // self.step_duration))
+
+    def get_allowance(self, elapsed):
+        step = int(elapsed // self.step_duration)
+        increasing_steps = step if self.step_count is None else min(step, self.step_count)
+        # Arithmetic series of the completed increasing steps, followed by the steps at maximum rate
+        allowance = self.step_duration * (increasing_steps * self.start_rate +
+                                          self.step_rate * increasing_steps * (increasing_steps - 1) / 2.)
+        allowance += self.step_duration * (step - increasing_steps) * self._get_step_rate(step)
+        return allowance + (elapsed - step * self.step_duration) * self._get_step_rate(step)
+
+
+class SpikeProfile(RateProfile):
+    """
+    Base rate with a spike at the end of every period
+    """
+
+    def __init__(self, base_rate, spike_rate, period, spike_duration, duration=None):
+        self.base_rate = float(base_rate)
+        self.spike_rate = float(spike_rate)
+        self.period = float(period)
+        self.spike_duration = min(float(spike_duration), self.period)
+        self.duration = duration
+
+    def get_rate(self, elapsed):
+        if elapsed % self.period >= self.period - self.spike_duration:
+            return self.spike_rate
+        return self.base_rate
+
+    def get_allowance(self, elapsed):
+        base_duration = self.period - self.spike_duration
+        periods = int(elapsed // self.period)
+        remaining = elapsed - periods * self.period
+        allowance = periods * (self.base_rate * base_duration + self.spike_rate * self.spike_duration)
+        return allowance + self.base_rate * min(remaining, base_duration) + \
+            self.spike_rate * max(0., remaining - base_duration)
+
+
+def create_profile(description, default_rate=0):
+    """
+    Create a rate profile from its textual description, fields are separated by colons
+        <rate>                                                  Constant rate
+        constant:<rate>[:<duration>]
+        ramp:<start rate>:<end rate>:<ramp duration>[:<duration>]
+        step:<start rate>:<step rate>:<step duration>[:<max rate>[:<duration>]]
+        spike:<base rate>:<spike rate>:<period>:<spike duration>[:<duration>]
+        soak:<rate>:<duration>
+    :param default_rate: Rate of the constant profile used when description is empty
+    :rtype: RateProfile
+    """
+    if description is None or len(description.strip()) == 0:
+        return ConstantProfile(default_rate)
+    fields = [_.strip() for _ in description.strip().split(":")]
+    name = fields[0].lower()
+    try:
+        if name not in [CONSTANT_PROFILE, RAMP_PROFILE, STEP_PROFILE, SPIKE_PROFILE, SOAK_PROFILE]:
+            return ConstantProfile(float(description))
+        values = [float(_) for _ in fields[1:]]
+    except ValueError:
+        raise ValueError("Invalid rate profile: {0}".format(description))
+    arguments = {CONSTANT_PROFILE: (ConstantProfile, 1, 2), RAMP_PROFILE: (RampProfile, 3, 4),
+                 STEP_PROFILE: (StepProfile, 3, 5), SPIKE_PROFILE: (SpikeProfile, 4, 5),
+                 SOAK_PROFILE: (SoakProfile, 2, 2)}
+    profile_class, min_count, max_count = arguments[name]
+    if not min_count <= len(values) <= max_count:
+        raise ValueError("{0} profile takes {1} to {2} values: {3}".format(name, min_count, max_count, description))
+    return profile_class(*values)
+
+
+class RateLimiter(object):
+    """
+    Token bucket whose refill rate follows a rate profile
+    Tokens are refilled from the integral of the profile, and the ones which are not used are capped by the burst
+    size. Waits are slept except for their last part, which is spun to reach the requested time precisely.
+    Limiter is thread safe, hence several senders can draw from the same one to share a rate. It can be paused
+    from another thread, then no tokens are granted and the profile continues from where it is paused on resume.
+    """
+
+    def __init__(self, profile, burst=None, clock=time.time):
+        """
+        :type profile: RateProfile
+        :param burst: Maximum number of tokens which can be accumulated, defaults to 100 ms of the current rate
+        :param clock: Function which returns current time in seconds
+        """
+        self.profile = profile
+        self.burst = burst
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.tokens = 0.
+        self.last_allowance = 0.
+        self.pause_time = None
+
+    def start(self):
+        """
+        Restart the profile from its beginning, first message is allowed immediately
+        """
+        with self.lock:
+            self.start_time = self.clock()
+            self.tokens = 1.
+            self.last_allowance = 0.
+
+    def pause(self):
+        with self.lock:
+            if self.pause_time is None:
+                self.pause_time = self.clock()
+
+    def resume(self):
+        with self.lock:
+            if self.pause_time is not None:
+                # Time spent while paused is skipped by the profile
+                if self.start_time is not None:
+                    self.start_time += self.clock() - self.pause_time
+                self.pause_time = None
+
+    def is_paused(self):
+        return self.pause_time is not None
+
+    def _get_elapsed_time(self):
+        return (self.pause_time if self.pause_time is not None else self.clock()) - self.start_time
+
+    def get_elapsed_time(self):
+        if self.start_time is None:
+            return 0.
+        return self._get_elapsed_time()
+
+    def get_current_rate(self):
+        return self.profile.get_rate(self.get_elapsed_time())
+
+    def is_finished(self):
+        return self.profile.is_finished(self.get_elapsed_time())
+
+    def _refill(self, elapsed):
+        allowance = self.profile.get_allowance(elapsed)
+        cap = self.burst if self.burst is not None else self.profile.get_rate(elapsed) * DEFAULT_BURST_TIME
+        self.tokens = min(self.tokens + allowance - self.last_allowance, max(1., cap))
+        self.last_allowance = allowance
+
+    def try_acquire(self, count=1):
+        """
+        Take as many tokens as available without waiting
+        :return: Number of granted tokens, at most count
+        """
+        if self.start_time is None:
+            self.start()
+        if self.pause_time is not None:
+            return 0
+        if self.profile.is_unlimited():
+            return count
+        with self.lock:
+            self._refill(self._get_elapsed_time())
+            granted = min(count, int(self.tokens))
+            if granted > 0:
+                self.tokens -= granted
+            return granted
+
+    def get_wait_time(self, count=1):
+        """
+        :return: Seconds until given number of tokens are available at the current rate
+        """
+        if self.start_time is None:
+            self.start()
+        if self.pause_time is not None:
+            return PAUSED_WAIT_TIME
+        if self.profile.is_unlimited():
+            return 0.
+        with self.lock:
+            elapsed = self._get_elapsed_time()
+            self._refill(elapsed)
+            missing = count - self.tokens
+            if missing <= 0:
+                return 0.
+            rate = self.profile.get_rate(elapsed)
+            return missing / rate if rate > 0 else IDLE_WAIT_TIME
+
+    def acquire(self, count=1, max_wait=None):
+        """
+        Wait until given number of tokens are available and take them
+        :param max_wait: Maximum time to wait in seconds, so callers can check their stop conditions
+        :return: Whether tokens are taken, false if maximum wait time passes or the profile finishes
+        """
+        deadline = self.clock() + max_wait if max_wait is not None else None
+        while True:
+            if self.try_acquire(count) == count:
+                return True
+            if self.is_finished():
+                return False
+            wait_time = self.get_wait_time(count)
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            self.wait(wait_time)
+
+    def wait(self, seconds):
+        target = self.clock() + seconds
+        if seconds > SPIN_THRESHOLD:
+            time.sleep(seconds - SPIN_THRESHOLD)
+        while self.clock() < target:
+            pass
+
+
+class TestRateLimiter(unittest.TestCase):
+    class Clock(object):
+        def __init__(self):
+            self.now = 0.
+
+        def __call__(self):
+            return self.now
+
+    def assert_allowance(self, profile, elapsed):
+        # Compare with the numeric integration of the rate
+        step = 0.001
+        integral = sum(profile.get_rate((index + 0.5) * step) * step for index in range(int(elapsed / step)))
+        self.assertAlmostEqual(integral, profile.get_allowance(elapsed), delta=max(1., integral * 0.001))
+
+    def test_allowances(self):
+        self.assert_allowance(ConstantProfile(1000), 2.5)
+        self.assert_allowance(RampProfile(0, 20000, 2), 3.)
+        self.assert_allowance(StepProfile(100, 100, 0.5, 350), 3.2)
+        self.assert_allowance(StepProfile(100, 100, 0.5), 3.2)
+        self.assert_allowance(SpikeProfile(100, 1000, 1., 0.25), 3.6)
+
+    def test_create_profile(self):
+        self.assertEqual(250, create_profile("250").get_rate(0))
+        self.assertEqual(10, create_profile("", 10).get_rate(0))
+        self.assertTrue(create_profile("").is_unlimited())
+        self.assertEqual(10000, create_profile("ramp:0:20000:60").get_rate(30))
+        self.assertEqual(300, create_profile("step:100:100:10:300").get_rate(100))
+        self.assertEqual(1000, create_profile("spike:100:1000:10:1").get_rate(9.5))
+        self.assertTrue(create_profile("soak:100:3600").is_finished(3600))
+        self.assertRaises(ValueError, create_profile, "ramp:0:100")
+        self.assertRaises(ValueError, create_profile, "fast")
+
+    def test_token_bucket(self):
+        clock = TestRateLimiter.Clock()
+        limiter = RateLimiter(ConstantProfile(100), burst=10, clock=clock)
+        limiter.start()
+        self.assertEqual(1, limiter.try_acquire(5))
+        self.assertEqual(0, limiter.try_acquire())
+        clock.now = 0.05
+        self.assertEqual(5, limiter.try_acquire(64))
+        # Unused tokens are capped by the burst
+        clock.now = 10.
+        self.assertEqual(10, limiter.try_acquire(64))
+        self.assertAlmostEqual(0.01, limiter.get_wait_time())
+
+    def test_ramp_from_zero(self):
+        clock = TestRateLimiter.Clock()
+        limiter = RateLimiter(RampProfile(0, 1000, 1), burst=1000, clock=clock)
+        limiter.start()
+        limiter.try_acquire()
+        clock.now = 1.
+        self.assertEqual(500, limiter.try_acquire(1000))
+
+    def test_pause(self):
+        clock = TestRateLimiter.Clock()
+        limiter = RateLimiter(SoakProfile(100, 2), burst=10, clock=clock)
+        limiter.start()
+        limiter.try_acquire()
+        clock.now = 1.
+        self.assertEqual(10, limiter.try_acquire(64))
+        limiter.pause()
+        clock.now = 5.
+        self.assertEqual(0, limiter.try_acquire())
+        self.assertEqual(PAUSED_WAIT_TIME, limiter.get_wait_time())
+        self.assertFalse(limiter.is_finished())
+        limiter.resume()
+        # Profile continues from its first second, tokens are not accumulated while paused
+        self.assertAlmostEqual(1., limiter.get_elapsed_time())
+        self.assertEqual(0, limiter.try_acquire(64))
+        # Times are exact in binary, so the refill is not rounded down
+        clock.now = 5.0625
+        self.assertEqual(6, limiter.try_acquire(64))
+
+    def test_achieved_rate(self):
+        limiter = RateLimiter(ConstantProfile(2000))
+        limiter.start()
+        count = 0
+        while limiter.get_elapsed_time() < 0.5:
+            if limiter.acquire(max_wait=0.01):
+                count += 1
+        self.assertAlmostEqual(1000, count, delta=50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,5 +2,7 @@
     Sniffer Utilities
     It contains necessary functionalities used for sniffers
 
-    1) Generic Sniffer with PyShark
+    1) Generic Sniffer with PyShark (batch, streaming and parallel offline capture)
+    2) Raw Socket Sniffer which decodes CoAP and MQTT packets without tshark
+    3) Capture Splitter which splits capture files on flow boundaries for parallel dissection
 """
\ No newline at end of file
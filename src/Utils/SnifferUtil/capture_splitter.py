@@ -0,0 +1,262 @@
+import heapq
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import unittest
+
+PCAP_HEADER_LENGTH = 24
+PCAP_RECORD_HEADER_LENGTH = 16
+# Byte order of classic pcap files by their magic number with microsecond and nanosecond resolution
+PCAP_BYTE_ORDERS = {"\xd4\xc3\xb2\xa1": "<", "\xa1\xb2\xc3\xd4": ">", "\x4d\x3c\xb2\xa1": "<", "\xa1\xb2\x3c\x4d": ">"}
+
+# Link types which are written by tshark and dumpcap for the interfaces peniot listens
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = 0x8100
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IP_FRAGMENT_OFFSET_MASK = 0x1fff
+IP_MORE_FRAGMENTS = 0x2000
+
+
+def get_ip_packet(link_type, data):
+    """
+    :return: Packet data starting with IP header or None if the frame does not carry IP
+    """
+    if link_type == LINKTYPE_ETHERNET:
+        offset = 12
+        while len(data) >= offset + 2 and struct.unpack_from("!H", data, offset)[0] == ETHERTYPE_VLAN:
+            offset += 4
+        if len(data) < offset + 2 or struct.unpack_from("!H", data, offset)[0] not in (ETHERTYPE_IPV4,
+                                                                                        ETHERTYPE_IPV6):
+            return None
+        return data[offset + 2:]
+    elif link_type == LINKTYPE_LINUX_SLL:
+        if len(data) < 16 or struct.unpack_from("!H", data, 14)[0] not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+        return data[16:]
+    elif link_type == LINKTYPE_NULL:
+        # Address family is in the byte order of capturing host, so IP version of the payload is checked instead
+        return data[4:]
+    elif link_type in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return data
+    return None
+
+
+def get_flow_key(ip_packet, fragment_flows):
+    """
+    Flow of a packet which is the same for both directions of a TCP connection or UDP conversation
+    :param fragment_flows: Flows of fragmented IPv4 datagrams by their identification, following fragments do not
+                           carry ports, so they are assigned to the flow of their first fragment
+    :return: Hashable flow key or None if the packet is not IP
+    """
+    if not ip_packet:
+        return None
+    version = ord(ip_packet[0]) >> 4
+    if version == 4 and len(ip_packet) >= 20:
+        header_length = (ord(ip_packet[0]) & 0x0F) * 4
+        identification, fragment = struct.unpack_from("!HH", ip_packet, 4)
+        protocol = ord(ip_packet[9])
+        source, destination = ip_packet[12:16], ip_packet[16:20]
+        fragment_id = (source, destination, protocol, identification)
+        if fragment & IP_FRAGMENT_OFFSET_MASK:
+            return fragment_flows.get(fragment_id, (protocol,) + tuple(sorted([source, destination])))
+    elif version == 6 and len(ip_packet) >= 40:
+        # Extension headers are not followed, such packets are grouped by their addresses only
+        header_length = 40
+        fragment, fragment_id = 0, None
+        protocol = ord(ip_packet[6])
+        source, destination = ip_packet[8:24], ip_packet[24:40]
+    else:
+        return None
+
+    segment = ip_packet[header_length:]
+    if protocol in (IPPROTO_TCP, IPPROTO_UDP) and len(segment) >= 4:
+        source_port, destination_port = struct.unpack_from("!HH", segment)
+        flow_key = (protocol,) + tuple(sorted([(source, source_port), (destination, destination_port)]))
+    else:
+        flow_key = (protocol,) + tuple(sorted([source, destination]))
+    if fragment & IP_MORE_FRAGMENTS:
+        fragment_flows[fragment_id] = flow_key
+    return flow_key
+
+
+def read_pcap_records(capture_file, byte_order):
+    """
+    :param capture_file: Classic pcap file which is positioned right after its file header
+    :return: Generator of record header and packet data tuples, a truncated last record is ignored
+    """
+    while True:
+        record_header = capture_file.read(PCAP_RECORD_HEADER_LENGTH)
+        if len(record_header) < PCAP_RECORD_HEADER_LENGTH:
+            return
+        captured_length = struct.unpack(byte_order + "IIII", record_header)[2]
+        data = capture_file.read(captured_length)
+        if len(data) < captured_length:
+            return
+        yield record_header, data
+
+
+def read_pcap_flows(input_filename):
+    """
+    :return: Flow index of each packet and packet counts of flows in the order their first packets appear
+    """
+    flow_indexes = {}
+    flow_sizes = []
+    packet_flows = []
+    fragment_flows = {}
+    with open(input_filename, "rb") as capture_file:
+        file_header = capture_file.read(PCAP_HEADER_LENGTH)
+        byte_order = PCAP_BYTE_ORDERS[file_header[:4]]
+        link_type = struct.unpack_from(byte_order + "I", file_header, 20)[0] & 0x0FFFFFFF
+        for _, data in read_pcap_records(capture_file, byte_order):
+            flow_key = get_flow_key(get_ip_packet(link_type, data), fragment_flows)
+            flow_index = flow_indexes.get(flow_key)
+            if flow_index is None:
+                flow_index = flow_indexes[flow_key] = len(flow_sizes)
+                flow_sizes.append(0)
+            flow_sizes[flow_index] += 1
+            packet_flows.append(flow_index)
+    return packet_flows, flow_sizes
+
+
+def assign_flows_to_chunks(flow_sizes, chunk_count):
+    """
+    Distribute flows to chunks so that chunks have similar number of packets, largest flows are placed first
+    :return: Chunk index of each flow
+    """
+    flow_chunks = [0] * len(flow_sizes)
+    chunk_sizes = [(0, chunk_index) for chunk_index in range(chunk_count)]
+    for flow_index in sorted(range(len(flow_sizes)), key=lambda _: flow_sizes[_], reverse=True):
+        chunk_size, chunk_index = heapq.heappop(chunk_sizes)
+        flow_chunks[flow_index] = chunk_index
+        heapq.heappush(chunk_sizes, (chunk_size + flow_sizes[flow_index], chunk_index))
+    return flow_chunks
+
+
+def split_capture_file(input_filename, output_dir, packets_per_chunk):
+    """
+    Split capture file into chunks on flow boundaries
+    All packets of a TCP connection or UDP conversation are written to the same chunk in their original order,
+    so tshark still reassembles MQTT and AMQP messages which span several segments. A flow is never divided,
+    hence a chunk has more than packets_per_chunk packets when a single flow is larger than that.
+    pcapng files are converted to pcap by editcap, which comes with tshark, before splitting.
+    :return: Chunk file names, packets of different chunks are interleaved in time
+    """
+    with open(input_filename, "rb") as capture_file:
+        magic = capture_file.read(4)
+    if magic not in PCAP_BYTE_ORDERS:
+        converted_filename = os.path.join(output_dir, "converted.pcap")
+        subprocess.check_call(["editcap", "-F", "pcap", input_filename, converted_filename])
+        input_filename = converted_filename
+
+    packet_flows, flow_sizes = read_pcap_flows(input_filename)
+    chunk_count = max(1, min(len(flow_sizes), (len(packet_flows) + packets_per_chunk - 1) // packets_per_chunk))
+    flow_chunks = assign_flows_to_chunks(flow_sizes, chunk_count)
+
+    chunk_filenames = [os.path.join(output_dir, "chunk_{0:05d}.pcap".format(chunk_index))
+                       for chunk_index in range(chunk_count)]
+    chunk_files = []
+    try:
+        with open(input_filename, "rb") as capture_file:
+            file_header = capture_file.read(PCAP_HEADER_LENGTH)
+            for chunk_filename in chunk_filenames:
+                chunk_files.append(open(chunk_filename, "wb"))
+                chunk_files[-1].write(file_header)
+            byte_order = PCAP_BYTE_ORDERS[file_header[:4]]
+            for flow_index, (record_header, data) in zip(packet_flows, read_pcap_records(capture_file, byte_order)):
+                chunk_file = chunk_files[flow_chunks[flow_index]]
+                chunk_file.write(record_header)
+                chunk_file.write(data)
+    finally:
+        for chunk_file in chunk_files:
+            chunk_file.close()
+    return chunk_filenames
+
+
+class TestCaptureSplitter(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix="peniot-split-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    @staticmethod
+    def build_frame(protocol, source, destination, identification=0, fragment=0, payload="payload"):
+        source_address, source_port = source
+        destination_address, destination_port = destination
+        if fragment & IP_FRAGMENT_OFFSET_MASK:
+            segment = payload
+        else:
+            segment = struct.pack("!HH", source_port, destination_port) + "\x00" * 16 + payload
+        ip_packet = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(segment), identification, fragment, 64,
+                                protocol, 0, socket.inet_aton(source_address),
+                                socket.inet_aton(destination_address)) + segment
+        return "\x00" * 12 + struct.pack("!H", ETHERTYPE_IPV4) + ip_packet
+
+    def write_capture(self, frames):
+        input_filename = os.path.join(self.output_dir, "input.pcap")
+        with open(input_filename, "wb") as capture_file:
+            capture_file.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+            for timestamp, frame in enumerate(frames):
+                capture_file.write(struct.pack("<IIII", timestamp, 0, len(frame), len(frame)))
+                capture_file.write(frame)
+        return input_filename
+
+    @staticmethod
+    def read_chunk(chunk_filename):
+        with open(chunk_filename, "rb") as chunk_file:
+            chunk_file.read(PCAP_HEADER_LENGTH)
+            return [data for _, data in read_pcap_records(chunk_file, "<")]
+
+    def test_tcp_streams_are_not_split(self):
+        client_1, client_2 = ("10.0.0.1", 40001), ("10.0.0.1", 40002)
+        broker = ("10.0.0.2", 1883)
+        frames = []
+        for index in range(10):
+            frames.append(self.build_frame(IPPROTO_TCP, client_1, broker, payload="first-%d" % index))
+            frames.append(self.build_frame(IPPROTO_TCP, broker, client_1, payload="first-ack-%d" % index))
+            frames.append(self.build_frame(IPPROTO_TCP, client_2, broker, payload="second-%d" % index))
+        frames.append("\xff" * 14)
+
+        chunk_filenames = split_capture_file(self.write_capture(frames), self.output_dir, packets_per_chunk=4)
+        chunks = [self.read_chunk(chunk_filename) for chunk_filename in chunk_filenames]
+
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(sorted(frames), sorted(sum(chunks, [])))
+        for chunk in chunks:
+            # Each chunk keeps the original order of its packets
+            self.assertEqual(sorted(chunk, key=frames.index), chunk)
+        first_stream = [frame for frame in frames if "first" in frame]
+        second_stream = [frame for frame in frames if "second" in frame]
+        self.assertIn(first_stream, chunks)
+        self.assertIn(second_stream, chunks)
+
+    def test_fragments_follow_their_flow(self):
+        client, server = ("10.0.0.1", 50000), ("10.0.0.2", 5683)
+        frames = [
+            self.build_frame(IPPROTO_UDP, client, server, identification=7, fragment=IP_MORE_FRAGMENTS),
+            self.build_frame(IPPROTO_UDP, ("10.0.0.3", 50001), server),
+            self.build_frame(IPPROTO_UDP, client, server, identification=7, fragment=4),
+        ]
+        packet_flows, flow_sizes = read_pcap_flows(self.write_capture(frames))
+        self.assertEqual([0, 1, 0], packet_flows)
+        self.assertEqual([2, 1], flow_sizes)
+
+    def test_assign_flows_to_chunks(self):
+        self.assertEqual([0, 1, 1, 1], assign_flows_to_chunks([5, 2, 2, 1], 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
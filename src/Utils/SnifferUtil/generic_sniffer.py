@@ -1,8 +1,20 @@
 import logging
+import multiprocessing
 import os
+import pickle
+import Queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
 
 import pyshark
 from Utils.FilterUtil import pyshark_filter_util as pyshark_filter_util
+from Utils.SnifferUtil import capture_splitter as capture_splitter
+from Utils.SnifferUtil import raw_socket_sniffer as raw_socket_sniffer
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s : %(message)s")
 logger = logging.getLogger("Generic Sniffer")
@@ -11,6 +23,16 @@ DEFAULT_INTERFACE = "any"
 DEFAULT_SNIFF_TIMEOUT = 15.
 DEFAULT_SAVE = False
 DEFAULT_SAVE_DIR = os.path.dirname(os.path.abspath(__file__)) + "/../../captured_packets/"
+DEFAULT_QUEUE_SIZE = 10000
+QUEUE_POLL_INTERVAL = 0.5
+PRODUCER_JOIN_TIMEOUT = 2.
+# Number of the most recent packets which sniff attacks keep to report
+RECENT_PACKET_COUNT = 100
+DEFAULT_PACKETS_PER_CHUNK = 20000
+
+# Capture backends
+PYSHARK_BACKEND = "pyshark"
+RAW_SOCKET_BACKEND = "raw_socket"
 
 
 def filter_packets_by_filter_list(packets, filter_list):
@@ -20,10 +42,54 @@ def filter_packets_by_filter_list(packets, filter_list):
     :type filter_list: list of pyshark_filter_util.PySharkFilter
     :return: Filtered packets as list
     """
+    return pyshark_filter_util.compile_filter_list(filter_list).filter_packets(packets)
+
+
+def get_capture_file_path(filename, input_dir=DEFAULT_SAVE_DIR):
+    """
+    :param filename: Absolute path or name of a file under captured packets directory
+    :return: Path of the capture file
+    """
+    if os.path.isabs(filename) or os.path.exists(filename):
+        return filename
+    return os.path.join(input_dir, filename)
+
+
+def dissect_capture_chunk(arguments):
+    """
+    Dissect a single chunk in a worker process
+    :param arguments: Tuple of chunk file name, display filter, packet filter, use json and include raw flags
+    :return: Pickled packet list, protocol 0 is used since pyshark fields cannot be restored from binary protocols
+    """
+    chunk_filename, display_filter, packet_filter, use_json, include_raw = arguments
+    capture = pyshark.FileCapture(chunk_filename, keep_packets=False, display_filter=display_filter,
+                                  use_json=use_json, include_raw=include_raw)
+    try:
+        packets = [packet for packet in capture if packet_filter is None or packet_filter(packet)]
+    finally:
+        capture.close()
+    return pickle.dumps(packets, 0)
+
+
+def interrupt_capture(capture):
+    """
+    End a capture which is being read by another thread
+    pyshark's close runs the event loop of the reading thread, so it cannot be called from here. Killing tshark
+    closes its output instead and the reading thread returns from sniff_continuously, then it closes the capture.
+    Raw socket capture does not have a tshark process, it checks the stop event at each socket poll instead.
+    """
+    for process in list(getattr(capture, "_running_processes", ())):
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
 
-    filtered_packets = [packet for packet in packets
-                        if all(single_filter.apply_filter_to_packet(packet) for single_filter in filter_list)]
-    return filtered_packets
+
+def get_packet_timestamp(packet):
+    try:
+        return float(packet.sniff_timestamp)
+    except (TypeError, ValueError):
+        return 0.
 
 
 class GenericSniffer:
@@ -35,9 +101,30 @@ class GenericSniffer:
     """
 
     def __init__(self, timeout=DEFAULT_SNIFF_TIMEOUT, interface=DEFAULT_INTERFACE, use_json=False, include_raw=False,
-                 output_pcap_filename=None, output_dir=DEFAULT_SAVE_DIR, display_filter=None):
+                 output_pcap_filename=None, output_dir=DEFAULT_SAVE_DIR, display_filter=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, filter_list=None, capture_backend=PYSHARK_BACKEND,
+                 tcp_ports=(), udp_ports=()):
+        """
+        :param capture_backend: Either tshark over pyshark or raw socket capture which decodes packets in Python,
+                                raw socket backend ignores display filter and captures given ports instead
+        :param tcp_ports: Ports whose TCP payloads are decoded as MQTT by raw socket backend
+        :param udp_ports: Ports whose UDP payloads are decoded as CoAP by raw socket backend
+        :param filter_list: Optional filters which captured packets have to pass, they are compiled into
+                            a single predicate and pushed down into the display filter as far as tshark allows
+        :type filter_list: list of pyshark_filter_util.PySharkFilter
+        """
         self.captured_packets = None
 
+        # Streaming capture members
+        self.queue_size = queue_size
+        self.received_packet_count = 0
+        self.dropped_packet_count = 0
+        self.stop_event = threading.Event()
+
+        self.capture_backend = capture_backend
+        self.tcp_ports = tcp_ports
+        self.udp_ports = udp_ports
+
         self.timeout = timeout
         self.interface = interface
         self.use_json = use_json
@@ -49,20 +136,151 @@ class GenericSniffer:
             self.output_pcap_filename = "{0}{1}{2}".format(output_dir, output_pcap_filename,
                                                            ("" if output_pcap_filename.endswith(".pcap") else ".pcap"))
 
-        self.display_filter = display_filter
+        if filter_list:
+            self.packet_filter = pyshark_filter_util.compile_filter_list(filter_list)
+            self.display_filter = self.packet_filter.combine_display_filter(display_filter)
+        else:
+            self.packet_filter = None
+            self.display_filter = display_filter
+
+    def create_live_capture(self):
+        if self.capture_backend == RAW_SOCKET_BACKEND:
+            return raw_socket_sniffer.RawSocketCapture(interface=self.interface, tcp_ports=self.tcp_ports,
+                                                       udp_ports=self.udp_ports, output_file=self.output_pcap_filename,
+                                                       stop_event=self.stop_event)
+        return pyshark.LiveCapture(interface=self.interface, use_json=self.use_json, include_raw=self.include_raw,
+                                   output_file=self.output_pcap_filename, display_filter=self.display_filter)
 
     def start_live_capture(self):
         """
         Start capture procedure of packets over listener
         :return: None since captured packets are saved internally
         """
-        capture = pyshark.LiveCapture(interface=self.interface, use_json=self.use_json, include_raw=self.include_raw,
-                                      output_file=self.output_pcap_filename, display_filter=self.display_filter)
+        capture = self.create_live_capture()
         capture.sniff(timeout=self.timeout)
         self.captured_packets = capture._packets
+        if self.packet_filter is not None:
+            self.captured_packets = self.packet_filter.filter_packets(self.captured_packets)
         logger.info("{0} packets are captured.".format(len(self.captured_packets)))
         capture.close()
 
+    def _produce_packets(self, capture, packet_queue, finished_event):
+        """
+        Move packets from tshark to the bounded queue, packets are dropped if the consumer cannot keep up
+        """
+        try:
+            for packet in capture.sniff_continuously():
+                if self.stop_event.is_set():
+                    break
+                if self.packet_filter is not None and not self.packet_filter(packet):
+                    continue
+                self.received_packet_count += 1
+                try:
+                    packet_queue.put_nowait(packet)
+                except Queue.Full:
+                    self.dropped_packet_count += 1
+        except Exception as e:
+            # Capture is interrupted on purpose when it is stopped
+            if not self.stop_event.is_set():
+                logger.error("Streaming capture is interrupted: {0}".format(e))
+        finally:
+            finished_event.set()
+            capture.close()
+
+    def iter_live_capture(self):
+        """
+        Streaming capture procedure which yields packets as tshark decodes them
+        Packets are not stored, so memory usage is bounded by the queue size whatever the capture duration is.
+        Capture ends when timeout passes, if timeout is not None, or when stop_live_capture is called.
+        :return: Generator of captured packets
+        """
+        self.stop_event.clear()
+        self.received_packet_count = 0
+        self.dropped_packet_count = 0
+
+        packet_queue = Queue.Queue(maxsize=self.queue_size)
+        finished_event = threading.Event()
+        capture = self.create_live_capture()
+        producer = threading.Thread(target=self._produce_packets, args=(capture, packet_queue, finished_event))
+        producer.daemon = True
+        producer.start()
+
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        try:
+            while not self.stop_event.is_set():
+                wait_time = QUEUE_POLL_INTERVAL
+                if deadline is not None:
+                    wait_time = min(wait_time, deadline - time.time())
+                    if wait_time <= 0:
+                        break
+                try:
+                    yield packet_queue.get(timeout=wait_time)
+                except Queue.Empty:
+                    if finished_event.is_set():
+                        break
+        finally:
+            # Producer may be waiting for a packet which never comes on a quiet link, so the capture is interrupted
+            self.stop_event.set()
+            interrupt_capture(capture)
+            producer.join(PRODUCER_JOIN_TIMEOUT)
+            logger.info("{0} packets are captured, {1} of them are dropped.".format(self.received_packet_count,
+                                                                                   self.dropped_packet_count))
+
+    def start_streaming_capture(self, callback):
+        """
+        Streaming capture procedure which calls the callback for each packet as it arrives
+        :param callback: Function which takes a packet as its single argument
+        """
+        for packet in self.iter_live_capture():
+            callback(packet)
+
+    def stop_live_capture(self):
+        """
+        Stop streaming capture, it is safe to call from another thread
+        """
+        self.stop_event.set()
+
+    def get_dropped_packet_count(self):
+        return self.dropped_packet_count
+
+    def start_offline_capture(self, input_filename, packets_per_chunk=DEFAULT_PACKETS_PER_CHUNK, worker_count=None):
+        """
+        Dissect a saved capture file in parallel
+        The file is split into chunks which are dissected by separate tshark processes on all cores,
+        then the results are merged back in timestamp order. Chunks are split on TCP connections and
+        UDP conversations, so messages which span several segments are reassembled as in a single pass.
+        :param input_filename: Absolute path or name of a file under captured packets directory
+        :param packets_per_chunk: Number of packets in each chunk, a chunk is larger if one of its flows is larger
+        :param worker_count: Number of parallel workers, number of cores is used by default
+        :return: None since captured packets are saved internally
+        """
+        input_filename = get_capture_file_path(input_filename)
+        if worker_count is None:
+            worker_count = multiprocessing.cpu_count()
+
+        chunk_dir = tempfile.mkdtemp(prefix="peniot-chunks-")
+        try:
+            chunk_filenames = capture_splitter.split_capture_file(input_filename, chunk_dir, packets_per_chunk)
+            logger.info("{0} is split into {1} chunks.".format(input_filename, len(chunk_filenames)))
+            arguments = [(chunk_filename, self.display_filter, self.packet_filter, self.use_json, self.include_raw)
+                         for chunk_filename in chunk_filenames]
+            pool = multiprocessing.Pool(max(1, min(worker_count, len(chunk_filenames))))
+            try:
+                pickled_chunks = pool.map(dissect_capture_chunk, arguments)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+        packets = []
+        for pickled_chunk in pickled_chunks:
+            packets.extend(pickle.loads(pickled_chunk))
+        # Each chunk is in timestamp order, so sorting only merges them
+        packets.sort(key=get_packet_timestamp)
+        self.captured_packets = packets
+        logger.info("{0} packets are dissected.".format(len(self.captured_packets)))
+
     def get_captured_packets(self):
         """
         :return: Captured packets as list
@@ -81,6 +299,64 @@ class GenericSniffer:
             return filter(lambda packet: protocol in str(packet.layers), self.captured_packets)
 
 
+class TestGenericSniffer(unittest.TestCase):
+    class QuietCapture(object):
+        """
+        Capture which waits for output of a silent process like tshark does on a link without traffic
+        """
+
+        def __init__(self, packets=()):
+            self.packets = packets
+            self.process = subprocess.Popen(["sleep", "60"], stdout=subprocess.PIPE)
+            self._running_processes = {self.process}
+            self.closed = False
+
+        def sniff_continuously(self):
+            for packet in self.packets:
+                yield packet
+            # Blocks until the process is killed
+            self.process.stdout.read()
+
+        def close(self):
+            self.process.wait()
+            self.closed = True
+
+    class QuietSniffer(GenericSniffer):
+        def __init__(self, packets=(), **kwargs):
+            GenericSniffer.__init__(self, **kwargs)
+            self.packets = packets
+            self.capture = None
+
+        def create_live_capture(self):
+            self.capture = TestGenericSniffer.QuietCapture(self.packets)
+            return self.capture
+
+    def test_stop_on_quiet_link(self):
+        sniffer = self.QuietSniffer(packets=["first", "second"], timeout=None)
+        received = []
+
+        def consume():
+            for packet in sniffer.iter_live_capture():
+                received.append(packet)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        time.sleep(QUEUE_POLL_INTERVAL)
+        sniffer.stop_live_capture()
+        consumer.join(QUEUE_POLL_INTERVAL + PRODUCER_JOIN_TIMEOUT)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(["first", "second"], received)
+        self.assertTrue(sniffer.capture.closed)
+
+    def test_timeout_on_quiet_link(self):
+        sniffer = self.QuietSniffer(timeout=QUEUE_POLL_INTERVAL)
+        start_time = time.time()
+        self.assertEqual([], list(sniffer.iter_live_capture()))
+        self.assertLess(time.time() - start_time, QUEUE_POLL_INTERVAL + PRODUCER_JOIN_TIMEOUT)
+        self.assertTrue(sniffer.capture.closed)
+
+
 if __name__ == '__main__':
     sniffer = GenericSniffer()
     sniffer.start_live_capture()
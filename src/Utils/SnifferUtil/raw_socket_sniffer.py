@@ -0,0 +1,531 @@
+import ctypes
+import logging
+import socket
+import struct
+import time
+import unittest
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s : %(message)s")
+logger = logging.getLogger("Raw Socket Sniffer")
+
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+PACKET_OUTGOING = 4
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+MAX_PACKET_SIZE = 65535
+SOCKET_POLL_INTERVAL = 0.5
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+# Classic BPF instruction classes and modes which are needed by the port filter
+BPF_LD_B_ABS = 0x30
+BPF_LD_H_ABS = 0x28
+BPF_LD_H_IND = 0x48
+BPF_LDX_B_MSH = 0xb1
+BPF_JEQ_K = 0x15
+BPF_JSET_K = 0x45
+BPF_RET_K = 0x06
+
+IP_FRAGMENT_OFFSET_MASK = 0x1fff
+
+# Link type of pcap files whose packets start with IP header
+LINKTYPE_RAW = 101
+PCAP_MAGIC = 0xa1b2c3d4
+
+MQTT_PUBLISH = 3
+MQTT_CONNECT = 1
+
+
+def assemble_port_filter(tcp_ports=(), udp_ports=()):
+    """
+    Assemble classic BPF program which accepts IPv4 TCP and UDP packets from or to given ports
+    Program runs on packets starting with IP header, as delivered to datagram packet sockets.
+    Non-first fragments are rejected since they have no transport header.
+    :return: List of (code, jt, jf, k) instructions
+    """
+    # Instructions are built with symbolic jump targets which are resolved at the end
+    program = []
+    labels = {}
+
+    for protocol, ports in ((IPPROTO_TCP, tcp_ports), (IPPROTO_UDP, udp_ports)):
+        if len(ports) == 0:
+            continue
+        next_block = "after_{0}".format(protocol)
+        program.append((BPF_LD_B_ABS, None, None, 9))
+        program.append((BPF_JEQ_K, 0, next_block, protocol))
+        program.append((BPF_LD_H_ABS, None, None, 6))
+        program.append((BPF_JSET_K, "reject", 0, IP_FRAGMENT_OFFSET_MASK))
+        program.append((BPF_LDX_B_MSH, None, None, 0))
+        for offset in (0, 2):  # Source port and destination port
+            program.append((BPF_LD_H_IND, None, None, offset))
+            for port in ports:
+                program.append((BPF_JEQ_K, "accept", 0, port))
+        program.append((BPF_RET_K, None, None, 0))
+        labels[next_block] = len(program)
+    labels["reject"] = len(program)
+    program.append((BPF_RET_K, None, None, 0))
+    labels["accept"] = len(program)
+    program.append((BPF_RET_K, None, None, MAX_PACKET_SIZE))
+
+    def resolve(target, index):
+        if target is None:
+            return 0
+        if target in labels:
+            target = labels[target] - index - 1
+        assert 0 <= target < 256, "Port filter is too long for classic BPF jumps"
+        return target
+
+    return [(code, resolve(jt, index), resolve(jf, index), k) for index, (code, jt, jf, k) in enumerate(program)]
+
+
+def attach_filter(sock, program):
+    """
+    Attach given BPF program to the socket, so unwanted packets are discarded in kernel
+    """
+    instructions = ctypes.create_string_buffer("".join(struct.pack("HBBI", *instruction)
+                                                       for instruction in program))
+    fprog = struct.pack("HL", len(program), ctypes.addressof(instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+class RawField(str):
+    """
+    Field of a raw packet which behaves like pyshark's field containers
+    Its string value is the displayed value and raw_value is the hex dump of the bytes on the wire.
+    """
+
+    def __new__(cls, show, wire_bytes):
+        field = str.__new__(cls, show)
+        field.raw_value = unicode(wire_bytes.encode("hex"))
+        return field
+
+    @property
+    def show(self):
+        return str(self)
+
+    @property
+    def main_field(self):
+        return self
+
+    @property
+    def value(self):
+        return [self.raw_value]
+
+
+class RawLayer:
+    """
+    Decoded layer of a raw packet, fields are accessible as attributes like pyshark layers
+    """
+
+    def __init__(self, layer_name):
+        self.layer_name = layer_name
+        self._all_fields = {}
+
+    def add_field(self, name, show, wire_bytes):
+        self._all_fields[name] = RawField(show, wire_bytes)
+
+    def get_field(self, name):
+        return self._all_fields.get(name.replace(".", "_"))
+
+    def get_field_value(self, name, raw=False):
+        field = self.get_field(name)
+        if field is None or not raw:
+            return field
+        return field.raw_value
+
+    @property
+    def field_names(self):
+        return self._all_fields.keys()
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        field = self.get_field(item)
+        if field is None:
+            raise AttributeError(item)
+        return field
+
+    def __repr__(self):
+        return "<{0} Layer>".format(self.layer_name.upper())
+
+    def __str__(self):
+        lines = ["Layer {0}:".format(self.layer_name.upper())]
+        lines += ["\t{0}: {1}".format(name, field) for name, field in sorted(self._all_fields.items())]
+        return "\n".join(lines)
+
+
+class RawPacket:
+    """
+    Packet decoded from raw bytes, it exposes layers the way pyshark packets do
+    Raw bytes of the frame and the application layer are kept as frame_raw and <protocol>_raw layers,
+    so the helpers of the scanners which expect json with raw packets work with it as well.
+    """
+
+    def __init__(self, data, sniff_timestamp, interface_captured=None):
+        self.data = data
+        self.sniff_timestamp = "{0:.6f}".format(sniff_timestamp)
+        self.interface_captured = interface_captured
+        self.length = len(data)
+        self.layers = []
+
+    def add_layer(self, layer, raw_bytes=None):
+        self.layers.append(layer)
+        if raw_bytes is not None:
+            raw_layer = RawLayer(layer.layer_name + "_raw")
+            raw_layer.value = [raw_bytes.encode("hex")]
+            self.layers.append(raw_layer)
+
+    @property
+    def highest_layer(self):
+        return [layer for layer in self.layers if not layer.layer_name.endswith("_raw")][-1].layer_name.upper()
+
+    @property
+    def frame_raw(self):
+        raw_layer = RawLayer("frame_raw")
+        raw_layer.value = [self.data.encode("hex")]
+        return raw_layer
+
+    def __getitem__(self, item):
+        if isinstance(item, int):
+            return self.layers[item]
+        for layer in self.layers:
+            if layer.layer_name == item.lower():
+                return layer
+        raise KeyError("Layer does not exist in packet")
+
+    def __contains__(self, item):
+        try:
+            self[item]
+            return True
+        except KeyError:
+            return False
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        for layer in self.layers:
+            if layer.layer_name == item:
+                return layer
+        raise AttributeError(item)
+
+    def __str__(self):
+        layers = [str(layer) for layer in self.layers if not layer.layer_name.endswith("_raw")]
+        return "\n".join(["Packet (Length: {0})".format(self.length)] + layers)
+
+
+def parse_coap(payload):
+    """
+    :return: CoAP layer or None if payload is not a CoAP message
+    """
+    if len(payload) < 4:
+        return None
+    first_byte, code = ord(payload[0]), ord(payload[1])
+    token_length = first_byte & 0x0F
+    if first_byte >> 6 != 1 or token_length > 8 or len(payload) < 4 + token_length:
+        return None
+    layer = RawLayer("coap")
+    layer.add_field("version", "1", payload[0])
+    layer.add_field("type", str((first_byte >> 4) & 0x03), payload[0])
+    layer.add_field("token_len", str(token_length), payload[0])
+    layer.add_field("code", str(code), payload[1])
+    layer.add_field("mid", str(struct.unpack_from("!H", payload, 2)[0]), payload[2:4])
+    token = payload[4:4 + token_length]
+    layer.add_field("token", token.encode("hex"), token)
+
+    position = 4 + token_length
+    option_number = 0
+    uri_path = []
+    try:
+        while position < len(payload):
+            if payload[position] == "\xff":
+                layer.add_field("payload", payload[position + 1:], payload[position + 1:])
+                break
+            delta, length = ord(payload[position]) >> 4, ord(payload[position]) & 0x0F
+            position += 1
+            extended = []
+            for nibble in (delta, length):
+                if nibble == 13:
+                    extended.append(ord(payload[position]) + 13)
+                    position += 1
+                elif nibble == 14:
+                    extended.append(struct.unpack_from("!H", payload, position)[0] + 269)
+                    position += 2
+                elif nibble == 15:
+                    return None
+                else:
+                    extended.append(nibble)
+            option_number += extended[0]
+            value = payload[position:position + extended[1]]
+            if len(value) < extended[1]:
+                return None
+            if option_number == 11:  # Uri-Path
+                uri_path.append(value)
+            position += extended[1]
+    except (IndexError, struct.error):
+        return None
+    if len(uri_path) > 0:
+        layer.add_field("opt_uri_path", "/".join(uri_path), "/".join(uri_path))
+    return layer
+
+
+def parse_mqtt(payload):
+    """
+    Parse the first MQTT control packet of the segment, segments are not reassembled
+    :return: MQTT layer or None if payload does not start with a MQTT control packet
+    """
+    if len(payload) < 2:
+        return None
+    first_byte = ord(payload[0])
+    message_type = first_byte >> 4
+    if message_type == 0:
+        return None
+    remaining_length, multiplier, position = 0, 1, 1
+    while True:
+        if position >= len(payload) or position > 4:
+            return None
+        byte = ord(payload[position])
+        remaining_length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        position += 1
+        if byte & 0x80 == 0:
+            break
+    end = min(len(payload), position + remaining_length)
+
+    layer = RawLayer("mqtt")
+    layer.add_field("hdrflags", "0x{0:02x}".format(first_byte), payload[0])
+    layer.add_field("msgtype", str(message_type), payload[0])
+    layer.add_field("len", str(remaining_length), payload[1:position])
+    try:
+        if message_type == MQTT_PUBLISH:
+            qos = (first_byte >> 1) & 0x03
+            layer.add_field("dupflag", str(first_byte >> 3 & 0x01), payload[0])
+            layer.add_field("qos", str(qos), payload[0])
+            layer.add_field("retain", str(first_byte & 0x01), payload[0])
+            topic_length = struct.unpack_from("!H", payload, position)[0]
+            layer.add_field("topic_len", str(topic_length), payload[position:position + 2])
+            topic = payload[position + 2:position + 2 + topic_length]
+            layer.add_field("topic", topic, topic)
+            position += 2 + topic_length
+            if qos > 0:
+                layer.add_field("msgid", str(struct.unpack_from("!H", payload, position)[0]),
+                                payload[position:position + 2])
+                position += 2
+            layer.add_field("msg", payload[position:end], payload[position:end])
+        elif message_type == MQTT_CONNECT:
+            name_length = struct.unpack_from("!H", payload, position)[0]
+            name = payload[position + 2:position + 2 + name_length]
+            layer.add_field("proto_name", name, name)
+            position += 2 + name_length
+            layer.add_field("ver", str(ord(payload[position])), payload[position])
+            layer.add_field("conflags", "0x{0:02x}".format(ord(payload[position + 1])), payload[position + 1])
+            position += 4  # Protocol level, connect flags and keep alive
+            client_id_length = struct.unpack_from("!H", payload, position)[0]
+            client_id = payload[position + 2:position + 2 + client_id_length]
+            layer.add_field("clientid", client_id, client_id)
+    except (IndexError, struct.error):
+        # Rest of the packet is in the next segment, fixed header is still worth reporting
+        pass
+    return layer
+
+
+def parse_packet(data, sniff_timestamp, tcp_ports=(), udp_ports=(), interface_captured=None):
+    """
+    Decode IPv4, TCP/UDP and CoAP/MQTT headers of a packet which starts with IP header
+    UDP payloads on given UDP ports are parsed as CoAP, TCP payloads on given TCP ports are parsed as MQTT.
+    :return: RawPacket or None if packet does not carry a parsable application layer
+    """
+    if len(data) < 20 or ord(data[0]) >> 4 != 4:
+        return None
+    header_length = (ord(data[0]) & 0x0F) * 4
+    total_length = struct.unpack_from("!H", data, 2)[0]
+    data = data[:total_length]
+    protocol = ord(data[9])
+
+    packet = RawPacket(data, sniff_timestamp, interface_captured)
+    ip = RawLayer("ip")
+    ip.add_field("version", "4", data[0])
+    ip.add_field("hdr_len", str(header_length), data[0])
+    ip.add_field("len", str(total_length), data[2:4])
+    ip.add_field("ttl", str(ord(data[8])), data[8])
+    ip.add_field("proto", str(protocol), data[9])
+    for name, wire_bytes in (("src", data[12:16]), ("dst", data[16:20])):
+        address = socket.inet_ntoa(wire_bytes)
+        ip.add_field(name, address, wire_bytes)
+        ip.add_field(name + "_host", address, wire_bytes)
+    packet.add_layer(ip)
+
+    segment = data[header_length:]
+    try:
+        source_port, destination_port = struct.unpack_from("!HH", segment)
+    except struct.error:
+        return None
+    if protocol == IPPROTO_UDP:
+        transport = RawLayer("udp")
+        transport.add_field("length", str(struct.unpack_from("!H", segment, 4)[0]), segment[4:6])
+        application_payload = segment[8:]
+        ports = udp_ports
+        parse_application = parse_coap
+    elif protocol == IPPROTO_TCP and len(segment) >= 20:
+        transport = RawLayer("tcp")
+        data_offset = (ord(segment[12]) >> 4) * 4
+        transport.add_field("seq", str(struct.unpack_from("!I", segment, 4)[0]), segment[4:8])
+        transport.add_field("flags", "0x{0:03x}".format(struct.unpack_from("!H", segment, 12)[0] & 0x0FFF),
+                            segment[12:14])
+        application_payload = segment[data_offset:]
+        ports = tcp_ports
+        parse_application = parse_mqtt
+    else:
+        return None
+    transport.add_field("srcport", str(source_port), segment[0:2])
+    transport.add_field("dstport", str(destination_port), segment[2:4])
+    packet.add_layer(transport)
+
+    if source_port not in ports and destination_port not in ports:
+        return None
+    application = parse_application(application_payload)
+    if application is None:
+        return None
+    packet.add_layer(application, application_payload)
+    return packet
+
+
+class RawSocketCapture:
+    """
+    Live capture over a Linux datagram packet socket
+    It has the same interface with pyshark's LiveCapture as far as GenericSniffer uses it, but packets are
+    filtered by a BPF port filter in kernel and decoded in Python, so there is no tshark process in between.
+    """
+
+    def __init__(self, interface="any", tcp_ports=(), udp_ports=(), output_file=None, stop_event=None):
+        """
+        :param interface: Interface name, "any" listens all interfaces
+        :param output_file: Optional pcap file which accepted packets are written to
+        :param stop_event: Optional threading event which ends continuous sniffing
+        """
+        self.interface = interface
+        self.tcp_ports = tuple(tcp_ports)
+        self.udp_ports = tuple(udp_ports)
+        self.output_file = output_file
+        self.stop_event = stop_event
+
+        self.sock = None
+        self.output = None
+        self._packets = []
+
+    def _open(self):
+        if self.sock is not None:
+            return
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_IP))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        attach_filter(self.sock, assemble_port_filter(self.tcp_ports, self.udp_ports))
+        if self.interface not in (None, "any"):
+            self.sock.bind((self.interface, ETH_P_IP))
+        self.sock.settimeout(SOCKET_POLL_INTERVAL)
+        if self.output_file is not None:
+            self.output = open(self.output_file, "wb")
+            self.output.write(struct.pack("IHHiIII", PCAP_MAGIC, 2, 4, 0, 0, MAX_PACKET_SIZE, LINKTYPE_RAW))
+
+    def _receive(self):
+        """
+        :return: Decoded packet or None if nothing to report has arrived within the poll interval
+        """
+        try:
+            data, address = self.sock.recvfrom(MAX_PACKET_SIZE)
+        except socket.timeout:
+            return None
+        interface_name, packet_type = address[0], address[2]
+        # Loopback delivers every packet twice, once as outgoing and once as incoming
+        if packet_type == PACKET_OUTGOING and interface_name == "lo":
+            return None
+        timestamp = time.time()
+        packet = parse_packet(data, timestamp, self.tcp_ports, self.udp_ports, interface_name)
+        if packet is not None and self.output is not None:
+            seconds = int(timestamp)
+            self.output.write(struct.pack("IIII", seconds, int((timestamp - seconds) * 1000000),
+                                          len(packet.data), len(packet.data)))
+            self.output.write(packet.data)
+        return packet
+
+    def sniff_continuously(self, packet_count=None):
+        """
+        :return: Generator of packets, it ends when stop event is set or packet count is reached
+        """
+        self._open()
+        count = 0
+        while self.stop_event is None or not self.stop_event.is_set():
+            packet = self._receive()
+            if packet is None:
+                continue
+            yield packet
+            count += 1
+            if packet_count is not None and count >= packet_count:
+                break
+
+    def sniff(self, packet_count=None, timeout=None):
+        """
+        Capture packets into internal list until timeout passes or packet count is reached
+        """
+        self._open()
+        deadline = None if timeout is None else time.time() + timeout
+        while deadline is None or time.time() < deadline:
+            packet = self._receive()
+            if packet is None:
+                continue
+            self._packets.append(packet)
+            if packet_count is not None and len(self._packets) >= packet_count:
+                break
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+
+class TestRawSocketSniffer(unittest.TestCase):
+    @staticmethod
+    def build_packet(protocol, source_port, destination_port, payload):
+        if protocol == IPPROTO_UDP:
+            segment = struct.pack("!HHHH", source_port, destination_port, 8 + len(payload), 0) + payload
+        else:
+            segment = struct.pack("!HHIIBBHHH", source_port, destination_port, 1, 0, 0x50, 0x18, 512, 0, 0) + payload
+        return struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(segment), 0, 0, 64, protocol, 0,
+                           socket.inet_aton("10.0.0.1"), socket.inet_aton("10.0.0.2")) + segment
+
+    def test_port_filter(self):
+        program = assemble_port_filter(tcp_ports=[1883], udp_ports=[5683])
+        self.assertEqual((BPF_RET_K, 0, 0, MAX_PACKET_SIZE), program[-1])
+        for code, jt, jf, k in program:
+            if code in (BPF_JEQ_K, BPF_JSET_K):
+                self.assertTrue(0 <= jt < len(program) and 0 <= jf < len(program))
+
+    def test_parse_coap(self):
+        payload = "\x42\x01\x12\x34\x01\x02\xb1a\x02bc\xffhello"
+        packet = parse_packet(self.build_packet(IPPROTO_UDP, 40000, 5683, payload), 0., udp_ports=[5683])
+        self.assertEqual("10.0.0.2", str(packet["ip"].dst))
+        self.assertEqual(5683, int(packet["udp"].dstport))
+        self.assertEqual("a/bc", packet.coap.opt_uri_path)
+        self.assertEqual("hello", packet.coap.payload)
+        self.assertEqual(payload, packet.coap_raw.value[0].decode("hex"))
+        self.assertEqual(u"0a000002", packet["ip"].get_field_value("dst").main_field.raw_value)
+
+    def test_parse_mqtt_publish(self):
+        payload = "\x30\x08\x00\x03a/bxyz"
+        packet = parse_packet(self.build_packet(IPPROTO_TCP, 50000, 1883, payload), 0., tcp_ports=[1883])
+        self.assertEqual("10.0.0.2", packet.ip.dst_host)
+        self.assertEqual(3, int(packet.mqtt.msgtype))
+        self.assertEqual("a/b", packet.mqtt.topic)
+        self.assertEqual("xyz", packet.mqtt.msg)
+        self.assertTrue("mqtt" in str(packet.layers).lower())
+
+    def test_unrelated_packets(self):
+        self.assertIsNone(parse_packet(self.build_packet(IPPROTO_TCP, 50000, 1883, ""), 0., tcp_ports=[1883]))
+        self.assertIsNone(parse_packet(self.build_packet(IPPROTO_UDP, 40000, 53, "\x42" * 8), 0., udp_ports=[5683]))
+        self.assertIsNone(parse_packet("\x60" * 40, 0.))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,6 @@
+# Run attack campaigns from the command line, graphical interface is never imported
+
+if __name__ == '__main__':
+    import sys
+    from Utils.CampaignUtil.campaign_runner import main
+    sys.exit(main())
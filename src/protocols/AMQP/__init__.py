@@ -3,4 +3,6 @@
 
     1) Example usage of AMQP.
     2) AMQP Scanner
+    3) Chunked AMQP Publisher
+    4) AMQP Load Engine
 """
@@ -0,0 +1,144 @@
+import logging
+import socket
+import struct
+import unittest
+
+import pika.frame
+import pika.spec
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("AMQP Chunked Publisher")
+
+DEFAULT_AMQP_PORT = 5672
+DEFAULT_USERNAME = "guest"
+DEFAULT_PASSWORD = "guest"
+DEFAULT_VIRTUAL_HOST = "/"
+CHANNEL_NUMBER = 1
+RECEIVE_SIZE = 4096
+
+
+class AMQPChunkedPublisher:
+    """
+    Minimal AMQP 0-9-1 publisher over a raw socket
+    Methods are encoded with pika's frame and spec modules, but message bodies are written as body frames
+    directly from the given chunks. Hence, a body of any size can be published without being kept in memory.
+    """
+
+    def __init__(self, host, port=DEFAULT_AMQP_PORT, username=DEFAULT_USERNAME, password=DEFAULT_PASSWORD,
+                 virtual_host=DEFAULT_VIRTUAL_HOST, timeout=None):
+        """
+        :param timeout: Timeout of the socket operations in seconds, None means that they block
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.virtual_host = virtual_host
+        self.timeout = timeout
+
+        self.sock = None
+        self.received = b""
+        self.frame_max = pika.spec.FRAME_MAX_SIZE
+
+    def _send_method(self, channel_number, method):
+        self.sock.sendall(pika.frame.Method(channel_number, method).marshal())
+
+    def _receive_method(self, expected_method):
+        """
+        Block until the next method frame arrives
+        :param expected_method: Method class which is expected from the broker
+        :return: Received method
+        """
+        while True:
+            consumed, frame = pika.frame.decode_frame(self.received)
+            if frame is not None:
+                self.received = self.received[consumed:]
+                if isinstance(frame, pika.frame.Method):
+                    if not isinstance(frame.method, expected_method):
+                        raise socket.error("Unexpected method from broker: {0}".format(frame.method))
+                    return frame.method
+                continue
+            data = self.sock.recv(RECEIVE_SIZE)
+            if not data:
+                raise socket.error("Broker closed the connection")
+            self.received += data
+
+    def connect(self):
+        """
+        Perform connection handshake and open a channel
+        """
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(pika.frame.ProtocolHeader().marshal())
+
+        self._receive_method(pika.spec.Connection.Start)
+        self._send_method(0, pika.spec.Connection.StartOk(
+            client_properties={"product": "Peniot"}, mechanism="PLAIN",
+            response="\0{0}\0{1}".format(self.username, self.password)))
+
+        tune = self._receive_method(pika.spec.Connection.Tune)
+        if tune.frame_max > 0:
+            self.frame_max = min(self.frame_max, tune.frame_max)
+        # Heartbeats are disabled since nothing is read while a body is being streamed
+        self._send_method(0, pika.spec.Connection.TuneOk(tune.channel_max, self.frame_max, 0))
+
+        self._send_method(0, pika.spec.Connection.Open(virtual_host=self.virtual_host))
+        self._receive_method(pika.spec.Connection.OpenOk)
+
+        self._send_method(CHANNEL_NUMBER, pika.spec.Channel.Open())
+        self._receive_method(pika.spec.Channel.OpenOk)
+
+    def get_max_body_frame_size(self):
+        return self.frame_max - pika.spec.FRAME_HEADER_SIZE - pika.spec.FRAME_END_SIZE
+
+    def publish(self, exchange, routing_key, body_size, chunks):
+        """
+        :param body_size: Total size of the body
+        :param chunks: Iterable of body parts, none of them may exceed maximum body frame size
+        """
+        self._send_method(CHANNEL_NUMBER, pika.spec.Basic.Publish(exchange=exchange, routing_key=routing_key))
+        self.sock.sendall(pika.frame.Header(CHANNEL_NUMBER, body_size, pika.spec.BasicProperties()).marshal())
+        frame_end = struct.pack(">B", pika.spec.FRAME_END)
+        for chunk in chunks:
+            self.sock.sendall(struct.pack(">BHI", pika.spec.FRAME_BODY, CHANNEL_NUMBER, len(chunk)))
+            self.sock.sendall(chunk)
+            self.sock.sendall(frame_end)
+
+    def ping(self):
+        """
+        Send a heartbeat and make a round trip on the channel, which tells that broker still processes methods
+        """
+        self.sock.sendall(pika.frame.Heartbeat().marshal())
+        self._send_method(CHANNEL_NUMBER, pika.spec.Basic.Qos(prefetch_count=0))
+        self._receive_method(pika.spec.Basic.QosOk)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self._send_method(0, pika.spec.Connection.Close(reply_code=200, reply_text="Normal shutdown",
+                                                                class_id=0, method_id=0))
+            except socket.error:
+                pass
+            self.sock.close()
+            self.sock = None
+
+
+class TestAMQPChunkedPublisher(unittest.TestCase):
+    def test_max_body_frame_size(self):
+        publisher = AMQPChunkedPublisher("localhost")
+        self.assertEqual(pika.spec.FRAME_MAX_SIZE - 8, publisher.get_max_body_frame_size())
+
+    def test_publish(self):
+        print "* If server is not initialized this test will not execute properly."
+        publisher = AMQPChunkedPublisher("localhost")
+        try:
+            publisher.connect()
+            publisher.publish("", "peniot-queue", 6, ["pen", "iot"])
+        except socket.error:
+            pass
+        finally:
+            publisher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,381 @@
+import collections
+import logging
+import time
+import unittest
+
+import pika
+import pika.exceptions
+import pika.spec
+from pika.adapters.select_connection import IOLoop
+
+from Entity import metrics as Metrics
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("AMQP Load Engine")
+
+DEFAULT_CONNECTION_COUNT = 1
+DEFAULT_CHANNEL_COUNT = 1
+DEFAULT_CONFIRM_WINDOW = 1000
+# Messages published in one turn of the I/O loop, so that socket events are served between the turns
+PUBLISH_BATCH_SIZE = 256
+# Publishing is paused while more bytes than this are waiting to be written to a connection
+MAX_WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+BACKPRESSURE_DELAY = 0.001
+REPORT_INTERVAL = 1.0
+
+
+def get_write_buffer_size(connection):
+    """
+    :return: Number of bytes which are published but not written to the socket yet, 0 if it cannot be told
+    """
+    transport = getattr(connection, "_transport", None)
+    if transport is None:
+        return 0
+    return transport.get_write_buffer_size()
+
+
+class AMQPLoadChannel:
+    """
+    Publishing channel of the load engine with its window of unconfirmed delivery tags
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.channel = None
+        self.ready = False
+        self.next_delivery_tag = 1
+        # Delivery tags are increasing, so the oldest unconfirmed message is always at the left
+        self.unconfirmed = collections.deque()
+
+    def get_unconfirmed_count(self):
+        return len(self.unconfirmed)
+
+    def confirm(self, delivery_tag, multiple):
+        """
+        :return: Number of messages which are confirmed by the acknowledgement
+        """
+        if multiple:
+            count = 0
+            while self.unconfirmed and self.unconfirmed[0] <= delivery_tag:
+                self.unconfirmed.popleft()
+                count += 1
+            return count
+        try:
+            self.unconfirmed.remove(delivery_tag)
+        except ValueError:
+            return 0
+        return 1
+
+
+class AMQPLoadEngine:
+    """
+    Publish messages over several connections and channels which are driven by a single asynchronous I/O loop
+    When publisher confirms are on, each channel keeps publishing until its window of unconfirmed messages is
+    full and continues as the broker confirms them. Otherwise, publishing only waits for the rate limiter and
+    for the connections to write out what is already published.
+    """
+
+    def __init__(self, parameters, exchange, routing_key, body, connection_count=DEFAULT_CONNECTION_COUNT,
+                 channel_count=DEFAULT_CHANNEL_COUNT, confirms=False, confirm_window=DEFAULT_CONFIRM_WINDOW,
+                 rate_limiter=None, message_count=None, metrics=None):
+        """
+        :type parameters: pika.ConnectionParameters
+        :param channel_count: Number of channels of each connection
+        :param confirm_window: Maximum number of unconfirmed messages of each channel
+        :param rate_limiter: Shared by all channels, messages are published as fast as possible if it is not given
+        :type rate_limiter: Utils.RateUtil.rate_limiter.RateLimiter
+        :param message_count: Engine stops after publishing that many messages, None means until it is stopped
+        :type metrics: Metrics.AttackMetrics
+        """
+        self.parameters = parameters
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.connection_count = max(1, connection_count)
+        self.channel_count = max(1, channel_count)
+        self.confirms = confirms
+        self.confirm_window = max(1, confirm_window)
+        self.rate_limiter = rate_limiter
+        self.message_count = message_count
+
+        self.ioloop = None
+        self.connections = []
+        self.channels = []
+        self.stopped = False
+        self.pump_timer = None
+        self.report_timer = None
+
+        self.start_time = None
+        self.end_time = None
+        self.published_count = 0
+        self.confirmed_count = 0
+        self.nacked_count = 0
+        self.error_count = 0
+        # Published count, confirmed count and time of the last periodic report
+        self.last_report = None
+
+        self.metrics = metrics if metrics is not None else Metrics.AttackMetrics("AMQP Load Engine")
+        self.published_metric = self.metrics.counter(Metrics.MESSAGES_SENT, "Published AMQP messages")
+        self.published_byte_metric = self.metrics.counter(Metrics.BYTES_SENT, "Sent body bytes")
+        self.confirmed_metric = self.metrics.counter(Metrics.RESPONSES_RECEIVED, "Confirmed AMQP messages")
+        self.error_metric = self.metrics.counter(Metrics.ERRORS, "Nacked messages and connection failures")
+        # Publish rate is derived by the metrics from published message count, confirm rate is kept here
+        self.confirm_rate_metric = self.metrics.gauge("confirm_rate", "Confirmed messages per second")
+
+    def run(self):
+        """
+        Open connections and publish until the engine is stopped, message count is reached or the rate profile
+        is finished. It blocks until all connections are closed.
+        """
+        self.ioloop = IOLoop()
+        self.start_time = time.time()
+        self.last_report = (0, 0, self.start_time)
+        for _ in range(self.connection_count):
+            self.connections.append(pika.SelectConnection(
+                self.parameters, on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed, custom_ioloop=self.ioloop))
+        if self.rate_limiter is not None:
+            self.rate_limiter.start()
+        self.report_timer = self.ioloop.call_later(REPORT_INTERVAL, self._report)
+        self.ioloop.start()
+        self.end_time = time.time()
+        self.ioloop.close()
+        self.confirm_rate_metric.set(self.get_confirm_rate())
+
+    def stop(self):
+        """
+        Close the connections, it can be called from signal handlers and other threads
+        """
+        if self.ioloop is None:
+            self.stopped = True
+        elif self.end_time is None:
+            self.ioloop.add_callback_threadsafe(self._close)
+
+    def _close(self):
+        self.stopped = True
+        for connection in self.connections:
+            if not connection.is_closing and not connection.is_closed:
+                connection.close()
+        self._stop_when_closed()
+
+    def _stop_when_closed(self):
+        if all(connection.is_closed for connection in self.connections):
+            for timer in (self.pump_timer, self.report_timer):
+                if timer is not None:
+                    self.ioloop.remove_timeout(timer)
+            self.ioloop.stop()
+
+    def _on_connection_open(self, connection):
+        if self.stopped:
+            connection.close()
+            return
+        for _ in range(self.channel_count):
+            load_channel = AMQPLoadChannel(connection)
+            self.channels.append(load_channel)
+            connection.channel(on_open_callback=lambda channel, lc=load_channel: self._on_channel_open(lc, channel))
+
+    def _on_connection_open_error(self, connection, error):
+        self.error_count += 1
+        self.error_metric.inc()
+        logger.error("Connection cannot be opened: {0}".format(error))
+        self._stop_when_closed()
+
+    def _on_connection_closed(self, connection, reason):
+        if not self.stopped:
+            self.error_count += 1
+            self.error_metric.inc()
+            logger.error("Connection is closed unexpectedly: {0}".format(reason))
+        for load_channel in self.channels:
+            if load_channel.connection is connection:
+                load_channel.ready = False
+        self._stop_when_closed()
+
+    def _on_channel_open(self, load_channel, channel):
+        load_channel.channel = channel
+        channel.add_on_close_callback(lambda _, reason: self._on_channel_closed(load_channel, reason))
+        if self.confirms:
+            try:
+                channel.confirm_delivery(lambda frame: self._on_delivery_confirmation(load_channel, frame),
+                                         callback=lambda _: self._on_channel_ready(load_channel))
+            except pika.exceptions.MethodNotImplemented:
+                self.error_count += 1
+                self.error_metric.inc()
+                logger.error("Broker does not support publisher confirms.")
+                self._close()
+        else:
+            self._on_channel_ready(load_channel)
+
+    def _on_channel_ready(self, load_channel):
+        load_channel.ready = True
+        self._schedule_pump(0)
+
+    def _on_channel_closed(self, load_channel, reason):
+        load_channel.ready = False
+        if not self.stopped and load_channel.connection.is_open:
+            self.error_count += 1
+            self.error_metric.inc()
+            logger.error("Channel is closed unexpectedly: {0}".format(reason))
+            if not any(_.ready for _ in self.channels):
+                self._close()
+
+    def _on_delivery_confirmation(self, load_channel, frame):
+        method = frame.method
+        count = load_channel.confirm(method.delivery_tag, method.multiple)
+        if isinstance(method, pika.spec.Basic.Ack):
+            self.confirmed_count += count
+            self.confirmed_metric.inc(count)
+        else:
+            self.nacked_count += count
+            self.error_metric.inc(count)
+        # A channel whose window was full can publish again
+        self._schedule_pump(0)
+
+    def _schedule_pump(self, delay):
+        if self.pump_timer is None and not self.stopped:
+            self.pump_timer = self.ioloop.call_later(delay, self._pump)
+
+    def _is_channel_writable(self, load_channel):
+        if not load_channel.ready:
+            return False
+        if self.confirms and load_channel.get_unconfirmed_count() >= self.confirm_window:
+            return False
+        return get_write_buffer_size(load_channel.connection) < MAX_WRITE_BUFFER_SIZE
+
+    def _pump(self):
+        """
+        Publish a batch of messages over the writable channels in round robin order
+        """
+        self.pump_timer = None
+        if self.stopped:
+            return
+        if self.message_count is not None and self.published_count >= self.message_count:
+            self._finish()
+            return
+        if self.rate_limiter is not None and self.rate_limiter.is_finished():
+            self._finish()
+            return
+
+        writable_channels = [_ for _ in self.channels if self._is_channel_writable(_)]
+        budget = PUBLISH_BATCH_SIZE
+        if self.confirms:
+            budget = min(budget, sum(self.confirm_window - _.get_unconfirmed_count() for _ in writable_channels))
+        if self.message_count is not None:
+            budget = min(budget, self.message_count - self.published_count)
+        if self.rate_limiter is not None and writable_channels:
+            # Only tokens which can be used right away are taken
+            budget = self.rate_limiter.try_acquire(budget)
+
+        published = 0
+        while writable_channels and published < budget:
+            for load_channel in list(writable_channels):
+                if published >= budget:
+                    break
+                if self._publish(load_channel):
+                    published += 1
+                if not self._is_channel_writable(load_channel):
+                    writable_channels.remove(load_channel)
+
+        if writable_channels:
+            # Either the batch is done or the rate limiter has no tokens left
+            self._schedule_pump(0 if published > 0 else self.rate_limiter.get_wait_time())
+        elif any(_.ready and get_write_buffer_size(_.connection) >= MAX_WRITE_BUFFER_SIZE for _ in self.channels):
+            # Wait for the connections to write out their buffers
+            self._schedule_pump(BACKPRESSURE_DELAY)
+        # Otherwise, windows are full and confirmations schedule the next turn
+
+    def _publish(self, load_channel):
+        try:
+            load_channel.channel.basic_publish(self.exchange, self.routing_key, self.body)
+        except Exception as e:
+            self.error_count += 1
+            self.error_metric.inc()
+            logger.debug("Publish is failed: {0}".format(e))
+            load_channel.ready = False
+            return False
+        if self.confirms:
+            load_channel.unconfirmed.append(load_channel.next_delivery_tag)
+            load_channel.next_delivery_tag += 1
+        self.published_count += 1
+        self.published_metric.inc()
+        self.published_byte_metric.inc(len(self.body))
+        return True
+
+    def _finish(self):
+        """
+        Wait for outstanding confirmations before closing the connections
+        """
+        if self.confirms and any(_.ready and _.get_unconfirmed_count() > 0 for _ in self.channels):
+            self.pump_timer = self.ioloop.call_later(BACKPRESSURE_DELAY * 10, self._finish)
+            return
+        self.pump_timer = None
+        self._close()
+
+    def _report(self):
+        self.confirm_rate_metric.set(self.get_confirm_rate())
+        published_count, confirmed_count, report_time = self.last_report
+        now = time.time()
+        elapsed = max(now - report_time, 1e-6)
+        logger.info("Published = {0} ({1:.1f}/s), confirmed = {2} ({3:.1f}/s), nacked = {4}.".format(
+            self.published_count, (self.published_count - published_count) / elapsed,
+            self.confirmed_count, (self.confirmed_count - confirmed_count) / elapsed, self.nacked_count))
+        self.last_report = (self.published_count, self.confirmed_count, now)
+        self.report_timer = self.ioloop.call_later(REPORT_INTERVAL, self._report)
+
+    def get_elapsed_time(self):
+        if self.start_time is None:
+            return 0.
+        return (self.end_time if self.end_time is not None else time.time()) - self.start_time
+
+    def get_publish_rate(self):
+        """
+        :return: Average number of published messages per second
+        """
+        elapsed = self.get_elapsed_time()
+        return self.published_count / elapsed if elapsed > 0 else 0.
+
+    def get_confirm_rate(self):
+        """
+        :return: Average number of confirmed messages per second
+        """
+        elapsed = self.get_elapsed_time()
+        return self.confirmed_count / elapsed if elapsed > 0 else 0.
+
+    def get_summary(self):
+        return "Connections = {0}, channels = {1}, published = {2} ({3:.1f}/s), confirmed = {4} ({5:.1f}/s), " \
+               "nacked = {6}, errors = {7}, elapsed time = {8:.2f} s".format(
+                self.connection_count, self.connection_count * self.channel_count, self.published_count,
+                self.get_publish_rate(), self.confirmed_count, self.get_confirm_rate(), self.nacked_count,
+                self.error_count, self.get_elapsed_time())
+
+
+class TestAMQPLoadEngine(unittest.TestCase):
+    def test_confirm_window(self):
+        load_channel = AMQPLoadChannel(None)
+        load_channel.unconfirmed.extend(range(1, 6))
+        self.assertEqual(1, load_channel.confirm(2, False))
+        self.assertEqual(3, load_channel.confirm(4, True))
+        self.assertEqual(0, load_channel.confirm(4, False))
+        self.assertEqual([5], list(load_channel.unconfirmed))
+
+    def test_connection_failure(self):
+        # Nothing listens on the discard port, so the engine should give up instead of blocking
+        engine = AMQPLoadEngine(pika.ConnectionParameters(host="127.0.0.1", port=9, connection_attempts=1),
+                                "", "peniot-queue", "peniot-body", connection_count=2)
+        engine.run()
+        self.assertEqual(0, engine.published_count)
+        self.assertEqual(2, engine.error_count)
+
+    def test_load(self):
+        print "* If server is not initialized this test will not execute properly."
+        engine = AMQPLoadEngine(pika.ConnectionParameters(host="localhost", connection_attempts=1), "",
+                                "peniot-queue", "peniot-body", connection_count=2, channel_count=2, confirms=True,
+                                message_count=1000)
+        engine.run()
+        if engine.error_count == 0:
+            self.assertEqual(1000, engine.published_count)
+            self.assertEqual(1000, engine.confirmed_count + engine.nacked_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
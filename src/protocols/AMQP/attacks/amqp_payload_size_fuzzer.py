@@ -2,19 +2,25 @@ import logging
 import multiprocessing
 import random
 import signal
+import socket
 import time
 import unittest
 
 import pika
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
+from Utils.FuzzerUtil.sized_payload_util import SizedPayloadGenerator
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
+from protocols.AMQP.amqp_chunked_publisher import AMQPChunkedPublisher
 
 
 class AMQPPayloadSizeFuzzerAttack(Attack):
     """
     AMQP Protocol - Payload Size Fuzzer Attack module
     It is created to test any AMQP device as black box test with malformed or semi-malformed inputs
+    Payloads are streamed as body frames in chunks, so memory usage does not depend on payload size
     """
     # Input Fields
     host = "localhost"
@@ -28,10 +34,14 @@ class AMQPPayloadSizeFuzzerAttack(Attack):
     # Misc Members
     connection = None
     channel = None
+    publisher = None
+    payload_generator = None
     logger = None
     sent_message_count = 0
     max_payload_length = 2 ** 32
     stopped_flag = False
+    turn_rate = 1.0  # Fuzzing turns per second
+    rate_limiter = None
 
     def __init__(self):
         default_parameters = ["", "", "", "", "", "", 10]
@@ -57,9 +67,10 @@ class AMQPPayloadSizeFuzzerAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Connection will be closed")
-        self.stopped_flag = True
+        self.stopped_flag = True  # Publisher is closed by the attack loop once it sees the flag
         if self.connection is not None:
             self.connection.close()
+            self.connection = None
         time.sleep(2)  # Sleep two seconds so the user can see the message
 
     def pre_attack_init(self):
@@ -77,6 +88,42 @@ class AMQPPayloadSizeFuzzerAttack(Attack):
         # Define queue to store
         self.channel.queue_declare(queue=self.queue)
 
+        # Messages are published over a separate connection, so this one is not needed anymore
+        self.connection.close()
+        self.connection = None
+        self.channel = None
+
+        self.payload_generator = SizedPayloadGenerator()
+        self.publisher = AMQPChunkedPublisher(self.host)
+        self.publisher.connect()
+
+    def iter_payload_chunks(self, payload_size):
+        """
+        Chunks of the payload from the reused buffer, it is cut short if the attack is stopped
+        """
+        for chunk in self.payload_generator.iter_chunks(payload_size, self.publisher.get_max_body_frame_size()):
+            if self.stopped_flag is True:
+                return
+            yield chunk
+
+    def publish_sized_payload(self, payload_size):
+        """
+        :return: Whether the whole message is sent
+        """
+        try:
+            if self.publisher.sock is None:
+                self.publisher.connect()
+            self.payload_generator.fill()
+            self.publisher.publish(self.exchange, self.routing_key, payload_size,
+                                   self.iter_payload_chunks(payload_size))
+            return self.stopped_flag is False
+        except socket.error as e:
+            # Broker may drop the connection due to the size of the message, reconnect for the next turn
+            self.logger.error("Connection is lost while sending {0} bytes: {1}".format(payload_size, e))
+            self.metrics.counter(metrics.ERRORS, "Lost connections").inc()
+            self.publisher.close()
+            return False
+
     def run(self):
         Attack.run(self)
         self.pre_attack_init()
@@ -87,25 +134,33 @@ class AMQPPayloadSizeFuzzerAttack(Attack):
         size_list.extend([random.randint(0, self.max_payload_length) for _ in range(self.turn - 2)])
 
         fuzzing = 0
+        messages_sent = self.metrics.counter(metrics.MESSAGES_SENT, "Published fuzzing messages")
+        bytes_sent = self.metrics.counter(metrics.BYTES_SENT, "Sent body bytes")
         self.logger.info("Size payload fuzzing is started. Please consider it may take some time.")
+        # Turns are paced by the rate limiter, so time spent on a turn is not added to the interval
+        self.rate_limiter = RateLimiter(ConstantProfile(self.turn_rate))
+        self.rate_limiter.start()
         for payload_size in size_list:
 
+            # Wait in short slices so that the stop flag is still checked while the limiter is paused
+            while self.stopped_flag is False and not self.rate_limiter.acquire(max_wait=0.1):
+                pass
             if self.stopped_flag is True:
                 break
             # Create payload and send it
-            random_strings = "".join([chr(_) for _ in range(65, 91)]) + "".join([chr(_) for _ in range(97, 123)])
-            random_character = random.choice(random_strings)
-            sized_payload = random_character * payload_size
-            self.channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=sized_payload)
+            if self.publish_sized_payload(payload_size):
+                self.sent_message_count += 1
+                messages_sent.inc()
+                bytes_sent.inc(payload_size)
 
             # Informative procedures
             self.logger.info("Turn {0} is completed".format(fuzzing + 1))
-            self.sent_message_count += 1
             fuzzing += 1
-            time.sleep(1)
 
         if self.stopped_flag is False:
             self.logger.info("Payload size attack is finished.")
+        self.publisher.close()
+        self.metrics.finish()
 
 
 class TestCoAPPayloadSizeAttack(unittest.TestCase):
@@ -7,9 +7,13 @@ import unittest
 
 import pika
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils.FuzzerUtil import radamsa_util as rdm
+from Utils.FuzzerUtil.fuzz_case_journal import get_default_journal_path, open_journal, replay_cases, \
+    OUTCOME_SEND_ERROR
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
 
 
 class AMQPRandomPayloadFuzzingAttack(Attack):
@@ -25,6 +29,7 @@ class AMQPRandomPayloadFuzzingAttack(Attack):
     exchange_type = "direct"
     turn = 10
     count = 1
+    journal_path = ""  # Default journal path is used if it is not given
 
     # Misc Members
     connection = None
@@ -33,9 +38,13 @@ class AMQPRandomPayloadFuzzingAttack(Attack):
     sent_message_count = 0
     max_length_of_random_payload = 100
     stopped_flag = False
+    turn_rate = 1.0  # Fuzzing turns per second
+    rate_limiter = None
+    radamsa_pool = None
+    journal = None
 
     def __init__(self):
-        default_parameters = ["", "", "", "", "", "", 10, 1]
+        default_parameters = ["", "", "", "", "", "", 10, 1, ""]
         inputs = [
             InputFormat("Host Name", "host", "localhost", str, mandatory=True),
             InputFormat("Queue Name", "queue", "peniot-queue", str, mandatory=True),
@@ -44,12 +53,16 @@ class AMQPRandomPayloadFuzzingAttack(Attack):
             InputFormat("Payload", "payload", "", str),
             InputFormat("Exchange Type", "exchange_type", "direct", str, mandatory=True),
             InputFormat("Fuzzing Turn", "turn", 10, int),
-            InputFormat("Fuzzing Count", "count", 1, int)
+            InputFormat("Fuzzing Count", "count", 1, int),
+            InputFormat("Journal Path", "journal_path", self.journal_path, str)
         ]
 
         Attack.__init__(self, "AMQP Random Payload Fuzzing Attack", inputs, default_parameters,
                         "    It creates a random payload and sends \n"
-                        "    this payload to the client.")
+                        "    this payload to the client.\n"
+                        "    Sent cases and their outcomes are kept\n"
+                        "    in a journal, already sent payloads\n"
+                        "    are skipped.")
 
         logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
 
@@ -77,9 +90,27 @@ class AMQPRandomPayloadFuzzingAttack(Attack):
         # Define queue to store
         self.channel.queue_declare(queue=self.queue)
 
+    def publish(self, payload):
+        self.channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=payload)
+
+    def replay(self, cases):
+        """
+        Publish journaled cases back to back, e.g. the cases sent right before the broker has stopped responding
+        :type cases: list of Utils.FuzzerUtil.fuzz_case_journal.FuzzCase
+        :return: Number of replayed cases
+        """
+        self.pre_attack_init()
+        try:
+            return replay_cases(cases, self.publish)
+        finally:
+            self.connection.close()
+            self.connection = None
+
     def run(self):
         Attack.run(self)
         self.pre_attack_init()
+        self.journal = open_journal(self.journal_path or get_default_journal_path(self.get_attack_name()),
+                                    "amqp://{0}/{1}/{2}".format(self.host, self.exchange, self.routing_key))
 
         payload = self.payload
         if payload is None:
@@ -87,39 +118,73 @@ class AMQPRandomPayloadFuzzingAttack(Attack):
             length = random.randint(1, self.max_length_of_random_payload)
             payload = "".join([chr(random.randint(1, 127)) for _ in range(length)])
 
-        self.logger.info("Random payload fuzzing is started.")
-        for fuzzing in range(self.turn):
-
-            if self.stopped_flag is True:
-                break
-            while True:
-                try:
-                    returned_strings = rdm.get_ascii_decodable_radamsa_malformed_input(payload, self.count)
-                    if type(returned_strings) == list:
-                        fuzzer_messages = [string.decode("utf-8") for string in returned_strings]
-                    else:
-                        fuzzer_messages = returned_strings.decode("utf-8")
+        # Test cases are generated ahead by long-lived radamsa workers
+        self.radamsa_pool = rdm.RadamsaWorkerPool(payload).start()
+        try:
+            messages_sent = self.metrics.counter(metrics.MESSAGES_SENT, "Published fuzzing messages")
+            bytes_sent = self.metrics.counter(metrics.BYTES_SENT, "Sent body bytes")
+
+            self.logger.info("Random payload fuzzing is started.")
+            # Turns are paced by the rate limiter, so time spent on a turn is not added to the interval
+            self.rate_limiter = RateLimiter(ConstantProfile(self.turn_rate))
+            self.rate_limiter.start()
+            for fuzzing in range(self.turn):
+
+                # Wait in short slices so that the stop flag is still checked while the limiter is paused
+                while self.stopped_flag is False and not self.rate_limiter.acquire(max_wait=0.1):
+                    pass
+                if self.stopped_flag is True:
                     break
-                except UnicodeDecodeError:
-                    continue
-            # Check whether result is list or not
-            if type(fuzzer_messages) == list:
+                while True:
+                    try:
+                        returned_strings = self.radamsa_pool.get_ascii_decodable_malformed_input(self.count)
+                        if type(returned_strings) == list:
+                            fuzzer_messages = [string.decode("utf-8") for string in returned_strings]
+                        else:
+                            fuzzer_messages = returned_strings.decode("utf-8")
+                        break
+                    except UnicodeDecodeError:
+                        continue
+                # Check whether result is list or not
+                if type(fuzzer_messages) != list:
+                    fuzzer_messages = [fuzzer_messages]
                 for message in fuzzer_messages:
-                    self.channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=message)
+                    case_id = None
+                    if self.journal is not None:
+                        case_id = self.journal.record(message)
+                        if case_id is None:
+                            continue  # Same payload is already sent
+                    try:
+                        self.publish(message)
+                    except Exception as e:
+                        # Connection is closed on purpose when the attack is stopped
+                        if self.stopped_flag is False:
+                            # Case which the broker could not take is kept in the journal, hence the run ends here
+                            if case_id is not None:
+                                self.journal.set_outcome(case_id, OUTCOME_SEND_ERROR)
+                            self.logger.error("Publish is failed: {0}".format(e))
+                            self.stopped_flag = True
+                        break
                     # Increment sent message count
                     self.sent_message_count += 1
-            else:
-                self.channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=fuzzer_messages)
-                # Increment sent message count
-                self.sent_message_count += 1
-            time.sleep(1)
-            self.logger.info("Turn {0} is completed".format(fuzzing + 1))
+                    messages_sent.inc()
+                    bytes_sent.inc(len(message))
+                self.logger.info("Turn {0} is completed".format(fuzzing + 1))
 
+        finally:
+            # Workers serve test cases forever, they must not outlive the attack
+            self.radamsa_pool.stop()
         if self.stopped_flag is False:
             self.logger.info("Random payload fuzzing is finished.")
 
-        if self.connection is not None:
+        if self.connection is not None and self.connection.is_open:
             self.connection.close()
+        if self.journal is not None:
+            self.logger.info("{0} cases are journaled in {1}, {2} duplicate cases are skipped.".format(
+                self.journal.get_case_count(), self.journal.path, self.journal.duplicate_count))
+            self.journal.close()
+            self.journal = None
+        self.metrics.finish()
 
 
 class TestAMQPRandomPayloadAttack(unittest.TestCase):
@@ -136,7 +201,7 @@ class TestAMQPRandomPayloadAttack(unittest.TestCase):
         inputs = self.amqp_random_payload_fuzzer.get_inputs()
         self.assertIsNotNone(inputs)
         self.assertGreater(len(inputs), 0, "Non inserted inputs")
-        self.assertEquals(len(inputs), 8)
+        self.assertEquals(len(inputs), 9)
 
     def test_non_initialized_inputs(self):
         inputs = self.amqp_random_payload_fuzzer.get_inputs()
@@ -146,7 +211,7 @@ class TestAMQPRandomPayloadAttack(unittest.TestCase):
 
     def test_after_getting_inputs(self):
         example_inputs = ["localhost", "peniot-queue", "peniot-exchange", "peniot-routing-key", "peniot-body", "direct",
-                          13, 12]
+                          13, 12, "peniot-journal.sqlite"]
         for index, _input in enumerate(example_inputs):
             self.amqp_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -162,7 +227,7 @@ class TestAMQPRandomPayloadAttack(unittest.TestCase):
 
     def test_invalid_fuzzing_turn(self):
         example_inputs = ["localhost", "peniot-queue", "peniot-exchange", "peniot-routing-key", "peniot-body", "direct",
-                          1, 11]
+                          1, 11, ""]
         for index, _input in enumerate(example_inputs):
             self.amqp_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -175,7 +240,7 @@ class TestAMQPRandomPayloadAttack(unittest.TestCase):
     def test_random_payload_fuzzing_attack(self):
         def run_attack():
             example_inputs = ["localhost", "peniot-queue", "peniot-exchange", "peniot-routing-key", "peniot-body",
-                              "direct", 5, 1]
+                              "direct", 5, 1, ""]
             for index, _input in enumerate(example_inputs):
                 self.amqp_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -1,7 +1,10 @@
 from __future__ import absolute_import
+import glob
 import time
 import os
+import struct
 import logging
+import threading
 from . import Logger
 
 LINKTYPE_BLUETOOTH_LE_LL = 251
@@ -16,64 +19,140 @@ SNAPLEN = 0xFFFF
 NETWORK = LINKTYPE_NORDIC_BLE
 
 
-globalHeaderString = [
-    ((MAGIC_NUMBER >> 0) & 0xFF),
-    ((MAGIC_NUMBER >> 8) & 0xFF),
-    ((MAGIC_NUMBER >> 16) & 0xFF),
-    ((MAGIC_NUMBER >> 24) & 0xFF),
-    ((VERSION_MAJOR >> 0) & 0xFF),
-    ((VERSION_MAJOR >> 8) & 0xFF),
-    ((VERSION_MINOR >> 0) & 0xFF),
-    ((VERSION_MINOR >> 8) & 0xFF),
-    ((THISZONE >> 0) & 0xFF),
-    ((THISZONE >> 8) & 0xFF),
-    ((THISZONE >> 16) & 0xFF),
-    ((THISZONE >> 24) & 0xFF),
-    ((SIGFIGS >> 0) & 0xFF),
-    ((SIGFIGS >> 8) & 0xFF),
-    ((SIGFIGS >> 16) & 0xFF),
-    ((SIGFIGS >> 24) & 0xFF),
-    ((SNAPLEN >> 0) & 0xFF),
-    ((SNAPLEN >> 8) & 0xFF),
-    ((SNAPLEN >> 16) & 0xFF),
-    ((SNAPLEN >> 24) & 0xFF),
-    ((NETWORK >> 0) & 0xFF),
-    ((NETWORK >> 8) & 0xFF),
-    ((NETWORK >> 16) & 0xFF),
-    ((NETWORK >> 24) & 0xFF)
-]
+GLOBAL_HEADER = struct.pack("<IHHiIII", MAGIC_NUMBER, VERSION_MAJOR, VERSION_MINOR, THISZONE, SIGFIGS,
+                            SNAPLEN, NETWORK)
+PACKET_HEADER_STRUCT = struct.Struct("<IIII")  # Seconds, microseconds, included length, original length
+BOARD_PACKET_HEADER_STRUCT = struct.Struct("<IIIIB")  # Packet header followed by the board id
+
+MAX_FILE_SIZE = 20000000
+FLUSH_SIZE = 65536
+FLUSH_INTERVAL = 1.0
+MAX_SEGMENTS = 10
 
 captureFilePath = os.path.join(Logger.logFilePath, "capture.pcap")
 
 
 class CaptureFileHandler:
-    def __init__(self, clear=False):
+    # The capture file is kept open and records are collected in a write buffer, which is written out once it
+    # reaches flushSize bytes or flushInterval seconds have passed since the last write.
+    # A file which grows beyond maxFileSize is closed and capturing goes on in a new numbered segment next to it,
+    # only the last maxSegments segments are kept. A capture which has segments is not continued by a new handler,
+    # the capture file and its segments are rolled over together to the backup set instead.
+    # Writes may come from the packet reader while the application closes the handler, so they are serialized by
+    # a lock and the ones which come after close are dropped.
+    def __init__(self, clear=False, flushSize=FLUSH_SIZE, flushInterval=FLUSH_INTERVAL, maxFileSize=MAX_FILE_SIZE,
+                 maxSegments=MAX_SEGMENTS):
         self.filename = captureFilePath
         self.backupFilename = self.filename+".1"
-        if not os.path.isfile(self.filename):
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.maxFileSize = maxFileSize
+        self.maxSegments = maxSegments
+        self.file = None
+        self.fileSize = 0
+        self.segment = 0
+        self.buffer = bytearray()
+        self.lastFlushTime = time.time()
+        self.lock = threading.RLock()
+        self.closed = False
+        if self.getSegmentFilenames():
+            self.doRollover()
+        elif not os.path.isfile(self.filename):
             self.startNewFile()
-        elif os.path.getsize(self.filename) > 20000000:
+        elif self.maxFileSize and os.path.getsize(self.filename) > self.maxFileSize:
             self.doRollover()
         if clear:
             # clear file
             self.startNewFile()
 
     def startNewFile(self):
+        self.closeFile()
+        self.segment = 0
         with open(self.filename, "wb") as f:
-            f.write(bytearray(globalHeaderString))
+            f.write(GLOBAL_HEADER)
 
     def doRollover(self):
+        # Capture file and its segments are moved to the backup set as a whole, replacing the previous backup set
+        self.closeFile()
+        for backupFilename in [self.backupFilename] + self.getSegmentFilenames(".1"):
+            try:
+                os.remove(backupFilename)
+            except:  # noqa: E722
+                logging.exception("capture file rollover remove backup failed")
         try:
-            os.remove(self.backupFilename)
-        except:  # noqa: E722
-            logging.exception("capture file rollover remove backup failed")
-        try:
-            os.rename(self.filename, self.backupFilename)
+            for segmentFilename in self.getSegmentFilenames():
+                os.rename(segmentFilename, segmentFilename + ".1")
+            if os.path.isfile(self.filename):
+                os.rename(self.filename, self.backupFilename)
             self.startNewFile()
         except:  # noqa: E722
             logging.exception("capture file rollover failed")
 
+    def getSegmentFilename(self, segment):
+        if segment == 0:
+            return self.filename
+        root, extension = os.path.splitext(self.filename)
+        return "%s_%03d%s" % (root, segment, extension)
+
+    def removeSegment(self, segment):
+        try:
+            os.remove(self.getSegmentFilename(segment))
+        except OSError:
+            pass
+
+    def getSegmentFilenames(self, suffix=""):
+        root, extension = os.path.splitext(self.filename)
+        return sorted(glob.glob("%s_[0-9][0-9][0-9]*%s%s" % (root, extension, suffix)))
+
+    def openFile(self):
+        # Capture file is continued, but a segment is always started from scratch
+        if self.segment == 0:
+            self.file = open(self.filename, "ab")
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(self.getSegmentFilename(self.segment), "wb")
+        self.fileSize = self.file.tell()
+        if self.fileSize == 0:
+            self.file.write(GLOBAL_HEADER)
+            self.fileSize = len(GLOBAL_HEADER)
+
+    def closeFile(self):
+        if self.file is not None:
+            self.writeBuffer()
+            self.file.close()
+            self.file = None
+
+    def rotate(self):
+        # Start the next segment, nothing is renamed so the finished segment stays readable as it is
+        self.closeFile()
+        self.segment += 1
+        if self.maxSegments and self.segment > self.maxSegments:
+            self.removeSegment(self.segment - self.maxSegments)
+        self.openFile()
+
+    def writeBuffer(self):
+        if self.buffer:
+            if self.file is None:
+                self.openFile()
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.fileSize += len(self.buffer)
+            del self.buffer[:]
+        self.lastFlushTime = time.time()
+
+    def flush(self):
+        with self.lock:
+            self.writeBuffer()
+            if self.maxFileSize and self.fileSize > self.maxFileSize:
+                self.rotate()
+
+    def close(self):
+        with self.lock:
+            self.closeFile()
+            self.closed = True
+
     def readLine(self, lineNum):
+        self.flush()
         line = ""
         with open(self.filename, "r") as f:
             f.seek(lineNum)
@@ -81,52 +160,45 @@ class CaptureFileHandler:
         return line
 
     def readAll(self):
+        self.flush()
         text = ""
         with open(self.filename, "r") as f:
             text = f.read()
         return text
 
+    def flushIfDue(self):
+        # Only called between records, hence a flushed file and a rotated segment always end with a whole record
+        if len(self.buffer) >= self.flushSize or time.time() - self.lastFlushTime >= self.flushInterval:
+            self.flush()
+
     def writeString(self, msgString):
-        with open(self.filename, "ab") as f:
-            f.write(msgString)
+        with self.lock:
+            if self.closed:
+                return
+            self.buffer += msgString
+            self.flushIfDue()
 
     def writeList(self, msgList):
         self.writeString(bytearray(msgList))
 
     def writePacketList(self, packetList):
-        self.writeList(self.makePacketHeader(len(packetList)) + packetList)
+        self.writeString(self.makePacketHeader(len(packetList)) + bytearray(packetList))
 
     def writePacket(self, packet):
-        self.writePacketList([packet.boardId] + packet.getList())
-
-    def makePacketHeader(self, length):
-
+        packetBytes = packet.getBytes()
+        with self.lock:
+            if self.closed:
+                return
+            self.buffer += self.makePacketHeader(len(packetBytes)+1, BOARD_PACKET_HEADER_STRUCT, packet.boardId)
+            self.buffer += packetBytes
+            self.flushIfDue()
+
+    def makePacketHeader(self, length, headerStruct=PACKET_HEADER_STRUCT, *fields):
         timeNow = time.time()
 
         TS_SEC = int(timeNow)
         TS_USEC = int((timeNow-TS_SEC)*1000000)
-        INCL_LENGTH = length
-        ORIG_LENGTH = length
-
-        headerString = [
-            ((TS_SEC >> 0) & 0xFF),
-            ((TS_SEC >> 8) & 0xFF),
-            ((TS_SEC >> 16) & 0xFF),
-            ((TS_SEC >> 24) & 0xFF),
-            ((TS_USEC >> 0) & 0xFF),
-            ((TS_USEC >> 8) & 0xFF),
-            ((TS_USEC >> 16) & 0xFF),
-            ((TS_USEC >> 24) & 0xFF),
-            ((INCL_LENGTH >> 0) & 0xFF),
-            ((INCL_LENGTH >> 8) & 0xFF),
-            ((INCL_LENGTH >> 16) & 0xFF),
-            ((INCL_LENGTH >> 24) & 0xFF),
-            ((ORIG_LENGTH >> 0) & 0xFF),
-            ((ORIG_LENGTH >> 8) & 0xFF),
-            ((ORIG_LENGTH >> 16) & 0xFF),
-            ((ORIG_LENGTH >> 24) & 0xFF)
-        ]
-        return headerString
+        return headerStruct.pack(TS_SEC, TS_USEC, length, length, *fields)
 
 
 def toList(myString):
@@ -1,14 +1,23 @@
 from __future__ import absolute_import
 from . import Notifications
+import collections
 import logging
+import time
+
+
+UPDATE_INTERVAL = 0.5
 
 
 class DeviceList(Notifications.Notifier):
+    # Devices are kept in order of discovery and indexed by address and name, so looking up the device of an
+    # advertisement does not depend on the number of devices in range. DEVICE_UPDATED notifications are
+    # coalesced, a device which keeps changing is notified at most once per updateInterval seconds.
     def __init__(self, *args, **kwargs):
+        self.updateInterval = kwargs.pop("updateInterval", UPDATE_INTERVAL)
         Notifications.Notifier.__init__(self, *args, **kwargs)
         logging.info("args: " + str(args))
         logging.info("kwargs: " + str(kwargs))
-        self.devices = []
+        self.clear()
 
     def __len__(self):
         return len(self.devices)
@@ -18,19 +27,29 @@ class DeviceList(Notifications.Notifier):
 
     def clear(self):
         self.devices = []
+        self.indexesByAddress = {}
+        self.devicesByName = {}
+        self.pendingUpdates = collections.OrderedDict()
+        self.lastUpdateTime = time.time()
+
+    def indexName(self, device):
+        if device.name:
+            self.devicesByName.setdefault(device.name, device)
 
     def appendOrUpdate(self, newDevice):
-        existingDevice = self.find(newDevice)
+        index = self.indexesByAddress.get(tuple(newDevice.address))
 
         # logging.info("appendOrUpdate")
 
         # Add device to the list of devices being displayed, but only if CRC is OK
-        if existingDevice is None:
+        if index is None:
             self.append(newDevice)
         else:
+            existingDevice = self.devices[index]
             updated = False
             if (newDevice.name != "") and (existingDevice.name == ""):
                 existingDevice.name = newDevice.name
+                self.indexName(existingDevice)
                 updated = True
 
             if (newDevice.RSSI < (newDevice.RSSI - 5)) or (existingDevice.RSSI > (newDevice.RSSI+2)):  # noqa: E501
@@ -38,25 +57,35 @@ class DeviceList(Notifications.Notifier):
                 updated = True
 
             if updated:
-                self.notify("DEVICE_UPDATED", existingDevice)
-                # self.updateDeviceDisplay()
+                self.pendingUpdates[tuple(existingDevice.address)] = existingDevice
+            if self.pendingUpdates and time.time() - self.lastUpdateTime >= self.updateInterval:
+                self.flushUpdates()
+
+    def flushUpdates(self):
+        # Send the DEVICE_UPDATED notifications which are held back since the last flush
+        pendingUpdates = self.pendingUpdates
+        self.pendingUpdates = collections.OrderedDict()
+        self.lastUpdateTime = time.time()
+        for device in pendingUpdates.values():
+            self.notify("DEVICE_UPDATED", device)
+            # self.updateDeviceDisplay()
 
     def append(self, device):
+        self.indexesByAddress[tuple(device.address)] = len(self.devices)
         self.devices.append(device)
+        self.indexName(device)
         self.notify("DEVICE_ADDED", device)
 
     def find(self, id):
         # logging.info("find type: %s" % str(id.__class__.__name__))
         if type(id) == list:
-            for dev in self.devices:
-                if dev.address == id:
-                    return dev
+            index = self.indexesByAddress.get(tuple(id))
+            return self.devices[index] if index is not None else None
         elif type(id) == int:
             return self.devices[id]
         elif type(id) == str:
-            for dev in self.devices:
-                if dev.name in [id, '"'+id+'"']:
-                    return dev
+            device = self.devicesByName.get(id)
+            return device if device is not None else self.devicesByName.get('"'+id+'"')
         elif id.__class__.__name__ == "Device":
             # logging.info("find Device")
             return self.find(id.address)
@@ -64,11 +93,17 @@ class DeviceList(Notifications.Notifier):
 
     def remove(self, id):
         if type(id) == list:  # address
-            device = self.devices.pop(self.devices.index(self.find(id)))
+            device = self.devices.pop(self.index(self.find(id)))
         elif type(id) == int:
             device = self.devices.pop(id)
         elif type(id) == Device:
-            device = self.devices.pop(self.devices.index(self.find(id.address)))
+            device = self.devices.pop(self.index(id))
+        # Indexes of the following devices are shifted, removing is rare so the indexes are rebuilt
+        self.indexesByAddress = dict((tuple(dev.address), index) for index, dev in enumerate(self.devices))
+        self.devicesByName = {}
+        for dev in self.devices:
+            self.indexName(dev)
+        self.pendingUpdates.pop(tuple(device.address), None)
         self.notify("DEVICE_REMOVED", device)
         # self.updateDeviceDisplay()
 
@@ -82,12 +117,7 @@ class DeviceList(Notifications.Notifier):
         # return None
 
     def index(self, device):
-        index = 0
-        for dev in self.devices:
-            if dev.address == device.address:
-                return index
-            index += 1
-        return None
+        return self.indexesByAddress.get(tuple(device.address))
 
     # def setSelected(self, device):
         # if device in self.devices:
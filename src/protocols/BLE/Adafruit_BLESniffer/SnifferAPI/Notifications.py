@@ -1,6 +1,11 @@
 from __future__ import absolute_import
+import collections
+import logging
 import threading
 
+QUEUE_SIZE = 10000
+BATCH_SIZE = 256
+
 
 class Notification():
     def __init__(self, key, msg=None):
@@ -13,20 +18,91 @@ class Notification():
         return "Notification (key: %s, msg: %s)" % (str(self.key), str(self.msg))
 
 
+class Subscription():
+    # Notifications which are waiting for a single subscriber. Each asynchronous subscriber has its own dispatcher
+    # thread, so a slow subscriber only falls behind itself and the oldest of its notifications are dropped.
+    def __init__(self, callback, batch=False, synchronous=False, queueSize=QUEUE_SIZE, batchSize=BATCH_SIZE):
+        self.callback = callback
+        self.batch = batch
+        self.synchronous = synchronous
+        self.batchSize = batchSize
+        self.pending = collections.deque(maxlen=queueSize)
+        self.pendingCondition = threading.Condition()
+        self.dispatcher = None
+        self.dispatching = False
+        self.delivered = 0
+        self.dropped = 0
+
+    def put(self, notification):
+        with self.pendingCondition:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(notification)
+            if self.dispatcher is None:
+                self.dispatching = True
+                self.dispatcher = threading.Thread(target=self.dispatch, name="NotificationDispatcher")
+                self.dispatcher.daemon = True
+                self.dispatcher.start()
+            self.pendingCondition.notify()
+
+    def dispatch(self):
+        while True:
+            with self.pendingCondition:
+                while self.dispatching and not self.pending:
+                    self.pendingCondition.wait(1)
+                if not self.pending:
+                    self.dispatcher = None
+                    return
+                notifications = [self.pending.popleft() for _ in range(min(len(self.pending), self.batchSize))]
+            # The callback runs without the lock, the notifying thread is never blocked by it
+            self.deliver(notifications)
+
+    def stop(self, timeout=2):
+        # Deliver the pending notifications and stop the dispatcher thread
+        with self.pendingCondition:
+            dispatcher = self.dispatcher
+            self.dispatching = False
+            self.pendingCondition.notify()
+        if dispatcher is not None and dispatcher is not threading.current_thread():
+            dispatcher.join(timeout)
+
+    def deliver(self, notifications):
+        try:
+            if self.batch:
+                self.callback(notifications)
+            else:
+                for notification in notifications:
+                    self.callback(notification)
+        except:  # noqa: E722
+            logging.exception("notification callback error")
+        self.delivered += len(notifications)
+
+
 class Notifier():
-    def __init__(self, callbacks=[]):
+    # An asynchronous notifier only queues notifications in notify, they are delivered by dispatcher threads in
+    # batches of up to batchSize for each subscriber, so a slow subscriber cannot hold up the notifying thread.
+    # Subscribers which must see a notification before notify returns can still subscribe synchronously.
+    def __init__(self, callbacks=[], asynchronous=False, queueSize=QUEUE_SIZE, batchSize=BATCH_SIZE):
         self.callbacks = {}
+        self.subscriptions = {}
         self.callbackLock = threading.RLock()
+        self.asynchronous = asynchronous
+        self.queueSize = queueSize
+        self.batchSize = batchSize
         # logging.info("callbacks: "+  str(callbacks))
         for callback in callbacks:
             self.subscribe(*callback)
 
         # logging.info(self.callbacks)
 
-    def subscribe(self, key, callback):
+    def subscribe(self, key, callback, batch=False, synchronous=False):
+        # A batch subscriber is called with a list of notifications instead of a single one
         with self.callbackLock:
             if callback not in self.getCallbacks(key):
                 self.getCallbacks(key).append(callback)
+            if callback not in self.subscriptions:
+                self.subscriptions[callback] = Subscription(
+                    callback, batch, synchronous or not self.asynchronous, self.queueSize, self.batchSize)
 
     def getCallbacks(self, key):
         with self.callbackLock:
@@ -41,13 +117,28 @@ class Notifier():
             if notification is None:
                 notification = Notification(key, msg)
 
-            for callback in self.getCallbacks(notification.key):
-                callback(notification)
-
-            for callback in self.getCallbacks("*"):
-                callback(notification)
+            for callback in self.callbacks.get(notification.key, []) + self.callbacks.get("*", []):
+                subscription = self.subscriptions[callback]
+                if subscription.synchronous:
+                    subscription.deliver([notification])
+                else:
+                    subscription.put(notification)
 
         # logging.info("sending notification: %s" % str(notification))
 
     def passOnNotification(self, notification):
         self.notify(notification=notification)
+
+    def stopDispatching(self, timeout=2):
+        # Deliver the pending notifications of all subscribers and stop their dispatcher threads
+        with self.callbackLock:
+            subscriptions = list(self.subscriptions.values())
+        for subscription in subscriptions:
+            subscription.stop(timeout)
+
+    def getDroppedCount(self, callback=None):
+        # Number of notifications which are dropped for the callback, or for all subscribers
+        with self.callbackLock:
+            if callback is not None:
+                return self.subscriptions[callback].dropped
+            return sum(subscription.dropped for subscription in self.subscriptions.values())
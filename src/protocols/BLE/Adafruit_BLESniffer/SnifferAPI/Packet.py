@@ -2,9 +2,11 @@ from __future__ import absolute_import
 from . import UART, Exceptions, Notifications
 import time
 import logging
+import struct
 import os
 import sys
 import serial
+import six
 from six.moves import range
 
 SLIP_START = 0xAB
@@ -13,6 +15,10 @@ SLIP_ESC = 0xCD
 SLIP_ESC_START = SLIP_START+1
 SLIP_ESC_END = SLIP_END+1
 SLIP_ESC_ESC = SLIP_ESC+1
+SLIP_START_BYTE = struct.pack("B", SLIP_START)
+SLIP_END_BYTE = struct.pack("B", SLIP_END)
+SLIP_ESC_BYTE = struct.pack("B", SLIP_ESC)
+SLIP_UNESCAPED = {SLIP_ESC_START: SLIP_START, SLIP_ESC_END: SLIP_END, SLIP_ESC_ESC: SLIP_ESC}
 
 REQ_FOLLOW = 0x00
 RESP_FOLLOW = 0x01
@@ -41,6 +47,7 @@ SET_ADV_CHANNEL_HOP_SEQ = 0x17
 GO_IDLE = 0xFE
 
 ADV_ACCESS_ADDRESS = [0xD6, 0xBE, 0x89, 0x8E]
+ADV_ACCESS_ADDRESS_VALUE = 0x8E89BED6
 
 SYNCWORD_POS = 0
 HEADER_LEN_POS = 0
@@ -74,6 +81,47 @@ ADV_TYPE_CONNECT_REQ = 0x5
 
 VALID_ADV_CHANS = [37, 38, 39]
 
+HEADER_STRUCT = struct.Struct("<BBBHB")  # Header length, payload length, protocol version, packet counter, id
+BLE_HEADER_STRUCT = struct.Struct("<BBBHI")  # Flags, channel, RSSI, event counter, timestamp
+UINT16_STRUCT = struct.Struct("<H")
+UINT32_STRUCT = struct.Struct("<I")
+
+NOT_DECODED = object()
+
+
+class SlipDecoder:
+    # Decodes SLIP frames out of chunks of serial data, bytes before a SLIP_START are dropped
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    def nextFrame(self):
+        # Returns the next complete frame as a bytearray, None if no complete frame is buffered.
+        # An invalid frame is removed from the buffer before UARTPacketError is raised.
+        start = self.buffer.find(SLIP_START_BYTE)
+        if start < 0:
+            del self.buffer[:]
+            return None
+        end = self.buffer.find(SLIP_END_BYTE, start+1)
+        if end < 0:
+            del self.buffer[:start]
+            return None
+        frame = self.buffer[start+1:end]
+        del self.buffer[:end+1]
+        if SLIP_ESC not in frame:
+            return frame
+        parts = frame.split(SLIP_ESC_BYTE)
+        decoded = parts[0]
+        for part in parts[1:]:
+            if not part or part[0] not in SLIP_UNESCAPED:
+                raise Exceptions.UARTPacketError(
+                    "Unexpected character after SLIP_ESC: %s." % (part[0] if part else SLIP_END))
+            decoded.append(SLIP_UNESCAPED[part[0]])
+            decoded += part[1:]
+        return decoded
+
 
 class PacketReader(Notifications.Notifier):
     def __init__(self, portnum=None, callbacks=[]):
@@ -88,6 +136,7 @@ class PacketReader(Notifications.Notifier):
         self.packetCounter = 0
         self.lastReceivedPacketCounter = 0
         self.lastReceivedPacket = None
+        self.slipDecoder = SlipDecoder()
 
         # self.states = {}
 
@@ -120,35 +169,14 @@ class PacketReader(Notifications.Notifier):
         tempSLIPBuffer.append(SLIP_END)
         return tempSLIPBuffer
 
-    # This function uses getSerialByte() function to get SLIP encoded bytes from the serial port
-    # and return a decoded byte list
-    # Based on https://github.com/mehdix/pyslip/
+    # This function reads whatever the serial port has available in chunks, buffers it in the SLIP decoder
+    # and return the next decoded frame as a bytearray. Frames which are already buffered are returned without reading.
     def decodeFromSLIP(self, timeout=None):
-        dataBuffer = []
-        startOfPacket = False
-        endOfPacket = False
-
-        while not startOfPacket:
-            startOfPacket = (self.getSerialByte(timeout) == SLIP_START)
-
-        while not endOfPacket:
-            serialByte = self.getSerialByte(timeout)
-            if serialByte == SLIP_END:
-                endOfPacket = True
-            elif serialByte == SLIP_ESC:
-                serialByte = self.getSerialByte()
-                if serialByte == SLIP_ESC_START:
-                    dataBuffer.append(SLIP_START)
-                elif serialByte == SLIP_ESC_END:
-                    dataBuffer.append(SLIP_END)
-                elif serialByte == SLIP_ESC_ESC:
-                    dataBuffer.append(SLIP_ESC)
-                else:
-                    raise Exceptions.UARTPacketError(
-                        "Unexpected character after SLIP_ESC: %d." % serialByte)
-            else:
-                dataBuffer.append(serialByte)
-        return dataBuffer
+        frame = self.slipDecoder.nextFrame()
+        while frame is None:
+            self.slipDecoder.feed(self.uart.readAvailable(timeout))
+            frame = self.slipDecoder.nextFrame()
+        return frame
 
     # This function read byte chuncks from the serial port and return one byte at a time
     # Based on https://github.com/mehdix/pyslip/
@@ -173,14 +201,13 @@ class PacketReader(Notifications.Notifier):
         self.lastReceivedPacket = packet
 
     def getPacket(self, timeout=None):
-        packetList = []
         try:
-            packetList = self.decodeFromSLIP(timeout)
+            packetBytes = self.decodeFromSLIP(timeout)
         except Exceptions.UARTPacketError:
             logging.exception("")
             return None
         else:
-            packet = Packet(packetList)
+            packet = Packet(packetBytes)
             if packet.valid:
                 self.handlePacketHistory(packet)
             return packet
@@ -322,17 +349,30 @@ class PacketReader(Notifications.Notifier):
         return (None, None)
 
 
-class Packet:
-
-    def __init__(self, packetList):
+class Packet(object):
+    # Packets work on the decoded frame without copying it, BLE fields are only decoded when they are read
+    __slots__ = ("packetBytes", "headerLength", "payloadLength", "protover", "packetCounter", "id", "valid", "OK",
+                 "bleHeaderLength", "flags", "crcOK", "direction", "encrypted", "micOK", "channel", "rawRSSI",
+                 "RSSI", "txAdd", "eventCounter", "timestamp", "version", "baudRate", "testId", "testLength",
+                 "boardId", "paddingByte", "_blePacket")
+
+    def __init__(self, packetBytes):
+        # A list of ints is still accepted, a bytearray is taken over as is
+        if not isinstance(packetBytes, bytearray):
+            packetBytes = bytearray(packetBytes)
+        self.packetBytes = packetBytes
+        self.packetCounter = None
+        self.id = None
+        self.OK = False
+        self.valid = False
+        self.paddingByte = None
+        self._blePacket = None
         try:
-            if packetList == []:
+            if not packetBytes:
                 raise Exceptions.InvalidPacketException(
-                    "packet list not valid: %s" % str(packetList))
-            self.packetList = packetList
-            self.readStaticHeader(packetList)
-            self.readDynamicHeader(packetList)
-            self.readPayload(packetList)
+                    "packet list not valid: %s" % str(self.getList()))
+            self.readHeader()
+            self.readPayload()
 
         except Exceptions.InvalidPacketException as e:
             logging.error("Invalid packet: %s" % str(e))
@@ -340,76 +380,54 @@ class Packet:
             self.valid = False
         except:  # noqa: E722
             logging.exception("packet creation error")
-            logging.info("packetList: " + str(packetList))
+            logging.info("packetList: " + str(self.getList()))
             self.OK = False
             self.valid = False
 
     def __repr__(self):
         return "UART packet, type: "+str(self.id)+", PC: "+str(self.packetCounter)
 
-    def readStaticHeader(self, packetList):
-        self.headerLength = packetList[HEADER_LEN_POS]
-        self.payloadLength = packetList[PAYLOAD_LEN_POS]
-        self.protover = packetList[PROTOVER_POS]
-
-    def readDynamicHeader(self, packetList):
-        self.header = packetList[0:self.headerLength]
-        if self.headerLength == HEADER_LENGTH:
-            self.packetCounter = parseLittleEndian(
-                packetList[PACKETCOUNTER_POS:PACKETCOUNTER_POS+2])
-            self.id = packetList[ID_POS]
-        else:
-            logging.info("incorrect header length: %d" % self.headerLength)
+    def readHeader(self):
+        if self.packetBytes[HEADER_LEN_POS] != HEADER_LENGTH:
+            raise Exceptions.InvalidPacketException("incorrect header length: %d" % self.packetBytes[HEADER_LEN_POS])
+        (self.headerLength, self.payloadLength, self.protover, self.packetCounter,
+         self.id) = HEADER_STRUCT.unpack_from(self.packetBytes, HEADER_LEN_POS)
 
-    def readPayload(self, packetList):
-        self.blePacket = None
-        self.OK = False
+    def readPayload(self):
+        packetBytes = self.packetBytes
 
-        if not self.validatePacketList(packetList):
-            raise Exceptions.InvalidPacketException("packet list not valid: %s" % str(packetList))
+        if not self.validatePacketList():
+            raise Exceptions.InvalidPacketException("packet list not valid: %s" % str(self.getList()))
         else:
             self.valid = True
 
-        self.payload = packetList[PAYLOAD_POS:PAYLOAD_POS+self.payloadLength]
-
         if self.id == EVENT_PACKET:
             try:
-                self.bleHeaderLength = packetList[BLE_HEADER_LEN_POS]
+                self.bleHeaderLength = packetBytes[BLE_HEADER_LEN_POS]
                 if self.bleHeaderLength == BLE_HEADER_LENGTH:
-                    self.flags = packetList[FLAGS_POS]
+                    (self.flags, self.channel, self.rawRSSI, self.eventCounter,
+                     self.timestamp) = BLE_HEADER_STRUCT.unpack_from(packetBytes, FLAGS_POS)
                     self.readFlags()
-                    self.channel = packetList[CHANNEL_POS]
-                    self.rawRSSI = packetList[RSSI_POS]
                     self.RSSI = -self.rawRSSI
-                    self.txAdd = packetList[TXADD_POS] & TXADD_MSK
-                    self.eventCounter = parseLittleEndian(
-                        packetList[EVENTCOUNTER_POS:EVENTCOUNTER_POS+2])
-                    self.timestamp = parseLittleEndian(packetList[TIMESTAMP_POS:TIMESTAMP_POS+2])
-                    # self.payload = packetList[13:(4+self.length)]
+                    self.txAdd = packetBytes[TXADD_POS] & TXADD_MSK
                     # The hardware adds a padding byte which isn't sent on air.
                     # The following removes it.
-                    self.packetList.pop(BLEPACKET_POS+6)
+                    self.paddingByte = packetBytes[BLEPACKET_POS+6]
+                    del packetBytes[BLEPACKET_POS+6]
                     self.payloadLength -= 1
-                    if packetList[PAYLOAD_LEN_POS] > 0:
-                        packetList[PAYLOAD_LEN_POS] -= 1
-
-                if self.OK:
-                    try:
-                        self.blePacket = BlePacket(packetList[BLEPACKET_POS:])
-                    except:  # noqa: E722
-                        logging.exception("blePacket error")
+                    if packetBytes[PAYLOAD_LEN_POS] > 0:
+                        packetBytes[PAYLOAD_LEN_POS] -= 1
             except:  # noqa: E722
                 # malformed packet
                 logging.exception("packet error")
                 self.OK = False
         elif self.id == PING_RESP:
-            self.version = parseLittleEndian(self.packetList[PAYLOAD_POS:PAYLOAD_POS+2])
+            self.version = UINT16_STRUCT.unpack_from(packetBytes, PAYLOAD_POS)[0]
         elif self.id == SWITCH_BAUD_RATE_RESP or self.id == SWITCH_BAUD_RATE_REQ:
-            self.baud_rate = parseLittleEndian(packetList[PAYLOAD_POS:PAYLOAD_POS+4])
+            self.baudRate = UINT32_STRUCT.unpack_from(packetBytes, PAYLOAD_POS)[0]
         elif self.id == TEST_RESULT_ID:
-            self.testId = packetList[PAYLOAD_POS]
-            self.testLength = packetList[PAYLOAD_POS+1]
-            self.testPayload = packetList[PAYLOAD_POS+2:]
+            self.testId = packetBytes[PAYLOAD_POS]
+            self.testLength = packetBytes[PAYLOAD_POS+1]
 
     def readFlags(self):
         self.crcOK = not not (self.flags & 1)
@@ -418,79 +436,143 @@ class Packet:
         self.micOK = not not (self.flags & 8)
         self.OK = self.crcOK and (self.micOK or not self.encrypted)
 
+    @property
+    def blePacket(self):
+        if self._blePacket is None and self.OK and self.id == EVENT_PACKET:
+            try:
+                self._blePacket = BlePacket(self.packetBytes, BLEPACKET_POS)
+            except:  # noqa: E722
+                logging.exception("blePacket error")
+        return self._blePacket
+
+    @property
+    def header(self):
+        return list(self.packetBytes[0:self.headerLength])
+
+    @property
+    def payload(self):
+        # Payload is as the board has sent it, the padding byte which is removed from the frame is put back
+        payload = list(self.packetBytes[PAYLOAD_POS:PAYLOAD_POS+self.payloadLength])
+        if self.paddingByte is not None:
+            payload.insert(BLEPACKET_POS+6-PAYLOAD_POS, self.paddingByte)
+        return payload
+
+    @property
+    def testPayload(self):
+        return list(self.packetBytes[PAYLOAD_POS+2:])
+
+    @property
+    def baud_rate(self):
+        return self.baudRate
+
+    @property
+    def packetList(self):
+        return self.getList()
+
     def getList(self):
-        return self.packetList
+        return list(self.packetBytes)
+
+    def getBytes(self):
+        return self.packetBytes
 
-    def validatePacketList(self, packetList):
+    def validatePacketList(self):
         try:
-            if (packetList[PAYLOAD_LEN_POS] + packetList[HEADER_LEN_POS]) == len(packetList):
+            if (self.packetBytes[PAYLOAD_LEN_POS] + self.packetBytes[HEADER_LEN_POS]) == len(self.packetBytes):
                 return True
             else:
                 return False
         except:  # noqa: E722
-            logging.exception("Invalid packet: %s" % str(packetList))
+            logging.exception("Invalid packet: %s" % str(self.getList()))
             return False
 
 
-class BlePacket():
-    def __init__(self, packetList):
-        self.extractAccessAddress(packetList)
-        if self.accessAddress == ADV_ACCESS_ADDRESS:
-            self.extractAdvType(packetList)
-            self.extractAdvAddress(packetList)
-            self.extractName(packetList)
-        self.extractLength(packetList)
-        self.payload = packetList[6:]
+class BlePacket(object):
+    # Only the access address is decoded up front, advertising fields are decoded once when they are read
+    __slots__ = ("packetBytes", "offset", "accessAddressValue", "_advAddress", "_name")
+
+    def __init__(self, packetBytes, offset=0):
+        if not isinstance(packetBytes, bytearray):
+            packetBytes = bytearray(packetBytes)
+        self.packetBytes = packetBytes
+        self.offset = offset
+        self.accessAddressValue = UINT32_STRUCT.unpack_from(packetBytes, offset)[0]
+        self._advAddress = NOT_DECODED
+        self._name = NOT_DECODED
 
     def __repr__(self):
         return "BLE packet, AAddr: "+str(self.accessAddress)
 
-    def extractAccessAddress(self, packetList):
-        self.accessAddress = packetList[0:4]
-
-    def extractAdvType(self, packetList):
-        self.advType = (packetList[4] & 15)
-
-    def extractAdvAddress(self, packetList):
-        addr = None
-        if (self.advType == 0 or self.advType == 1 or self.advType == 2 or self.advType == 4
-           or self.advType == 6):
-            addrType = not not packetList[4] & 64
-            addr = packetList[6:12]
-            addr.reverse()
-            addr += [addrType]
-        elif (self.advType == 3 or self.advType == 5):
-            addrType = not not packetList[4] & 64
-            addr = packetList[12:18]
-            addr.reverse()
-            addr += [addrType]
-
-        self.advAddress = addr
-
-    def extractName(self, packetList):
+    def isAdvertising(self):
+        return self.accessAddressValue == ADV_ACCESS_ADDRESS_VALUE
+
+    @property
+    def accessAddress(self):
+        return list(self.packetBytes[self.offset:self.offset+4])
+
+    @property
+    def advType(self):
+        if not self.isAdvertising():
+            return None
+        return self.packetBytes[self.offset+4] & 15
+
+    @property
+    def advAddress(self):
+        if self._advAddress is NOT_DECODED:
+            self._advAddress = self.extractAdvAddress() if self.isAdvertising() else None
+        return self._advAddress
+
+    @property
+    def name(self):
+        if self._name is NOT_DECODED:
+            self._name = self.extractName() if self.isAdvertising() else None
+        return self._name
+
+    @property
+    def length(self):
+        return self.packetBytes[self.offset+5]
+
+    @property
+    def payload(self):
+        return list(self.packetBytes[self.offset+6:])
+
+    def extractAdvAddress(self):
+        advType = self.advType
+        if advType == 0 or advType == 1 or advType == 2 or advType == 4 or advType == 6:
+            start = self.offset+6
+        elif advType == 3 or advType == 5:
+            start = self.offset+12
+        else:
+            return None
+        addr = list(self.packetBytes[start:start+6])
+        addr.reverse()
+        addr += [not not self.packetBytes[self.offset+4] & 64]
+        return addr
+
+    def extractName(self):
         name = ""
-        if (self.advType == 0 or self.advType == 2 or self.advType == 6):
-            i = 12
-            while i < len(packetList):
-                length = packetList[i]
-                if (i+length+1) > len(packetList) or length == 0:
+        advType = self.advType
+        if advType == 0 or advType == 2 or advType == 6:
+            packetBytes = self.packetBytes
+            i = self.offset+12
+            while i < len(packetBytes):
+                length = packetBytes[i]
+                if (i+length+1) > len(packetBytes) or length == 0:
                     break
-                type = packetList[i+1]
+                type = packetBytes[i+1]
                 if type == 8 or type == 9:
-                    nameList = packetList[i+2:i+length+1]
-                    name = ""
-                    for j in nameList:
-                        name += chr(j)
+                    name = toString(packetBytes[i+2:i+length+1])
                 i += (length+1)
             name = '"'+name+'"'
-        elif (self.advType == 1):
+        elif advType == 1:
             name = "[ADV_DIRECT_IND]"
+        return name
 
-        self.name = name  # .decode(encoding="UTF-8")
 
-    def extractLength(self, packetList):
-        length = packetList[5]
-        self.length = length
+def toString(byteArray):
+    # Characters map one to one to bytes as chr() did
+    if six.PY2:
+        return str(byteArray)
+    return byteArray.decode("latin-1")
 
 
 def parseLittleEndian(list):
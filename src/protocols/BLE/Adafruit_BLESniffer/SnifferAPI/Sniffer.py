@@ -27,12 +27,13 @@ class Sniffer(threading.Thread, SnifferCollector.SnifferCollector):
         SnifferCollector.SnifferCollector.__init__(self, portnum)
         self.daemon = True
 
-        self.subscribe("COMPORT_FOUND", self.comPortFound)
+        # The board id must be known before the first packet is captured
+        self.subscribe("COMPORT_FOUND", self.comPortFound, synchronous=True)
 
     # API STARTS HERE
 
     # Get [number] number of packets since last fetch (-1 means all)
-    # Note that the packet buffer is limited to about 80000 packets.
+    # Note that the packet buffer is limited to 100000 packets, the oldest ones are dropped when it is full.
     # Returns: A list of Packet objects
     def getPackets(self, number=-1):
         return self._getPackets(number)
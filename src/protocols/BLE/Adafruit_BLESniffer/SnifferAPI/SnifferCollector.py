@@ -3,8 +3,8 @@ from . import Packet, Exceptions, CaptureFiles, Devices, Notifications, Version
 import threading
 import logging
 import copy
+import unittest
 from serial import SerialException
-from six.moves import range
 
 
 REQ_FOLLOW = 0x00
@@ -35,9 +35,57 @@ STATE_FOLLOWING = 2
 
 ADV_ACCESS_ADDRESS = [0xD6, 0xBE, 0x89, 0x8E]
 
+PACKET_HISTORY_CAPACITY = 100000
+
+
+class PacketHistory(object):
+    # Fixed capacity ring of the latest packets with an index by packet counter.
+    # Packets from start to end are not fetched yet. Fetched packets stay in the ring for lookups until they
+    # are overwritten, and a full ring drops its oldest unfetched packet instead of shifting the whole history.
+    def __init__(self, capacity=PACKET_HISTORY_CAPACITY):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.start = 0  # Sequence number of the oldest unfetched packet
+        self.end = 0  # Sequence number of the next packet
+        self.packetsByCounter = {}
+        self.droppedPackets = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, packet):
+        slot = self.end % self.capacity
+        overwritten = self.slots[slot]
+        if overwritten is not None and self.packetsByCounter.get(overwritten.packetCounter) is overwritten:
+            del self.packetsByCounter[overwritten.packetCounter]
+        self.slots[slot] = packet
+        self.packetsByCounter[packet.packetCounter] = packet
+        self.end += 1
+        if self.end - self.start > self.capacity:
+            self.start += 1
+            self.droppedPackets += 1
+
+    def findByPacketCounter(self, packetCounterValue):
+        # Latest packet with the counter, counters wrap around so older ones are shadowed
+        return self.packetsByCounter.get(packetCounterValue)
+
+    def fetch(self, number=-1):
+        # Remove and return up to number oldest unfetched packets, all of them if number is negative
+        count = len(self) if number < 0 else min(number, len(self))
+        first = self.start % self.capacity
+        last = first + count
+        if last <= self.capacity:
+            packets = self.slots[first:last]
+        else:
+            packets = self.slots[first:] + self.slots[:last - self.capacity]
+        self.start += count
+        return packets
+
 
 class SnifferCollector(Notifications.Notifier):
     def __init__(self, portnum=None, *args, **kwargs):
+        # Subscribers are called from a dispatcher thread, the UART reader thread only queues notifications
+        kwargs.setdefault("asynchronous", True)
         Notifications.Notifier.__init__(self, *args, **kwargs)
         self._portnum = portnum
         self._swversion = Version.getRevision()
@@ -48,7 +96,7 @@ class SnifferCollector(Notifications.Notifier):
         self._connectionAccessAddress = None
         self._packetListLock = threading.RLock()
         with self._packetListLock:
-            self._packets = []
+            self._packets = PacketHistory()
 
         self._packetReader = Packet.PacketReader(
             self._portnum,  callbacks=[("*", self.passOnNotification)])
@@ -124,22 +172,24 @@ class SnifferCollector(Notifications.Notifier):
         self._nProcessedPackets += 1
         if packet.OK:
             try:
-                if packet.blePacket.accessAddress == ADV_ACCESS_ADDRESS:
+                blePacket = packet.blePacket
+                if blePacket.isAdvertising():
+                    advType = blePacket.advType
 
-                    if self.state == STATE_FOLLOWING and packet.blePacket.advType == 5:
-                        self._connectionAccessAddress = packet.blePacket.accessAddress
+                    if self.state == STATE_FOLLOWING and advType == 5:
+                        self._connectionAccessAddress = blePacket.accessAddress
 
                     if self.state == STATE_SCANNING:
-                        if (packet.blePacket.advType == 0
-                            or packet.blePacket.advType == 1
-                            or packet.blePacket.advType == 2
-                            or packet.blePacket.advType == 4
-                            or packet.blePacket.advType == 6
-                            ) and (packet.blePacket.advAddress is not None
+                        if (advType == 0
+                            or advType == 1
+                            or advType == 2
+                            or advType == 4
+                            or advType == 6
+                            ) and (blePacket.advAddress is not None
                                    ) and (packet.crcOK and not packet.direction):
 
                             newDevice = Devices.Device(
-                                address=packet.blePacket.advAddress, name=packet.blePacket.name,
+                                address=blePacket.advAddress, name=blePacket.name,
                                 RSSI=packet.RSSI, txAdd=packet.txAdd)
                             self._devices.appendOrUpdate(newDevice)
 
@@ -157,6 +207,9 @@ class SnifferCollector(Notifications.Notifier):
             except Exceptions.SnifferTimeout as e:
                 logging.info(str(e))
                 packet = None
+                # Nothing arrived for a while, do not hold back buffered packets and device updates
+                self._captureHandler.flush()
+                self._devices.flushUpdates()
             except (SerialException, ValueError):
                 logging.exception("UART read error")
                 logging.error("Lost contact with sniffer hardware.")
@@ -192,11 +245,7 @@ class SnifferCollector(Notifications.Notifier):
 
     def _findPacketByPacketCounter(self, packetCounterValue):
         with self._packetListLock:
-            for i in range(-1, -1-len(self._packets), -1):
-                # iterate backwards through packets
-                if self._packets[i].packetCounter == packetCounterValue:
-                    return self._packets[i]
-        return None
+            return self._packets.findByPacketCounter(packetCounterValue)
 
     def _startScanning(self):
         logging.info("starting scan")
@@ -213,6 +262,8 @@ class SnifferCollector(Notifications.Notifier):
         self._exit = True
         self.notify("APP_EXIT")
         self._packetReader.doExit()
+        self._captureHandler.close()
+        self.stopDispatching()
 
     def _startFollowing(self, device, followOnlyAdvertisements=False):
 
@@ -225,18 +276,65 @@ class SnifferCollector(Notifications.Notifier):
 
     def _appendPacket(self, packet):
         with self._packetListLock:
-            if len(self._packets) > 100000:
-                self._packets = self._packets[20000:]
             self._packets.append(packet)
 
     def _getPackets(self, number=-1):
         with self._packetListLock:
-            returnList = self._packets[0:number]
-            self._packets = self._packets[number:]
-        return returnList
+            return self._packets.fetch(number)
 
     def _sendTestPacket(self, payload):
         self._packetReader.sendTestPacket(payload)
 
     def _getTestPacket(self):
         return self._packetReader.getPacket()
+
+
+class TestPacketHistory(unittest.TestCase):
+    class CountedPacket(object):
+        def __init__(self, packetCounter):
+            self.packetCounter = packetCounter
+
+    def appendPackets(self, history, counters):
+        packets = [self.CountedPacket(counter) for counter in counters]
+        for packet in packets:
+            history.append(packet)
+        return packets
+
+    def test_append_past_capacity(self):
+        history = PacketHistory(capacity=4)
+        packets = self.appendPackets(history, range(6))
+        self.assertEqual(4, len(history))
+        self.assertEqual(2, history.droppedPackets)
+        # Oldest packets are dropped and so are their counters
+        self.assertIsNone(history.findByPacketCounter(0))
+        self.assertIs(packets[5], history.findByPacketCounter(5))
+        self.assertEqual(packets[2:], history.fetch())
+        self.assertEqual(0, len(history))
+
+    def test_fetch_across_wrap(self):
+        history = PacketHistory(capacity=4)
+        packets = self.appendPackets(history, range(3))
+        self.assertEqual(packets[:2], history.fetch(2))
+        packets += self.appendPackets(history, range(3, 6))
+        # Unfetched packets run from the end of the ring to its beginning
+        self.assertEqual(4, len(history))
+        self.assertEqual(0, history.droppedPackets)
+        self.assertEqual(packets[2:5], history.fetch(3))
+        self.assertEqual(packets[5:], history.fetch(10))
+        self.assertEqual([], history.fetch())
+        # Fetched packets can still be looked up until they are overwritten
+        self.assertIs(packets[3], history.findByPacketCounter(3))
+
+    def test_counter_shadowing(self):
+        history = PacketHistory(capacity=4)
+        first, second = self.appendPackets(history, [7, 7])
+        self.assertIs(second, history.findByPacketCounter(7))
+        # Overwriting the shadowed packet keeps the index of the latest one
+        self.appendPackets(history, [1, 2, 3])
+        self.assertIs(second, history.findByPacketCounter(7))
+        self.appendPackets(history, [4])
+        self.assertIsNone(history.findByPacketCounter(7))
+
+
+if __name__ == '__main__':
+    unittest.main()
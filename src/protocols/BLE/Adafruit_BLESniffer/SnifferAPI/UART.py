@@ -56,6 +56,27 @@ class Uart:
             self.byteQueue.extend(value)
         return value
 
+    def readAvailable(self, timeout=None, maxLength=4096):
+        # Block for the first byte only, then take everything the driver has buffered
+        if timeout != self.ser.timeout:
+            try:
+                self.ser.timeout = timeout
+            except ValueError as e:
+                logging.error("Error setting UART read timeout. Continuing.")
+
+        try:
+            available = self.ser.in_waiting
+        except AttributeError:
+            available = self.ser.inWaiting()
+        value = self.ser.read(min(max(available, 1), maxLength))
+        if not value:
+            raise Exceptions.SnifferTimeout(
+                "UART read timeout (" + str(self.ser.timeout) + " seconds).")
+
+        if self.useByteQueue:
+            self.byteQueue.extend(value)
+        return value
+
     def readByte(self, timeout=None):
         readString = ""
 
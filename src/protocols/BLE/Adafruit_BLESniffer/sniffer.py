@@ -98,7 +98,7 @@ def selectDevice(devlist):
 
 
 def dumpPackets():
-    """Dumps incoming packets to the display"""
+    """Dumps incoming packets to the display and returns how many of them are dumped"""
     # Get (pop) unprocessed BLE packets.
     packets = mySniffer.getPackets()
     # Display the packets on the screen in verbose mode
@@ -112,6 +112,7 @@ def dumpPackets():
                 print(packet)
     else:
         print('.' * len(packets))
+    return len(packets)
 
 
 if __name__ == '__main__':
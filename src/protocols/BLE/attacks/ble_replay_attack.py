@@ -24,7 +24,8 @@ class BLEReplayAttack(Attack):
 
     def run(self):
         super(BLEReplayAttack, self).run()
-        BLEReplayAttackHelper(self.file_path)
+        BLEReplayAttackHelper(self.file_path, self.metrics)
+        self.metrics.finish()
 
     def stop_attack(self):
         pass  # Since this attack is so short there is no need to a stop routine.
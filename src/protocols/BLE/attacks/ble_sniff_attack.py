@@ -25,7 +25,7 @@ class BLESniffAttack(Attack):
 
     def run(self):
         self.bleSni = BLESniffer(
-            self.port)  # if we initialize this in init, it gives an error when we want to go back after an attack
+            self.port, self.metrics)  # if we initialize this in init, it gives an error when we want to go back after an attack
         super(BLESniffAttack, self).run()
         self.bleSni.run()
 
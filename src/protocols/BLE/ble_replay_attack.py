@@ -1,4 +1,5 @@
 import os
+from Entity import metrics as Metrics
 from protocols.BLE.ble_device import BLEDevice
 
 
@@ -7,9 +8,14 @@ class BLEReplayAttackHelper:
     This is the helper class which is used to perform BLE Replay attack.
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, metrics=None):
+        """
+        :param metrics: Optional metrics of the attack which replayed writes are counted in
+        :type metrics: Metrics.AttackMetrics
+        """
         self.file_path = file_path
         self.write_requests = {}
+        self.metrics = metrics if metrics is not None else Metrics.AttackMetrics("BLE Replay Attack Helper")
         self.run()
 
     def run(self):
@@ -76,6 +82,8 @@ class BLEReplayAttackHelper:
         """
         Replay all write requests
         """
+        messages_sent = self.metrics.counter(Metrics.MESSAGES_SENT, "Replayed write requests")
+        bytes_sent = self.metrics.counter(Metrics.BYTES_SENT, "Written value bytes")
         # Replay all write request
         for slave_address in self.write_requests:
             # Create a connection to the device
@@ -85,6 +93,8 @@ class BLEReplayAttackHelper:
                 handle = handle_value_pair["handle"]
                 value = handle_value_pair["value"]
                 device.writecmd(handle, value)
+                messages_sent.inc()
+                bytes_sent.inc(len(value))
                 print "wrote " + value + " to handle: " + handle
 
     def delete_tmp_file(self):
@@ -2,6 +2,7 @@ import os
 import sys
 import time
 
+from Entity import metrics as Metrics
 from Utils import CommonUtil
 from protocols.BLE.Adafruit_BLESniffer import sniffer
 from protocols.BLE.Adafruit_BLESniffer.SnifferAPI import CaptureFiles
@@ -11,9 +12,10 @@ class BLESniffer:
     stopped_flag = False
     serial_port = None
 
-    def __init__(self, serial_portt):
+    def __init__(self, serial_portt, metrics=None):
 
         self.stopped_flag = False
+        self.metrics = metrics if metrics is not None else Metrics.AttackMetrics("BLE Sniffer")
         # store the captured packets
         PATH_TO_FILE = BLESniffer.create_file_name()
 
@@ -75,8 +77,9 @@ class BLESniffer:
                     print("ERROR: Could not find the selected device")
 
             # Dump packets
+            packets_captured = self.metrics.counter(Metrics.PACKETS_CAPTURED, "Captured BLE packets")
             while (self.stopped_flag is False) and (d is not None):  # Dogukan
-                sniffer.dumpPackets()
+                packets_captured.inc(sniffer.dumpPackets())
                 time.sleep(1)
 
             # Close gracefully
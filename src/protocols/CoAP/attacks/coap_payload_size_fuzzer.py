@@ -5,11 +5,12 @@ import signal
 import time
 import unittest
 
-from coapthon.client.helperclient import HelperClient
-
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
+from Utils.FuzzerUtil.sized_payload_util import SizedPayloadGenerator
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
 from protocols import CoAP as PeniotCoAP
+from protocols.CoAP.coap_pipelined_client import CoAPPipelinedClient
 
 
 class CoAPPayloadSizeFuzzerAttack(Attack):
@@ -26,22 +27,27 @@ class CoAPPayloadSizeFuzzerAttack(Attack):
     method = None
     method_string = PeniotCoAP.get_coap_methods_as_string(PeniotCoAP.CoAPMethods.POST)
     fuzzing_turn = 10
+    window_size = 32
 
     # Miscellaneous Members
     logger = None
     max_payload_length = 2 ** 16 - 1
     sent_message_count = 0  # Transmitted fuzzing packets
     stopped_flag = False
+    turn_rate = 1.0  # Fuzzing turns per second
+    rate_limiter = None
+    payload_generator = None
 
     def __init__(self):
-        default_parameters = ["", "", "", "", 10, self.max_payload_length]
+        default_parameters = ["", "", "", "", 10, self.max_payload_length, 32]
         inputs = [
             InputFormat("Host Name", "host", "", str, mandatory=True),
             InputFormat("Port Number", "port", "", int, mandatory=True),
             InputFormat("Endpoint", "path", "", str, mandatory=True),
             InputFormat("Method", "method_string", self.method_string, str, mandatory=True),
             InputFormat("Fuzzing Round Count", "fuzzing_turn", self.fuzzing_turn, int),
-            InputFormat("Maximum Payload Size", "max_payload_length", self.max_payload_length, int, mandatory=True)
+            InputFormat("Maximum Payload Size", "max_payload_length", self.max_payload_length, int, mandatory=True),
+            InputFormat("Window Size", "window_size", self.window_size, int)
         ]
 
         Attack.__init__(self, "CoAP Payload Size Fuzzer Attack", inputs, default_parameters,
@@ -57,19 +63,18 @@ class CoAPPayloadSizeFuzzerAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Sent message count: {0}, exitting...".format(self.sent_message_count))
-        self.stopped_flag = True
-        if self.client is not None:
-            self.client.stop()
-            self.client = None
+        self.stopped_flag = True  # Client is closed by the attack loop once it sees the flag
         time.sleep(2)  # Sleep two seconds so the user can see the message
 
     def pre_attack_init(self):
+        self.method = PeniotCoAP.get_coap_methods_by_name(self.method_string)
         try:
             assert PeniotCoAP.does_method_have_payload(self.method) and self.fuzzing_turn >= 2
         except AssertionError as e:
             raise
-        self.client = HelperClient(server=(self.host, self.port))
-        self.method = PeniotCoAP.get_coap_methods_by_name(self.method_string)
+        self.client = CoAPPipelinedClient((self.host, self.port), window_size=self.window_size,
+                                          metrics=self.metrics)
+        self.payload_generator = SizedPayloadGenerator()
 
     def run(self):
         Attack.run(self)
@@ -81,22 +86,27 @@ class CoAPPayloadSizeFuzzerAttack(Attack):
 
         fuzzing = 0
         self.logger.info("Size payload fuzzing is started. Please consider it may take some time.")
+        # Turns are paced by the rate limiter, so time spent on a turn is not added to the interval
+        self.rate_limiter = RateLimiter(ConstantProfile(self.turn_rate))
+        self.rate_limiter.start()
         for payload_size in size_list:
 
+            # Wait in short slices so that the stop flag is still checked while the limiter is paused
+            while self.stopped_flag is False and not self.rate_limiter.acquire(max_wait=0.1):
+                pass
             if self.stopped_flag is True:  # Attack is terminated
                 break
 
-            # Create payload and send it
-            random_strings = "".join([chr(_) for _ in range(65, 91)]) + "".join([chr(_) for _ in range(97, 123)])
-            random_character = random.choice(random_strings)
-            sized_payload = random_character * payload_size
-            PeniotCoAP.make_request(self.client, self.path, self.method, sized_payload)
+            # Create payload from the reused buffer and send it, datagram size bounds the payload anyway
+            self.payload_generator.fill()
+            sized_payload = self.payload_generator.get_payload(payload_size)
+            if not self.client.request(self.method, self.path, sized_payload):
+                self.logger.error("{0} bytes of payload cannot be sent.".format(payload_size))
 
             # Informative procedures
             self.logger.info("Turn {0} is completed".format(fuzzing + 1))
             self.sent_message_count += 1
             fuzzing += 1
-            time.sleep(1)
 
         if self.stopped_flag is False:
             self.logger.info("Payload size attack is finished.")
@@ -104,8 +114,12 @@ class CoAPPayloadSizeFuzzerAttack(Attack):
             self.logger.info("Payload size attack has been terminated.")
 
         if self.client is not None:
+            self.client.flush()
+            self.logger.info("Responses = {0}, timed out requests = {1}.".format(self.client.response_count,
+                                                                                 self.client.timeout_count))
             self.client.stop()
             self.client = None
+        self.metrics.finish()
 
 
 class TestCoAPPayloadSizeAttack(unittest.TestCase):
@@ -122,7 +136,7 @@ class TestCoAPPayloadSizeAttack(unittest.TestCase):
         inputs = self.coap_payload_size_fuzzer.get_inputs()
         self.assertIsNotNone(inputs)
         self.assertGreater(len(inputs), 0, "Non inserted inputs")
-        self.assertEquals(len(inputs), 6)
+        self.assertEquals(len(inputs), 7)
 
     def test_non_initialized_inputs(self):
         inputs = self.coap_payload_size_fuzzer.get_inputs()
@@ -131,7 +145,7 @@ class TestCoAPPayloadSizeAttack(unittest.TestCase):
             self.assertTrue(value is None or type(value) == _input.get_type())
 
     def test_after_getting_inputs(self):
-        example_inputs = ["a.b.c.d", 8888, "peniot-coap-test", "PuT", 13, 6583]
+        example_inputs = ["a.b.c.d", 8888, "peniot-coap-test", "PuT", 13, 6583, 16]
         for index, _input in enumerate(example_inputs):
             self.coap_payload_size_fuzzer.inputs[index].set_value(_input)
 
@@ -146,7 +160,7 @@ class TestCoAPPayloadSizeAttack(unittest.TestCase):
             self.assertEqual(example_inputs[index], value)
 
     def test_invalid_method(self):
-        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "geT", 13, 6583]
+        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "geT", 13, 6583, 16]
         for index, _input in enumerate(example_inputs):
             self.coap_payload_size_fuzzer.inputs[index].set_value(_input)
 
@@ -157,7 +171,7 @@ class TestCoAPPayloadSizeAttack(unittest.TestCase):
             self.assertTrue(True)
 
     def test_invalid_fuzzing_turn(self):
-        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "puT", 1, 6583]
+        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "puT", 1, 6583, 16]
         for index, _input in enumerate(example_inputs):
             self.coap_payload_size_fuzzer.inputs[index].set_value(_input)
 
@@ -169,7 +183,7 @@ class TestCoAPPayloadSizeAttack(unittest.TestCase):
 
     def test_payload_size_fuzzing_attack(self):
         def run_attack():
-            example_inputs = ["127.0.0.1", 5683, "peniot", "pOsT", 3, 6583]
+            example_inputs = ["127.0.0.1", 5683, "peniot", "pOsT", 3, 6583, 32]
             for index, _input in enumerate(example_inputs):
                 self.coap_payload_size_fuzzer.inputs[index].set_value(_input)
 
@@ -5,12 +5,14 @@ import signal
 import time
 import unittest
 
-from coapthon.client.helperclient import HelperClient
-
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils.FuzzerUtil import radamsa_util as rdm
+from Utils.FuzzerUtil.fuzz_case_journal import get_default_journal_path, open_journal, replay_cases
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
 from protocols import CoAP as PeniotCoAP
+from protocols.CoAP.coap_fuzzing_engine import CoAPFuzzingEngine, CoAPFuzzCaseOutcome, OUTCOME_SEND_ERROR, \
+    OUTCOME_TIMEOUT
 
 
 class CoAPRandomPayloadFuzzingAttack(Attack):
@@ -29,15 +31,21 @@ class CoAPRandomPayloadFuzzingAttack(Attack):
     method_string = PeniotCoAP.get_coap_methods_as_string(PeniotCoAP.CoAPMethods.POST)
     fuzzing_turn = 10
     fuzzing_count = 10
+    window_size = 256
+    journal_path = ""  # Default journal path is used if it is not given
 
     # Miscellaneous Members
     logger = None
     max_length_of_random_payload = 100
     sent_message_count = 0  # Transmitted fuzzing packets
     stopped_flag = False
+    turn_rate = 1.0  # Fuzzing turns per second
+    rate_limiter = None
+    radamsa_pool = None
+    journal = None
 
     def __init__(self):
-        default_parameters = ["", "", "", "", "", 2, 10, 100]
+        default_parameters = ["", "", "", "", "", 2, 10, 100, 256, ""]
         inputs = [
             InputFormat("Host Name", "host", "", str, mandatory=True),
             InputFormat("Port Number", "port", "", int, mandatory=True),
@@ -46,12 +54,17 @@ class CoAPRandomPayloadFuzzingAttack(Attack):
             InputFormat("Method", "method_string", self.method_string, str, mandatory=True),
             InputFormat("Fuzzing Round Count", "fuzzing_turn", self.fuzzing_turn, int),
             InputFormat("Number of fuzzer messages", "fuzzing_count", self.fuzzing_count, int),
-            InputFormat("Payload length", "max_length_of_random_payload", self.max_length_of_random_payload, int, mandatory=True)
+            InputFormat("Payload length", "max_length_of_random_payload", self.max_length_of_random_payload, int, mandatory=True),
+            InputFormat("Window Size", "window_size", self.window_size, int),
+            InputFormat("Journal Path", "journal_path", self.journal_path, str)
         ]
 
         Attack.__init__(self, "CoAP Random Payload Fuzzing Attack", inputs, default_parameters,
                         "    It creates a random payload and sends \n"
-                        "    this payload to the client.")
+                        "    this payload to the client.\n"
+                        "    Sent cases and their outcomes are kept\n"
+                        "    in a journal, already sent payloads\n"
+                        "    are skipped.")
 
         logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
 
@@ -63,23 +76,58 @@ class CoAPRandomPayloadFuzzingAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Sent message count: {0}, exitting...".format(self.sent_message_count))
-        self.stopped_flag = True
-        if self.client is not None:
-            self.client.stop()
-            self.client = None
+        self.stopped_flag = True  # Client is closed by the attack loop once it sees the flag
         time.sleep(2)  # Sleep two seconds so the user can see the message
 
+    def handle_outcome(self, outcome):
+        if self.journal is not None:
+            self.journal.set_outcome(outcome.case_id, outcome.status if outcome.response_code is None else
+                                     "{0} {1}".format(outcome.status, outcome.response_code))
+        # Send errors and timeouts do not have a response code
+        if outcome.status == OUTCOME_TIMEOUT or (outcome.response_code is not None and
+                                                 outcome.response_code.startswith("5")):
+            self.logger.debug("Case {0} with payload {1!r}: {2}".format(outcome.case_id, outcome.payload, outcome))
+
     def pre_attack_init(self):
-        self.client = HelperClient(server=(self.host, self.port))
         self.method = PeniotCoAP.get_coap_methods_by_name(self.method_string)
+        self.client = CoAPFuzzingEngine((self.host, self.port), self.method, self.path, window_size=self.window_size,
+                                        metrics=self.metrics, outcome_callback=self.handle_outcome)
         try:
             assert PeniotCoAP.does_method_have_payload(self.method) and self.fuzzing_turn >= 2
         except AssertionError as e:
             raise
 
+    def send_cases(self, payloads):
+        """
+        Send the cases which are not in the journal yet, they are identified by their journal identifiers
+        """
+        for payload in payloads:
+            if self.journal is None:
+                self.client.send_case(payload)
+                continue
+            case_id = self.journal.record(payload)
+            if case_id is not None:
+                self.client.send_case(payload, case_id)
+
+    def replay(self, cases):
+        """
+        Send journaled cases back to back, e.g. the cases sent right before the target has stopped responding
+        :type cases: list of Utils.FuzzerUtil.fuzz_case_journal.FuzzCase
+        :return: Number of replayed cases
+        """
+        self.pre_attack_init()
+        replayed = replay_cases(cases, self.client.send_case)
+        self.client.flush()
+        self.logger.info(self.client.get_summary())
+        self.client.stop()
+        self.client = None
+        return replayed
+
     def run(self):
         Attack.run(self)
         self.pre_attack_init()
+        self.journal = open_journal(self.journal_path or get_default_journal_path(self.get_attack_name()),
+                                    "coap://{0}:{1}/{2}".format(self.host, self.port, self.path))
 
         self.logger.info("Random payload fuzzing is started.")
 
@@ -87,40 +135,56 @@ class CoAPRandomPayloadFuzzingAttack(Attack):
             length = random.randint(1, self.max_length_of_random_payload)
             self.payload = "".join([chr(random.randint(1, 127)) for _ in range(length)])
 
-        for fuzzing in range(self.fuzzing_turn):
-            if self.stopped_flag is True:
-                break
-            while self.stopped_flag is False:
-                try:
-                    returned_strings = rdm.get_ascii_decodable_radamsa_malformed_input(self.payload, self.fuzzing_count)
-                    if type(returned_strings) == list:
-                        fuzzer_messages = [string.decode("utf-8") for string in returned_strings]
-                    else:
-                        fuzzer_messages = returned_strings.decode("utf-8")
+        # Test cases are generated ahead by long-lived radamsa workers
+        self.radamsa_pool = rdm.RadamsaWorkerPool(self.payload).start()
+        try:
+            # Turns are paced by the rate limiter, so time spent on a turn is not added to the interval
+            self.rate_limiter = RateLimiter(ConstantProfile(self.turn_rate))
+            self.rate_limiter.start()
+            for fuzzing in range(self.fuzzing_turn):
+                if self.stopped_flag is True:
                     break
-                except UnicodeDecodeError:
-                    continue
-            # Check whether result is list or not
-            if type(fuzzer_messages) == list:
-                for message in fuzzer_messages:
-                    PeniotCoAP.make_request(self.client, self.path, self.method, message)
-                    # Increment sent message count
-                    self.sent_message_count += 1
-            else:
-                PeniotCoAP.make_request(self.client, self.path, self.method, fuzzer_messages)
-                # Increment sent message count
-                self.sent_message_count += 1
-            time.sleep(1)
-            self.logger.info("Turn {0} is completed".format(fuzzing + 1))
-
+                # Responses are collected while waiting for the turn, so their latencies are measured on arrival
+                while self.stopped_flag is False and self.rate_limiter.try_acquire() == 0:
+                    self.client.poll(min(self.rate_limiter.get_wait_time(), 0.1))
+                if self.stopped_flag is True:
+                    break
+                while True:
+                    try:
+                        returned_strings = self.radamsa_pool.get_ascii_decodable_malformed_input(self.fuzzing_count)
+                        if type(returned_strings) == list:
+                            fuzzer_messages = [string.decode("utf-8") for string in returned_strings]
+                        else:
+                            fuzzer_messages = returned_strings.decode("utf-8")
+                        break
+                    except UnicodeDecodeError:
+                        continue
+                # Check whether result is list or not
+                if type(fuzzer_messages) != list:
+                    fuzzer_messages = [fuzzer_messages]
+                self.send_cases(fuzzer_messages)
+                self.sent_message_count = self.client.get_sent_case_count()
+                self.logger.info("Turn {0} is completed".format(fuzzing + 1))
+
+        finally:
+            # Workers serve test cases forever, they must not outlive the attack
+            self.radamsa_pool.stop()
         if self.stopped_flag is False:
             self.logger.info("Random payload fuzzing is finished.")
         else:
             self.logger.info("Random payload fuzzing has been terminated.")
 
         if self.client is not None:
+            self.client.flush()
+            self.logger.info(self.client.get_summary())
             self.client.stop()
             self.client = None
+        if self.journal is not None:
+            self.logger.info("{0} cases are journaled in {1}, {2} duplicate cases are skipped.".format(
+                self.journal.get_case_count(), self.journal.path, self.journal.duplicate_count))
+            self.journal.close()
+            self.journal = None
+        self.metrics.finish()
 
 
 class TestCoAPRandomPayloadAttack(unittest.TestCase):
@@ -137,7 +201,7 @@ class TestCoAPRandomPayloadAttack(unittest.TestCase):
         inputs = self.coap_random_payload_fuzzer.get_inputs()
         self.assertIsNotNone(inputs)
         self.assertGreater(len(inputs), 0, "Non inserted inputs")
-        self.assertEquals(len(inputs), 8)
+        self.assertEquals(len(inputs), 10)
 
     def test_non_initialized_inputs(self):
         inputs = self.coap_random_payload_fuzzer.get_inputs()
@@ -146,7 +210,7 @@ class TestCoAPRandomPayloadAttack(unittest.TestCase):
             self.assertTrue(value is None or type(value) == _input.get_type())
 
     def test_after_getting_inputs(self):
-        example_inputs = ["a.b.c.d", 8888, "peniot-coap-test", "Heyyo", "PuT", 13, 12, 11]
+        example_inputs = ["a.b.c.d", 8888, "peniot-coap-test", "Heyyo", "PuT", 13, 12, 11, 16, "peniot-journal.sqlite"]
         for index, _input in enumerate(example_inputs):
             self.coap_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -161,7 +225,7 @@ class TestCoAPRandomPayloadAttack(unittest.TestCase):
             self.assertEqual(example_inputs[index], value)
 
     def test_invalid_method(self):
-        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "Ghetto", "geT", 13, 12, 11]
+        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "Ghetto", "geT", 13, 12, 11, 16, ""]
         for index, _input in enumerate(example_inputs):
             self.coap_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -172,7 +236,7 @@ class TestCoAPRandomPayloadAttack(unittest.TestCase):
             self.assertTrue(True)
 
     def test_invalid_fuzzing_turn(self):
-        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "Keyyo", "puT", 1, 12, 11]
+        example_inputs = ["127.0.0.1", 8888, "peniot-coap-test", "Keyyo", "puT", 1, 12, 11, 16, ""]
         for index, _input in enumerate(example_inputs):
             self.coap_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -182,9 +246,13 @@ class TestCoAPRandomPayloadAttack(unittest.TestCase):
         except AssertionError as e:
             self.assertTrue(True)
 
+    def test_handle_send_error(self):
+        self.coap_random_payload_fuzzer.handle_outcome(
+            CoAPFuzzCaseOutcome(0, "payload", None, None, OUTCOME_SEND_ERROR))
+
     def test_random_payload_fuzzing_attack(self):
         def run_attack():
-            example_inputs = ["127.0.0.1", 5683, "peniot", None, "pOsT", 3, 5, 12]
+            example_inputs = ["127.0.0.1", 5683, "peniot", None, "pOsT", 3, 5, 12, 32, ""]
             for index, _input in enumerate(example_inputs):
                 self.coap_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -4,6 +4,7 @@ import socket
 import time
 import unittest
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils.SnifferUtil import generic_sniffer
@@ -66,8 +67,11 @@ class CoAPReplayAttack(Attack):
             udp_payload = CoAPScanner.get_raw_udp_payload_as_bytes(selected_packet)
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             sock.sendto(udp_payload, (str(selected_packet["ip"].dst), int(selected_packet["udp"].dstport)))
+            self.metrics.counter(metrics.MESSAGES_SENT, "Replayed CoAP messages").inc()
+            self.metrics.counter(metrics.BYTES_SENT, "Sent bytes").inc(len(udp_payload))
         except IndexError as e:
             self.logger.error("Invalid packet index. Indices start from 0...")
+        self.metrics.finish()
 
     def pre_attack_process(self):
         """
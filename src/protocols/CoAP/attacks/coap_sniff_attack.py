@@ -1,8 +1,10 @@
+import collections
 import logging
 import signal
 import time
 import unittest
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils import CommonUtil
@@ -22,6 +24,7 @@ class CoAPSniffAttack(Attack):
 
     # Miscellaneous Members
     logger = None
+    sniffer = None
 
     def __init__(self):
         default_parameters = [10.0, generic_sniffer.DEFAULT_INTERFACE, generic_sniffer.DEFAULT_SAVE]
@@ -45,18 +48,37 @@ class CoAPSniffAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Exitting...")
+        if self.sniffer is not None:
+            self.sniffer.stop_live_capture()
         time.sleep(2)  # Sleep two seconds so the user can see the message
 
     def run(self):
         super(CoAPSniffAttack, self).run()
-        packets = CoAPScanner().scan(self.timeout, self.interface,
-                                     output_pcap_filename="CoAP_" + CommonUtil.get_current_datetime_for_filename_format() if self.save_output else None)
+        self.sniffer = CoAPScanner.create_sniffer(self.timeout, self.interface,
+                                                  output_pcap_filename="CoAP_" + CommonUtil.get_current_datetime_for_filename_format() if self.save_output else None)
 
-        for packet in packets:
-            self.logger.info(packet)
+        packets = self.report_packets(self.sniffer.iter_live_capture())
+        self.metrics.gauge("packets_dropped", "Packets dropped since they could not be consumed in time").set(
+            self.sniffer.get_dropped_packet_count())
+        self.metrics.finish()
+        self.sniffer = None
 
         return packets
 
+    def report_packets(self, packets):
+        """
+        Report packets as soon as they are captured, only the most recent ones are kept
+        so that memory usage does not grow with capture duration
+        :return: Most recent packets as list
+        """
+        recent_packets = collections.deque(maxlen=generic_sniffer.RECENT_PACKET_COUNT)
+        packets_captured = self.metrics.counter(metrics.PACKETS_CAPTURED, "Captured CoAP packets")
+        for packet in packets:
+            self.logger.info(packet)
+            recent_packets.append(packet)
+            packets_captured.inc()
+        return list(recent_packets)
+
 
 class TestCoAPSniffAttack(unittest.TestCase):
     def setUp(self):
@@ -86,6 +108,13 @@ class TestCoAPSniffAttack(unittest.TestCase):
             value = getattr(self.coap_sniff_attack, _input.get_name())
             self.assertEqual(example_inputs[index], value)
 
+    def test_report_packets(self):
+        self.coap_sniff_attack.logger = logging.getLogger("test")
+        packet_count = generic_sniffer.RECENT_PACKET_COUNT * 3 + 1
+        packets = self.coap_sniff_attack.report_packets(iter(xrange(packet_count)))
+        self.assertEqual(range(packet_count - generic_sniffer.RECENT_PACKET_COUNT, packet_count), packets)
+        self.assertEqual(packet_count, self.coap_sniff_attack.get_metrics().get_snapshot()[metrics.PACKETS_CAPTURED])
+
     def test_sniff_attack(self):
         example_inputs = [10.0]
         for index, _input in enumerate(example_inputs):
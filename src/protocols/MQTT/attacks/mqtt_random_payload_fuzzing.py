@@ -8,10 +8,14 @@ import random
 import signal
 import time
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils.FuzzerUtil import radamsa_util as rdm
+from Utils.FuzzerUtil.fuzz_case_journal import get_default_journal_path, open_journal, replay_cases, \
+    OUTCOME_SEND_ERROR
 from Utils.RandomUtil import random_generated_names
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
 
 
 class MQTTRandomPayloadFuzzingAttack(Attack):
@@ -27,26 +31,35 @@ class MQTTRandomPayloadFuzzingAttack(Attack):
     turn = 10
     count = 1
     payload = None
+    journal_path = ""  # Default journal path is used if it is not given
 
     # Misc Members
     logger = None
     max_length_of_random_payload = 100
     sent_message_count = 0
     stopped_flag = False
+    turn_rate = 1.0  # Fuzzing turns per second
+    rate_limiter = None
+    radamsa_pool = None
+    journal = None
 
     def __init__(self):
-        default_parameters = ["127.0.0.1", "#", 10, 10, ""]
+        default_parameters = ["127.0.0.1", "#", 10, 10, "", ""]
         inputs = [
             InputFormat("Broker Address", "address", "", str, mandatory=True),
             InputFormat("Topic", "topic", "", str, mandatory=True),
             InputFormat("Fuzzing Turn", "turn", self.turn, int),
             InputFormat("Fuzzing Message Count in each Turn", "count", self.count, int),
-            InputFormat("Payload", "payload", "", str, mandatory=True)
+            InputFormat("Payload", "payload", "", str, mandatory=True),
+            InputFormat("Journal Path", "journal_path", self.journal_path, str)
         ]
 
         Attack.__init__(self, "MQTT Random Payload Fuzzing Attack", inputs, default_parameters,
                         "    It creates a random payload and sends \n"
-                        "    this payload to the client.")
+                        "    this payload to the client.\n"
+                        "    Sent cases and their outcomes are kept\n"
+                        "    in a journal, already sent payloads\n"
+                        "    are skipped.")
 
         logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
 
@@ -71,9 +84,30 @@ class MQTTRandomPayloadFuzzingAttack(Attack):
         except Exception as e:
             self.logger.error("Failed to connect to broker")
 
+    def publish(self, payload):
+        """
+        :return: Whether the payload could be queued for publishing
+        """
+        return self.client.publish(self.topic, payload).rc == paho.MQTT_ERR_SUCCESS
+
+    def replay(self, cases):
+        """
+        Publish journaled cases back to back, e.g. the cases sent right before the broker has stopped responding
+        :type cases: list of Utils.FuzzerUtil.fuzz_case_journal.FuzzCase
+        :return: Number of replayed cases
+        """
+        self.pre_attack_init()
+        self.client.loop_start()
+        replayed = replay_cases(cases, self.publish)
+        self.client.disconnect()
+        self.client.loop_stop()
+        return replayed
+
     def run(self):
         Attack.run(self)
         self.pre_attack_init()
+        self.journal = open_journal(self.journal_path or get_default_journal_path(self.get_attack_name()),
+                                    "mqtt://{0}/{1}".format(self.address, self.topic))
 
         self.client.loop_start()
         self.logger.info("Random payload fuzzing is started.")
@@ -82,36 +116,61 @@ class MQTTRandomPayloadFuzzingAttack(Attack):
             length = random.randint(1, self.max_length_of_random_payload)
             self.payload = "".join([chr(random.randint(1, 127)) for _ in range(length)])
 
-        for fuzzing in range(self.turn):
-
-            if self.stopped_flag is True:
-                break
-
-            while True:
-                try:
-                    returned_strings = rdm.get_ascii_decodable_radamsa_malformed_input(self.payload, self.count)
-                    if type(returned_strings) == list:
-                        fuzzer_messages = [string.decode("utf-8") for string in returned_strings]
-                    else:
-                        fuzzer_messages = returned_strings.decode("utf-8")
+        # Test cases are generated ahead by long-lived radamsa workers
+        self.radamsa_pool = rdm.RadamsaWorkerPool(self.payload).start()
+        try:
+            messages_sent = self.metrics.counter(metrics.MESSAGES_SENT, "Published fuzzing messages")
+            bytes_sent = self.metrics.counter(metrics.BYTES_SENT, "Sent payload bytes")
+
+            # Turns are paced by the rate limiter, so time spent on a turn is not added to the interval
+            self.rate_limiter = RateLimiter(ConstantProfile(self.turn_rate))
+            self.rate_limiter.start()
+            for fuzzing in range(self.turn):
+
+                # Wait in short slices so that the stop flag is still checked while the limiter is paused
+                while self.stopped_flag is False and not self.rate_limiter.acquire(max_wait=0.1):
+                    pass
+                if self.stopped_flag is True:
                     break
-                except UnicodeDecodeError:
-                    self.logger.debug("Error occurred while decoding payload in random payload fuzzing.")
-                    continue
-            # Check whether result is list or not
-            if type(fuzzer_messages) == list:
+
+                while True:
+                    try:
+                        returned_strings = self.radamsa_pool.get_ascii_decodable_malformed_input(self.count)
+                        if type(returned_strings) == list:
+                            fuzzer_messages = [string.decode("utf-8") for string in returned_strings]
+                        else:
+                            fuzzer_messages = returned_strings.decode("utf-8")
+                        break
+                    except UnicodeDecodeError:
+                        self.logger.debug("Error occurred while decoding payload in random payload fuzzing.")
+                        continue
+                # Check whether result is list or not
+                if type(fuzzer_messages) != list:
+                    fuzzer_messages = [fuzzer_messages]
                 for message in fuzzer_messages:
-                    self.client.publish(self.topic, message)
+                    case_id = None
+                    if self.journal is not None:
+                        case_id = self.journal.record(message)
+                        if case_id is None:
+                            continue  # Same payload is already sent
+                    if not self.publish(message) and case_id is not None:
+                        self.journal.set_outcome(case_id, OUTCOME_SEND_ERROR)
                     # Increment sent message count
                     self.sent_message_count += 1
-            else:
-                self.client.publish(self.topic, fuzzer_messages)
-                # Increment sent message count
-                self.sent_message_count += 1
-            time.sleep(1)
-            self.logger.info("Turn {0} is completed with message content = {1}".format(fuzzing + 1, fuzzer_messages))
+                    messages_sent.inc()
+                    bytes_sent.inc(len(message))
+                self.logger.info("Turn {0} is completed with message content = {1}".format(fuzzing + 1, fuzzer_messages))
 
+        finally:
+            # Workers serve test cases forever, they must not outlive the attack
+            self.radamsa_pool.stop()
         self.client.loop_stop()
+        if self.journal is not None:
+            self.logger.info("{0} cases are journaled in {1}, {2} duplicate cases are skipped.".format(
+                self.journal.get_case_count(), self.journal.path, self.journal.duplicate_count))
+            self.journal.close()
+            self.journal = None
+        self.metrics.finish()
         self.logger.info("Random payload fuzzing is finished.")
 
 
@@ -129,7 +188,7 @@ class TestMQTTRandomPayloadAttack(unittest.TestCase):
         inputs = self.mqtt_random_payload_fuzzer.get_inputs()
         self.assertIsNotNone(inputs)
         self.assertGreater(len(inputs), 0, "Non inserted inputs")
-        self.assertEquals(len(inputs), 5)
+        self.assertEquals(len(inputs), 6)
 
     def test_non_initialized_inputs(self):
         inputs = self.mqtt_random_payload_fuzzer.get_inputs()
@@ -138,7 +197,7 @@ class TestMQTTRandomPayloadAttack(unittest.TestCase):
             self.assertTrue(value is None or type(value) == _input.get_type())
 
     def test_after_getting_inputs(self):
-        example_inputs = ["a.b.c.d", "pen-topic", 12, 2, "pen-payload"]
+        example_inputs = ["a.b.c.d", "pen-topic", 12, 2, "pen-payload", "peniot-journal.sqlite"]
         for index, _input in enumerate(example_inputs):
             self.mqtt_random_payload_fuzzer.inputs[index].set_value(_input)
 
@@ -165,7 +224,7 @@ class TestMQTTRandomPayloadAttack(unittest.TestCase):
 
     def test_random_payload_fuzzing_attack(self):
         def run_attack():
-            example_inputs = ["127.0.0.1", "peniot/test", 3, 1, "peniot-bbdep"]
+            example_inputs = ["127.0.0.1", "peniot/test", 3, 1, "peniot-bbdep", ""]
             for index, _input in enumerate(example_inputs):
                 self.mqtt_random_payload_fuzzer.inputs[index].set_value(_input)
 
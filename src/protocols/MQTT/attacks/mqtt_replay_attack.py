@@ -6,6 +6,7 @@ import unittest
 import paho.mqtt.client as paho
 
 from protocols.MQTT.mqtt_scanner import MQTTScanner
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils.RandomUtil import random_generated_names
@@ -76,12 +77,15 @@ class MQTTReplayAttack(Attack):
             try:
                 self.client.connect(selected_packet.ip.dst_host)
             except Exception as e:
+                self.metrics.counter(metrics.ERRORS, "Failed connection attempts").inc()
                 self.logger.error("Failed to connect to broker")
 
             self.logger.info(selected_packet)
             self.client.publish(selected_packet.mqtt.topic, selected_packet.mqtt.msg)
+            self.metrics.counter(metrics.MESSAGES_SENT, "Replayed MQTT messages").inc()
         except IndexError as _:
             self.logger.error("Invalid packet index. Indices start from 0...")
+        self.metrics.finish()
 
     def pre_attack_process(self):
         """
@@ -1,9 +1,11 @@
+import collections
 import logging
 import signal
 import time
 import unittest
 
 from protocols.MQTT.mqtt_scanner import MQTTScanner
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils import CommonUtil
@@ -22,6 +24,7 @@ class MQTTSniffAttack(Attack):
 
     # Misc Members
     logger = None
+    sniffer = None
 
     def __init__(self):
         default_parameters = [
@@ -47,6 +50,8 @@ class MQTTSniffAttack(Attack):
 
     def stop_attack(self):
         self.logger.info("Exitting...")
+        if self.sniffer is not None:
+            self.sniffer.stop_live_capture()
         time.sleep(2)  # Sleep two seconds so the user can see the message
         # sys.exit(0)
 
@@ -59,14 +64,31 @@ class MQTTSniffAttack(Attack):
     def run(self):
         self.input_check()  # Do the necessary checks
         super(MQTTSniffAttack, self).run()
-        packets = MQTTScanner().scan(self.timeout, self.interface,
-                                     output_pcap_filename="MQTT_" + CommonUtil.get_current_datetime_for_filename_format() if self.save_output else None)
+        self.sniffer = MQTTScanner.create_sniffer(self.timeout, self.interface,
+                                                  output_pcap_filename="MQTT_" + CommonUtil.get_current_datetime_for_filename_format() if self.save_output else None)
 
-        for packet in packets:
-            self.logger.info(packet)
+        packets = self.report_packets(self.sniffer.iter_live_capture())
+        self.metrics.gauge("packets_dropped", "Packets dropped since they could not be consumed in time").set(
+            self.sniffer.get_dropped_packet_count())
+        self.metrics.finish()
+        self.sniffer = None
 
         return packets
 
+    def report_packets(self, packets):
+        """
+        Report packets as soon as they are captured, only the most recent ones are kept
+        so that memory usage does not grow with capture duration
+        :return: Most recent packets as list
+        """
+        recent_packets = collections.deque(maxlen=generic_sniffer.RECENT_PACKET_COUNT)
+        packets_captured = self.metrics.counter(metrics.PACKETS_CAPTURED, "Captured MQTT packets")
+        for packet in packets:
+            self.logger.info(packet)
+            recent_packets.append(packet)
+            packets_captured.inc()
+        return list(recent_packets)
+
 
 class TestMQTTSniffAttack(unittest.TestCase):
     def setUp(self):
@@ -96,6 +118,13 @@ class TestMQTTSniffAttack(unittest.TestCase):
             value = getattr(self.mqtt_sniff_attack, _input.get_name())
             self.assertEqual(example_inputs[index], value)
 
+    def test_report_packets(self):
+        self.mqtt_sniff_attack.logger = logging.getLogger("test")
+        packet_count = generic_sniffer.RECENT_PACKET_COUNT * 3 + 1
+        packets = self.mqtt_sniff_attack.report_packets(iter(xrange(packet_count)))
+        self.assertEqual(range(packet_count - generic_sniffer.RECENT_PACKET_COUNT, packet_count), packets)
+        self.assertEqual(packet_count, self.mqtt_sniff_attack.get_metrics().get_snapshot()[metrics.PACKETS_CAPTURED])
+
     def test_sniff_attack(self):
         example_inputs = [10.0]
         for index, _input in enumerate(example_inputs):
@@ -6,6 +6,7 @@ import unittest
 
 import paho.mqtt.client as paho
 
+from Entity import metrics
 from Entity.attack import Attack
 from Entity.input_format import InputFormat
 from Utils.RandomUtil import random_generated_names
@@ -61,7 +62,9 @@ class MQTTTopicNameFuzzingAttack(Attack):
         Attack.run(self)
         self.pre_attack_init()
 
+        messages_sent = self.metrics.counter(metrics.MESSAGES_SENT, "Published MQTT messages")
         self.client.publish(self.client2_name + "/status", "topic_name_fuzzing_type_1")
+        messages_sent.inc()
         print "Please check if the attacked client continues working"
 
         er = self.client.subscribe("$SYS/#", 1)
@@ -77,6 +80,8 @@ class MQTTTopicNameFuzzingAttack(Attack):
             "Please check from the broker monitor if 999 is published to $SYS/broker/clients/connected, it will be published in a seconds!")
         time.sleep(2)
         self.client.publish("$SYS/broker/clients/connected", 999)
+        messages_sent.inc()
+        self.metrics.finish()
         self.logger.info("Please check from the broker monitor if 999 is published to $SYS/broker/clients/connected.")
 
 
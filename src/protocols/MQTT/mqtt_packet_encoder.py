@@ -0,0 +1,318 @@
+import struct
+import unittest
+
+# Control packet types in the upper nibble of the fixed header
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PUBREC = 0x50
+PUBREL = 0x60
+PUBCOMP = 0x70
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA0
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+# Packets whose reserved flags must be 0b0010
+RESERVED_FLAGS = 0x02
+
+PROTOCOL_NAME = "MQTT"
+PROTOCOL_LEVEL = 4  # MQTT v3.1.1
+DEFAULT_KEEP_ALIVE = 60
+MAX_REMAINING_LENGTH = 268435455
+
+CLEAN_SESSION_FLAG = 0x02
+WILL_FLAG = 0x04
+WILL_RETAIN_FLAG = 0x20
+PASSWORD_FLAG = 0x40
+USERNAME_FLAG = 0x80
+RETAIN_FLAG = 0x01
+DUP_FLAG = 0x08
+
+
+def encode_remaining_length(length):
+    """
+    Encode remaining length field of MQTT fixed header
+    :param length: Length of variable header and payload
+    :return: Variable length encoded bytes
+    """
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length > 0:
+            byte |= 0x80
+        encoded.append(byte)
+        if length == 0:
+            return encoded
+
+
+def encode_string(_string):
+    """
+    :param _string: String to be prefixed with its two byte length
+    :return: Length prefixed bytes
+    """
+    if isinstance(_string, unicode):
+        _string = _string.encode("utf-8")
+    return bytearray(struct.pack("!H", len(_string))) + bytearray(_string)
+
+
+def encode_packet(command, body=bytearray(), remaining_length=None):
+    """
+    :param command: First byte of the fixed header, i.e. packet type and flags
+    :param body: Variable header and payload
+    :param remaining_length: Remaining length written to the header, actual body length is used if it is not given
+    :return: Encoded control packet
+    """
+    if remaining_length is None:
+        remaining_length = len(body)
+    return bytearray([command & 0xFF]) + encode_remaining_length(remaining_length) + body
+
+
+def encode_connect_packet(client_id, username=None, password=None, keep_alive=DEFAULT_KEEP_ALIVE, clean_session=True,
+                          will_topic=None, will_message=None, will_qos=0, will_retain=False,
+                          protocol_name=PROTOCOL_NAME, protocol_level=PROTOCOL_LEVEL):
+    """
+    :param client_id: Client identifier sent to the broker
+    :param username: Optional user name
+    :param password: Optional password, only used if user name is given
+    :param keep_alive: Keep alive interval in seconds
+    :param will_topic: Topic of the will message, will is only sent if it is given
+    :return: Encoded CONNECT packet
+    """
+    flags = CLEAN_SESSION_FLAG if clean_session else 0
+    payload = encode_string(client_id)
+    if will_topic is not None:
+        flags |= WILL_FLAG | (will_qos & 0x03) << 3 | (WILL_RETAIN_FLAG if will_retain else 0)
+        payload += encode_string(will_topic) + encode_string(will_message or "")
+    if username:
+        flags |= USERNAME_FLAG
+        payload += encode_string(username)
+        if password:
+            flags |= PASSWORD_FLAG
+            payload += encode_string(password)
+    variable_header = encode_string(protocol_name) + bytearray(struct.pack("!BBH", protocol_level, flags, keep_alive))
+    return encode_packet(CONNECT, variable_header + payload)
+
+
+def encode_connack_packet(return_code=0, session_present=False):
+    return encode_packet(CONNACK, bytearray([1 if session_present else 0, return_code]))
+
+
+def encode_publish_header(topic, payload_length, retain=False, qos=0, packet_id=None, dup=False):
+    """
+    Encode fixed header and variable header of a PUBLISH packet, so that payload can be streamed right after it
+    :param payload_length: Length of the payload which will follow the header
+    :param packet_id: Packet identifier, only written for QoS 1 and 2
+    :return: Encoded PUBLISH packet without its payload
+    """
+    variable_header = encode_string(topic)
+    if qos > 0:
+        variable_header += bytearray(struct.pack("!H", packet_id or 1))
+    command = PUBLISH | (DUP_FLAG if dup else 0) | (qos & 0x03) << 1 | (RETAIN_FLAG if retain else 0)
+    return bytearray([command]) + encode_remaining_length(len(variable_header) + payload_length) + variable_header
+
+
+def encode_publish_packet(topic, message, retain=False, qos=0, packet_id=None, dup=False):
+    """
+    :param topic: Topic name
+    :param message: Application message
+    :param retain: Retain flag of the message
+    :return: Encoded PUBLISH packet
+    """
+    if isinstance(message, unicode):
+        message = message.encode("utf-8")
+    return encode_publish_header(topic, len(message), retain, qos, packet_id, dup) + bytearray(message)
+
+
+def encode_packet_id_packet(command, packet_id):
+    """
+    Encode packets which only carry a packet identifier, i.e. PUBACK, PUBREC, PUBREL, PUBCOMP and UNSUBACK
+    """
+    return encode_packet(command, bytearray(struct.pack("!H", packet_id)))
+
+
+def encode_puback_packet(packet_id):
+    return encode_packet_id_packet(PUBACK, packet_id)
+
+
+def encode_pubrec_packet(packet_id):
+    return encode_packet_id_packet(PUBREC, packet_id)
+
+
+def encode_pubrel_packet(packet_id):
+    return encode_packet_id_packet(PUBREL | RESERVED_FLAGS, packet_id)
+
+
+def encode_pubcomp_packet(packet_id):
+    return encode_packet_id_packet(PUBCOMP, packet_id)
+
+
+def encode_subscribe_packet(packet_id, topics):
+    """
+    :param topics: List of topic and requested QoS tuples
+    """
+    body = bytearray(struct.pack("!H", packet_id))
+    for topic, qos in topics:
+        body += encode_string(topic)
+        body.append(qos)
+    return encode_packet(SUBSCRIBE | RESERVED_FLAGS, body)
+
+
+def encode_suback_packet(packet_id, return_codes):
+    return encode_packet(SUBACK, bytearray(struct.pack("!H", packet_id)) + bytearray(return_codes))
+
+
+def encode_unsubscribe_packet(packet_id, topics):
+    """
+    :param topics: List of topic filters
+    """
+    body = bytearray(struct.pack("!H", packet_id))
+    for topic in topics:
+        body += encode_string(topic)
+    return encode_packet(UNSUBSCRIBE | RESERVED_FLAGS, body)
+
+
+def encode_unsuback_packet(packet_id):
+    return encode_packet_id_packet(UNSUBACK, packet_id)
+
+
+def encode_pingreq_packet():
+    return encode_packet(PINGREQ)
+
+
+def encode_pingresp_packet():
+    return encode_packet(PINGRESP)
+
+
+def encode_disconnect_packet():
+    return encode_packet(DISCONNECT)
+
+
+def encode_mutated_subscription_packet(message_type, packet_id, topics, dup=False, optional_remaining_length=2,
+                                       command_dup_shift_times=3, command_base_xor_part=RESERVED_FLAGS):
+    """
+    Encode a SUBSCRIBE or UNSUBSCRIBE packet whose header fields are derived from the given mutation parameters
+    :param message_type: Either SUBSCRIBE or UNSUBSCRIBE
+    :param topics: Topic and QoS tuples for SUBSCRIBE, topic filters for UNSUBSCRIBE
+    :param optional_remaining_length: Length assumed for the packet identifier and each length prefix while
+                                      calculating remaining length, 2 gives the correct length for UNSUBSCRIBE
+    :param command_dup_shift_times: Position of the duplicate flag in the first byte
+    :param command_base_xor_part: Flags which are combined with the packet type, normally 0x2
+    :return: Encoded and possibly malformed packet
+    """
+    remaining_length = optional_remaining_length
+    for topic in topics:
+        remaining_length += optional_remaining_length + len(topic)
+
+    command = message_type | (dup << command_dup_shift_times) | command_base_xor_part
+    body = bytearray(struct.pack("!H", packet_id))
+    if message_type == SUBSCRIBE:
+        for topic, qos in topics:
+            body += encode_string(topic)
+            body.append(qos)
+    else:
+        for topic in topics:
+            body += encode_string(topic)
+    return encode_packet(command, body, remaining_length)
+
+
+class MQTTPacketBatch(object):
+    """
+    Frames encoded back to back into a single buffer, so a whole batch is written to a socket with one call
+    Packet identifiers are assigned from a running counter which wraps around like the ones of regular clients.
+    """
+
+    def __init__(self, first_packet_id=1):
+        self.buffer = bytearray()
+        self.frame_offsets = []
+        self.next_packet_id = first_packet_id
+
+    def generate_packet_id(self):
+        packet_id = self.next_packet_id
+        self.next_packet_id = self.next_packet_id % 65535 + 1
+        return packet_id
+
+    def append(self, frame):
+        self.frame_offsets.append(len(self.buffer))
+        self.buffer += frame
+        return self
+
+    def extend_mutated_subscriptions(self, test_cases):
+        """
+        :param test_cases: Keyword arguments of encode_mutated_subscription_packet except the packet identifier
+        """
+        for test_case in test_cases:
+            self.append(encode_mutated_subscription_packet(packet_id=self.generate_packet_id(), **test_case))
+        return self
+
+    def get_frame(self, index):
+        end = self.frame_offsets[index + 1] if index + 1 < len(self.frame_offsets) else len(self.buffer)
+        return memoryview(self.buffer)[self.frame_offsets[index]:end]
+
+    def __len__(self):
+        return len(self.frame_offsets)
+
+    def get_bytes(self):
+        return bytes(self.buffer)
+
+
+class TestMQTTPacketEncoder(unittest.TestCase):
+    def test_remaining_length(self):
+        self.assertEqual(bytearray([0x00]), encode_remaining_length(0))
+        self.assertEqual(bytearray([0x7F]), encode_remaining_length(127))
+        self.assertEqual(bytearray([0x80, 0x01]), encode_remaining_length(128))
+        self.assertEqual(bytearray([0xFF, 0xFF, 0xFF, 0x7F]), encode_remaining_length(MAX_REMAINING_LENGTH))
+
+    def test_publish_packet(self):
+        packet = encode_publish_packet("a/b", "xyz")
+        self.assertEqual(bytearray([0x30, 8, 0, 3]) + bytearray("a/bxyz"), packet)
+        self.assertEqual(0x31, encode_publish_packet("a/b", "xyz", retain=True)[0])
+        self.assertEqual(bytearray([0x30, 0x80, 0x01, 0, 3]) + bytearray("a/b"), encode_publish_header("a/b", 123))
+        self.assertEqual(bytearray([0x3B, 10, 0, 3]) + bytearray("a/b") + bytearray([0, 7]) + bytearray("xyz"),
+                         encode_publish_packet("a/b", "xyz", qos=1, packet_id=7, dup=True, retain=True))
+
+    def test_connect_packet(self):
+        packet = encode_connect_packet("peniot", "user", "pass")
+        self.assertEqual(CONNECT, packet[0])
+        self.assertEqual(len(packet) - 2, packet[1])
+        self.assertEqual(CLEAN_SESSION_FLAG | USERNAME_FLAG | PASSWORD_FLAG, packet[9])
+        packet = encode_connect_packet("peniot", will_topic="will", will_message="bye", will_qos=1, will_retain=True)
+        self.assertEqual(CLEAN_SESSION_FLAG | WILL_FLAG | 0x08 | WILL_RETAIN_FLAG, packet[9])
+
+    def test_control_packets(self):
+        self.assertEqual(bytearray([0x20, 2, 0, 5]), encode_connack_packet(5))
+        self.assertEqual(bytearray([0x40, 2, 0x12, 0x34]), encode_puback_packet(0x1234))
+        self.assertEqual(bytearray([0x62, 2, 0, 1]), encode_pubrel_packet(1))
+        self.assertEqual(bytearray([0x82, 8, 0, 1, 0, 3]) + bytearray("a/b") + bytearray([1]),
+                         encode_subscribe_packet(1, [("a/b", 1)]))
+        self.assertEqual(bytearray([0x90, 4, 0, 1, 0, 0x80]), encode_suback_packet(1, [0, 0x80]))
+        self.assertEqual(bytearray([0xA2, 7, 0, 1, 0, 3]) + bytearray("a/b"), encode_unsubscribe_packet(1, ["a/b"]))
+        self.assertEqual(bytearray([0xC0, 0]), encode_pingreq_packet())
+        self.assertEqual(bytearray([0xD0, 0]), encode_pingresp_packet())
+        self.assertEqual(bytearray([0xE0, 0]), encode_disconnect_packet())
+
+    def test_mutated_subscription_packet(self):
+        # Default mutation parameters give well formed UNSUBSCRIBE packets
+        self.assertEqual(encode_unsubscribe_packet(1, ["a/b"]),
+                         encode_mutated_subscription_packet(UNSUBSCRIBE, 1, ["a/b"]))
+        packet = encode_mutated_subscription_packet(SUBSCRIBE, 1, [("a/b", 1)], dup=True, command_dup_shift_times=5,
+                                                    command_base_xor_part=0x5)
+        self.assertEqual(SUBSCRIBE | 0x20 | 0x5, packet[0])
+
+    def test_batch(self):
+        batch = MQTTPacketBatch(first_packet_id=65535)
+        batch.extend_mutated_subscriptions([dict(message_type=UNSUBSCRIBE, topics=["a/b"]),
+                                            dict(message_type=UNSUBSCRIBE, topics=["c"])])
+        self.assertEqual(2, len(batch))
+        self.assertEqual(bytes(encode_unsubscribe_packet(65535, ["a/b"])), batch.get_frame(0).tobytes())
+        self.assertEqual(bytes(encode_unsubscribe_packet(1, ["c"])), batch.get_frame(1).tobytes())
+        self.assertEqual(batch.get_frame(0).tobytes() + batch.get_frame(1).tobytes(), batch.get_bytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,17 +21,48 @@ class MQTTScanner:
     def __init__(self):
         pass
 
+    @staticmethod
+    def create_sniffer(timeout=generic_sniffer.DEFAULT_SNIFF_TIMEOUT, interface=generic_sniffer.DEFAULT_INTERFACE,
+                       use_json_and_include_raw=False, output_pcap_filename=None,
+                       queue_size=generic_sniffer.DEFAULT_QUEUE_SIZE, capture_backend=generic_sniffer.PYSHARK_BACKEND,
+                       filter_list=None):
+        """
+        :param capture_backend: Raw socket backend skips tshark and decodes packets on the protocol port itself
+        :param filter_list: Optional field filters which packets have to pass in addition to protocol filter
+        :return: Sniffer which is configured for MQTT packets, use its iter_live_capture to stream them
+        """
+        return generic_sniffer.GenericSniffer(timeout=timeout, interface=interface,
+                                              use_json=use_json_and_include_raw,
+                                              include_raw=use_json_and_include_raw,
+                                              output_pcap_filename=output_pcap_filename,
+                                              display_filter=mqtt_layer_filter, queue_size=queue_size,
+                                              capture_backend=capture_backend, filter_list=filter_list,
+                                              tcp_ports=[mqtt_port])
+
     @staticmethod
     def scan(timeout=generic_sniffer.DEFAULT_SNIFF_TIMEOUT, interface=generic_sniffer.DEFAULT_INTERFACE,
-             use_json_and_include_raw=False, output_pcap_filename=None):
-        sniffer = generic_sniffer.GenericSniffer(timeout=timeout, interface=interface,
-                                                 use_json=use_json_and_include_raw,
-                                                 include_raw=use_json_and_include_raw,
-                                                 output_pcap_filename=output_pcap_filename,
-                                                 display_filter=mqtt_layer_filter)
+             use_json_and_include_raw=False, output_pcap_filename=None,
+             capture_backend=generic_sniffer.PYSHARK_BACKEND):
+        sniffer = MQTTScanner.create_sniffer(timeout, interface, use_json_and_include_raw, output_pcap_filename,
+                                             capture_backend=capture_backend)
         sniffer.start_live_capture()
         return sniffer.get_captured_packets()
 
+    @staticmethod
+    def scan_file(input_filename, use_json_and_include_raw=False,
+                  packets_per_chunk=generic_sniffer.DEFAULT_PACKETS_PER_CHUNK, worker_count=None, filter_list=None):
+        """
+        Offline scan of a saved capture file which is dissected in parallel chunks
+        :param input_filename: Absolute path or name of a file under captured packets directory
+        :param filter_list: Optional field filters which packets have to pass
+        :type filter_list: list of pyshark_filter_util.PySharkFilter
+        :return: MQTT packets in timestamp order
+        """
+        sniffer = MQTTScanner.create_sniffer(use_json_and_include_raw=use_json_and_include_raw,
+                                             filter_list=filter_list)
+        sniffer.start_offline_capture(input_filename, packets_per_chunk, worker_count)
+        return sniffer.get_captured_packets()
+
     @staticmethod
     def get_raw_tcp_payload_as_bytes(packet):
         return (packet.mqtt_raw.value[0]).decode("hex")